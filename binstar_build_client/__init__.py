@@ -9,13 +9,14 @@ import warnings
 
 from binstar_build_client.mixins.build import BuildMixin
 from binstar_build_client.mixins.build_queue import BuildQueueMixin
+from binstar_build_client.mixins.transport import TransportMixin
 import logging
 from binstar_client import Binstar
 
 log = logging.getLogger('binstar.build')
 
 
-class BinstarBuildAPI(BuildMixin, BuildQueueMixin, Binstar):
+class BinstarBuildAPI(TransportMixin, BuildMixin, BuildQueueMixin, Binstar):
     '''
     '''
     pass
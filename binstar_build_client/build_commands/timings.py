@@ -0,0 +1,92 @@
+'''
+Show where the build time of a package goes
+
+Aggregate the step durations recorded by the build workers over the
+build history of a package:
+
+    anaconda build timings orgname/packagename
+
+'''
+
+from __future__ import (print_function, unicode_literals, division,
+    absolute_import)
+
+import argparse
+import logging
+
+from binstar_client.utils import get_binstar
+from binstar_client.utils import package_specs
+from binstar_build_client import BinstarBuildAPI
+
+log = logging.getLogger('binstar.build')
+
+
+def aggregate_timings(builds):
+    '''
+    Aggregate the step timings of all the build items in `builds`
+
+    Returns:
+        (list) of dicts with the keys `section`, `command`, `count`, `total`,
+        `mean` and `max`, slowest total first
+    '''
+    steps = {}
+    for build in builds:
+        for item in build.get('items', []):
+            for step in item.get('timings') or []:
+                key = (step.get('section'), step.get('command'))
+                agg = steps.setdefault(key, {'section': key[0], 'command': key[1],
+                                             'count': 0, 'total': 0.0, 'max': 0.0})
+                duration = step.get('duration') or 0.0
+                agg['count'] += 1
+                agg['total'] += duration
+                agg['max'] = max(agg['max'], duration)
+
+    for agg in steps.values():
+        agg['mean'] = agg['total'] / agg['count']
+
+    return sorted(steps.values(), key=lambda agg: agg['total'], reverse=True)
+
+
+def show_timings(args):
+
+    binstar = get_binstar(args, cls=BinstarBuildAPI)
+
+    builds = binstar.builds(args.package.user, args.package.name)
+    rows = aggregate_timings(builds)
+
+    if not rows:
+        log.info('No step timings have been recorded for %s/%s',
+                 args.package.user, args.package.name)
+        return
+
+    fmt = '%(total)10s | %(mean)10s | %(max)10s | %(count)6s | %(section)-22s | %(command)s'
+    header = {'total': 'Total', 'mean': 'Mean', 'max': 'Max', 'count': 'Runs',
+              'section': 'Section', 'command': 'Command'}
+    log.info(fmt % header)
+    log.info(fmt.replace('|', '+') % dict.fromkeys(header, '-' * 10))
+
+    for row in rows[:args.n]:
+        row = dict(row)
+        for key in ('total', 'mean', 'max'):
+            row[key] = '%.1fs' % row[key]
+        command = row['command'] or '[%s]' % row['section']
+        row['command'] = command.strip().split('\n')[0]
+        log.info(fmt % row)
+
+
+def add_parser(subparsers):
+
+    parser = subparsers.add_parser('timings',
+                                      help='Show the slowest build steps of a package',
+                                      description=__doc__,
+                                      formatter_class=argparse.RawDescriptionHelpFormatter,
+                                      )
+
+    parser.add_argument('package', metavar='OWNER/PACKAGE',
+                       help='show the build timings of the package OWNER/PACKAGE',
+                       type=package_specs)
+
+    parser.add_argument('-n', metavar='#', type=int, default=20,
+                       help='Number of steps to show (default: %(default)s)')
+
+    parser.set_defaults(main=show_timings)
@@ -10,7 +10,6 @@ from __future__ import (print_function, unicode_literals, division,
 from binstar_client.utils import jencode, compute_hash
 from binstar_build_client.utils import get_anaconda_url
 from binstar_client.requests_ext import stream_multipart
-import requests
 from binstar_client.errors import BinstarError
 
 class BuildMixin(object):
@@ -55,7 +54,7 @@ class BuildMixin(object):
         data_stream, headers = stream_multipart(s3data, files={'file':(obj['basename'], fd)},
                                                 callback=callback)
 
-        s3res = requests.post(s3url, data=data_stream, verify=True, timeout=10 * 60 * 60, headers=headers)
+        s3res = self.storage_session.post(s3url, data=data_stream, verify=True, headers=headers)
 
         if s3res.status_code != 201:
             raise BinstarError('Error uploading build', s3res.status_code)
@@ -1,7 +1,8 @@
+import gzip
+import io
+import json
 import logging
 
-import requests
-
 from binstar_client import errors
 from binstar_client.utils import jencode
 import binstar_client
@@ -10,6 +11,20 @@ from binstar_build_client.utils.worker_stats import worker_stats
 
 log = logging.getLogger('binstar.build')
 
+
+def text_msg(msg):
+    if isinstance(msg, bytes):
+        return msg.decode('utf-8', 'replace')
+    return msg
+
+
+def gzip_compress(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as fd:
+        fd.write(data)
+    return buf.getvalue()
+
+
 class BuildQueueMixin(object):
 
     def register_worker(self, username, queue_name, platform, hostname, dist, name):
@@ -98,9 +113,78 @@ class BuildQueueMixin(object):
 
         return result
 
-    def finish_build(self, username, queue_name, worker_id, job_id, status='success', failed=False):
+    def log_build_output_batch(self, username, queue_name, worker_id, job_id, chunks):
+        '''Send many log chunks in one gzip compressed request to the
+        /tagged-log-batch endpoint, or fallback to one structured log request
+        per chunk
+
+        :param chunks: a list of dicts with the keys `seq` (the number of the
+                       chunk in the build log), `msg` and the metadata of the chunk;
+                       with the fallback, the chunks sent are removed from it
+        '''
+        if getattr(self, 'log_build_output_batch_failed', False):
+            return self._log_build_output_chunks(username, queue_name, worker_id,
+                                                 job_id, chunks)
+        url = '%s/build-worker/%s/%s/%s/jobs/%s/tagged-log-batch' % (self.domain, username, queue_name, worker_id, job_id)
+        content = [dict(chunk, msg=text_msg(chunk['msg'])) for chunk in chunks]
+        data = gzip_compress(json.dumps({'chunks': content}).encode('utf-8'))
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        res = self.session.post(url, data=data, headers=headers)
+        try:
+            self._check_response(res, [201, 200])
+        except errors.NotFound:
+            if hasattr(self, 'log_build_output_batch_failed'):
+                # The batch endpoint worked before, the job is not found
+                raise
+
+            log.info('Will not attempt batched logging, falling back to one '
+                     'request per log chunk. There is no Repository endpoint %s',
+                     url, exc_info=True)
+            self.log_build_output_batch_failed = True
+            return self._log_build_output_chunks(username, queue_name, worker_id,
+                                                 job_id, chunks)
+        else:
+            self.log_build_output_batch_failed = False
+
+        try:
+            result = res.json().get('terminate_build', False)
+        except ValueError:
+            result = False
+
+        return result
+
+    def _log_build_output_chunks(self, username, queue_name, worker_id, job_id, chunks):
+        '''Send the chunks one structured log request at a time
+
+        The /tagged-log endpoint has no sequence numbers to drop the chunks
+        it already has, so the chunks sent are removed from `chunks`, even
+        when a later request fails
+        '''
+        result = False
+        sent = 0
+        try:
+            for chunk in chunks:
+                metadata = dict((key, value) for key, value in chunk.items()
+                                if key not in ('msg', 'seq'))
+                result = self.log_build_output_structured(username, queue_name, worker_id, job_id,
+                                                          chunk['msg'], metadata) or result
+                sent += 1
+        finally:
+            del chunks[:sent]
+        return result
+
+    def finish_build(self, username, queue_name, worker_id, job_id, status='success', failed=False,
+                     timings=None):
+        '''Mark a job as finished
+
+        :param timings: optional list of the durations of the build steps
+                        as recorded by the worker's build log
+        '''
         url = '%s/build-worker/%s/%s/%s/jobs/%s/finish' % (self.domain, username, queue_name, worker_id, job_id)
-        data, headers = jencode(status=status, failed=failed)
+        content = dict(status=status, failed=failed)
+        if timings is not None:
+            content['timings'] = timings
+        data, headers = jencode(content)
         res = self.session.post(url, data=data, headers=headers)
         self._check_response(res, [200])
         return res.json()
@@ -121,7 +205,7 @@ class BuildQueueMixin(object):
         if res.status_code == 304:
             return None
         elif res.status_code == 302:
-            res = requests.get(res.headers['location'], stream=True, verify=True)
+            res = self.storage_session.get(res.headers['location'], stream=True, verify=True)
 
         return res.raw
 
@@ -167,9 +251,12 @@ class BuildQueueMixin(object):
         self._check_response(res, [200])
         return res.json().get('jobs', [])
 
-    def upload_worker_stats(self, username, queue_name, worker_id):
+    def upload_worker_stats(self, username, queue_name, worker_id, stats=None):
+        '''Upload the worker stats, collected now if `stats` is None'''
         url = '%s/build-worker/%s/%s/%s/worker-stats' % (self.domain, username, queue_name, worker_id)
-        data, headers = jencode(worker_stats=worker_stats())
+        if stats is None:
+            stats = worker_stats()
+        data, headers = jencode(worker_stats=stats)
         res = self.session.post(url, data=data, headers=headers)
         self._check_response(res, [201])
         return res.json()
@@ -0,0 +1,209 @@
+'''
+The HTTP transport of the build API
+
+Every request to the API server goes through `self.session`, and every
+request to the storage (the presigned upload and download urls of the build
+sources) through `self.storage_session`, which never sends the API token.
+Both sessions mount a `TransportAdapter`, which:
+
+ * keeps up to `pool_size` connections per host alive, enough for the
+   requests of all the build slots of a worker to reuse a connection
+ * retries the requests that failed to connect, and the idempotent requests
+   (GET, HEAD, OPTIONS, PUT, DELETE) that failed or got a 502, 503 or 504
+   response, with an exponential backoff
+ * applies the connect and read timeouts of the endpoint when the caller
+   gives none
+ * records the latency, the status and the bytes of each request by
+   endpoint in the worker metrics
+'''
+from __future__ import (print_function, unicode_literals, division,
+    absolute_import)
+
+import logging
+import re
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+from binstar_build_client.worker.utils import metrics
+
+log = logging.getLogger('binstar.build')
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUS = (502, 503, 504)
+
+STORAGE = 'storage'
+OTHER = 'other'
+
+CONNECT_TIMEOUT = 10
+
+# The endpoints of the build API, the most specific first, with their
+# (connect, read) timeouts in seconds
+ENDPOINTS = [
+    ('/build-worker/{user}/{queue}', (CONNECT_TIMEOUT, 60)),
+    ('/build-worker/{user}/{queue}/{worker}', (CONNECT_TIMEOUT, 60)),
+    ('/build-worker/{user}/{queue}/{worker}/jobs', (CONNECT_TIMEOUT, 60)),
+    ('/build-worker/{user}/{queue}/{worker}/jobs/{job}/log', (CONNECT_TIMEOUT, 30)),
+    ('/build-worker/{user}/{queue}/{worker}/jobs/{job}/tagged-log', (CONNECT_TIMEOUT, 30)),
+    ('/build-worker/{user}/{queue}/{worker}/jobs/{job}/tagged-log-batch', (CONNECT_TIMEOUT, 60)),
+    ('/build-worker/{user}/{queue}/{worker}/jobs/{job}/finish', (CONNECT_TIMEOUT, 120)),
+    ('/build-worker/{user}/{queue}/{worker}/jobs/{job}/push', (CONNECT_TIMEOUT, 60)),
+    ('/build-worker/{user}/{queue}/{worker}/jobs/{job}/build-source', (CONNECT_TIMEOUT, 120)),
+    ('/build-worker/{user}/{queue}/{worker}/worker-stats', (CONNECT_TIMEOUT, 60)),
+    ('/build-queues', (CONNECT_TIMEOUT, 60)),
+    ('/build-queues/{user}', (CONNECT_TIMEOUT, 60)),
+    ('/build-queues/{user}/{queue}', (CONNECT_TIMEOUT, 60)),
+    ('/build-queues/{user}/{queue}/jobs', (CONNECT_TIMEOUT, 60)),
+    ('/build/{user}/{package}/keyfile', (CONNECT_TIMEOUT, 60)),
+    ('/build/{user}/{package}/keyfiles', (CONNECT_TIMEOUT, 60)),
+    ('/build/{user}/{package}/stage', (CONNECT_TIMEOUT, 120)),
+    ('/build/{user}/{package}/commit/{build}', (CONNECT_TIMEOUT, 120)),
+    ('/build/{user}/{package}/submit-git-url', (CONNECT_TIMEOUT, 120)),
+    ('/build/{user}/{package}/stop/{build}', (CONNECT_TIMEOUT, 60)),
+    ('/build/{user}/{package}/tail/{build}', (CONNECT_TIMEOUT, 60)),
+    ('/build/{user}/{package}/resubmit/{build}', (CONNECT_TIMEOUT, 60)),
+    ('/build/{user}/{package}/ci', (CONNECT_TIMEOUT, 60)),
+    ('/build/{user}/{package}/trigger', (CONNECT_TIMEOUT, 120)),
+    ('/build/{user}/{package}/results/{major}/{minor}/{action}', (CONNECT_TIMEOUT, 300)),
+    ('/build/{user}/{package}/{build}', (CONNECT_TIMEOUT, 60)),
+    ('/build/{user}/{package}', (CONNECT_TIMEOUT, 60)),
+]
+
+# The requests to the storage upload and download build sources, which may
+# be large and slow
+STORAGE_TIMEOUT = (CONNECT_TIMEOUT, 10 * 60 * 60)
+
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, 60)
+
+
+def compile_endpoints(endpoints):
+    compiled = []
+    for template, timeout in endpoints:
+        pattern = re.sub(r'\\\{\w+\\\}', '[^/]+', re.escape(template))
+        compiled.append((re.compile('^' + pattern + '/?$'), template, timeout))
+    return compiled
+
+
+_ENDPOINTS = compile_endpoints(ENDPOINTS)
+
+
+def endpoint(path):
+    '''
+    The endpoint template of the url path of an API request, and its timeout
+    '''
+    for pattern, template, timeout in _ENDPOINTS:
+        if pattern.match(path):
+            return template, timeout
+    return OTHER, DEFAULT_TIMEOUT
+
+
+def body_size(request):
+    body = request.body
+    if isinstance(body, (bytes, type(''))):
+        return len(body)
+    return int(request.headers.get('Content-Length') or 0)
+
+
+def make_retry(retries, backoff):
+    '''
+    Retry failed connections of any request, and failed reads and error
+    responses of the idempotent requests only
+    '''
+    options = dict(total=retries, connect=retries, read=retries, status=retries,
+                   redirect=False, backoff_factor=backoff, status_forcelist=RETRY_STATUS,
+                   raise_on_status=False)
+    try:
+        return Retry(allowed_methods=IDEMPOTENT_METHODS, **options)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=IDEMPOTENT_METHODS, **options)
+
+
+class TransportAdapter(HTTPAdapter):
+    '''
+    A pooled, retrying HTTP adapter which applies the endpoint timeouts and
+    records the requests in the worker metrics
+
+    :param base_url: the url of the API server, None for the storage
+    '''
+    def __init__(self, base_url=None, pool_size=DEFAULT_POOL_SIZE,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.base_path = urlsplit(base_url).path.rstrip('/') if base_url else None
+        HTTPAdapter.__init__(self, pool_connections=pool_size, pool_maxsize=pool_size,
+                             max_retries=make_retry(retries, backoff))
+
+    def endpoint(self, url):
+        if self.base_path is None:
+            return STORAGE, STORAGE_TIMEOUT
+        path = urlsplit(url).path
+        if path.startswith(self.base_path):
+            path = path[len(self.base_path):]
+        return endpoint(path)
+
+    def send(self, request, timeout=None, **kwargs):
+        name, endpoint_timeout = self.endpoint(request.url)
+        if timeout is None:
+            timeout = endpoint_timeout
+
+        start = time.time()
+        try:
+            response = HTTPAdapter.send(self, request, timeout=timeout, **kwargs)
+        except requests.RequestException:
+            self.record(name, request, None, time.time() - start)
+            raise
+        self.record(name, request, response, time.time() - start)
+        return response
+
+    def record(self, name, request, response, seconds):
+        metrics.HTTP_REQUEST_DURATION.observe(seconds, endpoint=name, method=request.method)
+        code = str(response.status_code) if response is not None else 'error'
+        metrics.HTTP_REQUESTS.inc(endpoint=name, method=request.method, code=code)
+        metrics.HTTP_SENT_BYTES.inc(body_size(request), endpoint=name)
+        if response is not None:
+            received = int(response.headers.get('Content-Length') or 0)
+            metrics.HTTP_RECEIVED_BYTES.inc(received, endpoint=name)
+
+
+class TransportMixin(object):
+    '''
+    Mount a `TransportAdapter` on the API session and on a storage session
+    '''
+    def __init__(self, *args, **kwargs):
+        super(TransportMixin, self).__init__(*args, **kwargs)
+        self.transport_options = dict(pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES,
+                                      backoff=DEFAULT_BACKOFF)
+        self.storage_session = requests.Session()
+        self.storage_session.verify = self.session.verify
+        self.configure_transport()
+
+    def configure_transport(self, pool_size=None, retries=None, backoff=None):
+        '''
+        Mount new adapters on the sessions, the options not given keep their
+        current value
+
+        :param pool_size: the connections kept alive per host
+        :param retries: the attempts after the first one of a failed request
+        :param backoff: the backoff factor between the attempts, in seconds
+        '''
+        options = dict(pool_size=pool_size, retries=retries, backoff=backoff)
+        self.transport_options.update((key, value) for key, value in options.items()
+                                      if value is not None)
+
+        adapter = TransportAdapter(self.domain, **self.transport_options)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        storage_adapter = TransportAdapter(None, **self.transport_options)
+        self.storage_session.mount('http://', storage_adapter)
+        self.storage_session.mount('https://', storage_adapter)
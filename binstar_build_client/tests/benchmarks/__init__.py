@@ -0,0 +1,7 @@
+'''
+Performance benchmarks
+
+These are not run by the test suite, run them as modules, e.g.:
+
+    python -m binstar_build_client.tests.benchmarks.render_build_script
+'''
@@ -0,0 +1,91 @@
+'''
+Micro-benchmark of reading a docker attach stream through GeneratorFile
+
+Reads a multi-MB stream of large chunks through small buffers, directly
+and through the line reader of the build log, and compares with the
+previous implementation that sliced the pending chunk on every read
+
+    python -m binstar_build_client.tests.benchmarks.generator_file --size 64
+'''
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import argparse
+import io
+import timeit
+
+from binstar_build_client.worker.utils.build_log import wrap_file
+from binstar_build_client.worker.utils.generator_file import GeneratorFile
+
+MB = 1024 * 1024
+
+
+class SlicingGeneratorFile(io.RawIOBase):
+    '''
+    The previous implementation, copies the rest of the chunk on every read
+    '''
+    def __init__(self, generator):
+        self.generator = generator
+        self.buffer = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.buffer:
+            data, self.buffer = self.buffer, None
+        else:
+            data = next(self.generator, b'')
+
+        n = len(data)
+        if n > len(b):
+            n = len(b)
+            data, self.buffer = data[:n], data[n:]
+        b[:n] = data
+        return n
+
+
+def stream(size, chunk_size):
+    line = b'x' * 79 + b'\n'
+    chunk = line * (chunk_size // len(line))
+    for _ in range(size // len(chunk)):
+        yield chunk
+
+
+def read_raw(cls, size, chunk_size, buffer_size):
+    fd = cls(stream(size, chunk_size))
+    buf = bytearray(buffer_size)
+    while fd.readinto(buf):
+        pass
+
+
+def read_lines(cls, size, chunk_size):
+    fd = wrap_file(cls(stream(size, chunk_size)))
+    while fd.readline():
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=32,
+                        help='MB to read per run (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=4 * MB,
+                        help='Bytes per chunk of the stream (default: %(default)s)')
+    parser.add_argument('--buffer-size', type=int, default=8192,
+                        help='Bytes per readinto call (default: %(default)s)')
+    parser.add_argument('-n', '--number', type=int, default=3,
+                        help='Number of runs (default: %(default)s)')
+    args = parser.parse_args()
+
+    size = args.size * MB
+    for name, func in [
+            ('readinto', lambda cls: read_raw(cls, size, args.chunk_size, args.buffer_size)),
+            ('readline', lambda cls: read_lines(cls, size, args.chunk_size)),
+            ]:
+        new = min(timeit.repeat(lambda: func(GeneratorFile), number=1, repeat=args.number))
+        old = min(timeit.repeat(lambda: func(SlicingGeneratorFile), number=1, repeat=args.number))
+        print('{0:10} memoryview: {1:8.1f} MB/s   slicing: {2:8.1f} MB/s   speedup: {3:5.1f}x'.format(
+            name, args.size / new, args.size / old, old / new))
+
+
+if __name__ == '__main__':
+    main()
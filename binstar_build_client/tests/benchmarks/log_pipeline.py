@@ -0,0 +1,228 @@
+'''
+Micro-benchmark of the build log pipeline of the worker
+
+Streams the output of synthetic build scripts through `read_with_timeout`
+into a `BuildLog`, whose server is a fake API answering after a latency:
+
+ * short: many short lines
+ * long: very long lines
+ * progress: `\\r` progress bars, with a line break every 100 updates
+ * metadata: a metadata marker every other line
+ * invalid: lines with invalid UTF-8
+
+and reports the MB/s and lines/s of output, the CPU seconds per MB, the
+requests to the server and the peak memory allocated by the pipeline
+
+    python -m binstar_build_client.tests.benchmarks.log_pipeline --size 8 --latency 0.001
+    python -m binstar_build_client.tests.benchmarks.log_pipeline --batch --quiet
+'''
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import argparse
+import collections
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+from binstar_build_client.worker.utils.build_log import BuildLog, encode_metadata
+from binstar_build_client.worker.utils.generator_file import GeneratorFile
+from binstar_build_client.worker.utils.timeout import read_with_timeout
+
+MB = 1024 * 1024
+
+try:
+    process_time = time.process_time
+except AttributeError:  # Python 2
+    process_time = time.clock
+
+
+def short_lines(size):
+    line = 0
+    while size > 0:
+        data = 'compiling src/module_{0}.c\n'.format(line).encode('utf-8')
+        size -= len(data)
+        line += 1
+        yield data
+
+
+def long_lines(size):
+    data = b'x' * (256 * 1024 - 1) + b'\n'
+    for _ in range(max(1, size // len(data))):
+        yield data
+
+
+def progress(size):
+    update = 0
+    while size > 0:
+        data = '\r[{0:<50}] {1:3}%'.format('#' * (update % 100 // 2), update % 100).encode('utf-8')
+        if update % 100 == 99:
+            data += b'\n'
+        size -= len(data)
+        update += 1
+        yield data
+
+
+def metadata(size):
+    line = 0
+    while size > 0:
+        if line % 2:
+            data = encode_metadata({'section': 'script', 'command': 'make target_{0}'.format(line)}) + b'\n'
+        else:
+            data = 'building target_{0}\n'.format(line).encode('utf-8')
+        size -= len(data)
+        line += 1
+        yield data
+
+
+def invalid(size):
+    line = 0
+    while size > 0:
+        data = 'caf\xe9 {0} '.format(line).encode('latin-1') + b'\xe2\x28\xa1 \xff\xfe\n'
+        size -= len(data)
+        line += 1
+        yield data
+
+
+PRODUCERS = collections.OrderedDict([
+    ('short', short_lines),
+    ('long', long_lines),
+    ('progress', progress),
+    ('metadata', metadata),
+    ('invalid', invalid),
+])
+
+
+def chunks(data, chunk_size):
+    '''
+    The output of a build as read from a pipe or a docker attach stream
+    '''
+    view = memoryview(data)
+    for start in range(0, len(data), chunk_size):
+        yield view[start:start + chunk_size].tobytes()
+
+
+def count_lines(data):
+    return data.count(b'\n') + data.count(b'\r') - data.count(b'\r\n')
+
+
+class FakeProcess(object):
+    '''
+    A build process which exited, with its output still to read
+    '''
+    pid = 0
+
+    def __init__(self, data, chunk_size):
+        self.stdout = GeneratorFile(chunks(data, chunk_size))
+
+    def poll(self):
+        return 0
+
+    def wait(self):
+        return 0
+
+    def kill(self):
+        pass
+
+
+class FakeAPI(object):
+    '''
+    The log endpoints of the server, answering after `latency` seconds
+    '''
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+        self.bytes = 0
+
+    def _request(self, size):
+        self.requests += 1
+        self.bytes += size
+        if self.latency:
+            time.sleep(self.latency)
+        return False
+
+    def log_build_output_structured(self, username, queue, worker_id, job_id, msg, metadata):
+        return self._request(len(msg))
+
+    def log_build_output_batch(self, username, queue, worker_id, job_id, chunks):
+        return self._request(sum(len(chunk['msg']) for chunk in chunks))
+
+
+def run(data, args, tempdir):
+    '''
+    Stream `data` through the log pipeline
+
+    :return: (wall seconds, CPU seconds, the fake API)
+    '''
+    api = FakeAPI(args.latency)
+    build_log = BuildLog(api, 'user', 'queue', 'worker_id', 'job_id',
+                         filename=os.path.join(tempdir, 'build-log.txt'),
+                         quiet=args.quiet, batch=args.batch)
+    process = FakeProcess(data, args.chunk_size)
+
+    start, cpu_start = time.time(), process_time()
+    with build_log:
+        read_with_timeout(process, build_log, timeout=60 * 60, iotimeout=60 * 60,
+                          flush_interval=BuildLog.INTERVAL)
+    return time.time() - start, process_time() - cpu_start, api
+
+
+def peak_memory(data, args, tempdir):
+    '''
+    The peak of the memory allocated by the pipeline, None without tracemalloc
+    '''
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        run(data, args, tempdir)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--producers', nargs='+', choices=list(PRODUCERS), default=list(PRODUCERS),
+                        help='The build outputs to stream (default: all)')
+    parser.add_argument('--size', type=float, default=4,
+                        help='MB of output per run (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=4096,
+                        help='Bytes per chunk of output (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds per request to the server (default: %(default)s)')
+    parser.add_argument('--batch', action='store_true',
+                        help='Send the log in batches, as with anaconda worker run --log-batch')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Drop the progress bar updates, as with quiet: true in .binstar.yml')
+    parser.add_argument('-n', '--number', type=int, default=3,
+                        help='Number of runs, the fastest is reported (default: %(default)s)')
+    args = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp(prefix='log-pipeline-')
+    try:
+        for name in args.producers:
+            data = b''.join(PRODUCERS[name](int(args.size * MB)))
+            size = len(data) / MB
+            lines = count_lines(data)
+
+            runs = [run(data, args, tempdir) for _ in range(args.number)]
+            seconds, cpu, api = min(runs, key=lambda result: result[0])
+            peak = peak_memory(data, args, tempdir)
+
+            print('{0:9} {1:8.1f} MB/s {2:11.0f} lines/s {3:7.3f} CPU s/MB {4:7} requests '
+                  '{5:>9} peak'.format(
+                      name, size / seconds, lines / seconds, cpu / size, api.requests,
+                      '{0:.1f} MB'.format(peak / MB) if peak is not None else '-'))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+'''
+Micro-benchmark of rendering the build script for a job
+
+Compares the cached templates against parsing the templates for every job
+
+    python -m binstar_build_client.tests.benchmarks.render_build_script -n 200
+'''
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import argparse
+import copy
+import timeit
+
+from binstar_build_client.worker.tests.test_build_script import default_build_data
+from binstar_build_client.worker.utils import script_generator
+
+
+def render(job_data):
+    script_generator.render_build_script('/working_dir', copy.deepcopy(job_data))
+
+
+def render_uncached(job_data):
+    script_generator.TEMPLATES.clear()
+    render(job_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=100,
+                        help='Number of jobs to render (default: %(default)s)')
+    args = parser.parse_args()
+
+    job_data = default_build_data()
+    for platform in ('linux-64', 'win-64'):
+        job_data['build_item_info']['platform'] = platform
+        render(job_data)  # warm up the cache
+
+        cached = timeit.timeit(lambda: render(job_data), number=args.number)
+        uncached = timeit.timeit(lambda: render_uncached(job_data), number=args.number)
+
+        print('{0:10} cached: {1:8.3f} ms/job   uncached: {2:8.3f} ms/job   speedup: {3:5.1f}x'.format(
+            platform,
+            1000 * cached / args.number,
+            1000 * uncached / args.number,
+            uncached / cached))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+'''
+End-to-end throughput benchmark of build workers
+
+Runs workers in this process against the build service emulator, in a
+subprocess, with synthetic jobs of each workload:
+
+ * trivial: one line of output
+ * chatty: thousands of lines of output at once
+ * long: a few lines of output over seconds
+
+For each workload and number of workers, it reports the jobs per minute,
+the overhead of the worker per job outside of the build script, the latency
+of the build log lines from the build script to the server, the requests
+per job and the CPU usage of the workers.
+
+The workers run the user script of each job instead of the full build
+script, which sets up conda environments. Everything else of a job is the
+code of the worker: polling, fetching the source, rendering the build
+script, shipping the log and finishing the job.
+
+    python -m binstar_build_client.tests.benchmarks.worker_throughput --workers 1 4 -o before.json
+    python -m binstar_build_client.tests.benchmarks.worker_throughput --workers 1 4 --compare before.json
+'''
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import argparse
+import collections
+import io
+import json
+import multiprocessing
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+from binstar_client import errors
+
+from binstar_build_client import BinstarBuildAPI
+from binstar_build_client.tests.emulator import Emulator
+from binstar_build_client.worker.register import WorkerConfiguration
+from binstar_build_client.worker.worker import Worker
+
+USERNAME = 'benchmark'
+QUEUE = 'queue'
+
+WORKLOADS = collections.OrderedDict([
+    ('trivial', {'lines': 1, 'interval': 0}),
+    ('chatty', {'lines': 5000, 'interval': 0}),
+    ('long', {'lines': 20, 'interval': 0.25}),
+])
+
+# Each line of output carries the time it was printed, the first and the
+# last lines time the script
+USER_SCRIPT = """#!{python} -u
+import time
+print('start ts={{0:.6f}}'.format(time.time()))
+for i in range({lines}):
+    print('line {{0}} ts={{1:.6f}}'.format(i, time.time()))
+    if {interval}:
+        time.sleep({interval})
+print('end ts={{0:.6f}}'.format(time.time()))
+"""
+TIMESTAMP = re.compile(r'ts=(\d+\.\d+)')
+
+LOG_ENDPOINTS = ('log', 'tagged-log', 'tagged-log-batch')
+
+
+class BenchmarkWorker(Worker):
+    '''
+    A worker running the user script of the benchmark jobs
+    '''
+    SLEEP_TIME = 0.1
+
+    def __init__(self, bs, worker_config, args):
+        Worker.__init__(self, bs, worker_config, args)
+        self.JOURNAL_FILE = os.path.join(args.cwd, 'journal.csv')
+
+    def run(self, build_data, script_filename, build_log, *args, **kwargs):
+        workload = build_data['build_item_info']['instructions']['benchmark']
+        user_script = os.path.join(self.staging_dir(build_data), 'user_script.py')
+        with io.open(user_script, 'w') as fd:
+            fd.write(USER_SCRIPT.format(python=sys.executable, **workload))
+        os.chmod(user_script, 0o755)
+        return Worker.run(self, build_data, user_script, build_log, *args, **kwargs)
+
+
+def worker_args(cwd, log_batch):
+    return argparse.Namespace(
+        cwd=cwd, conda_build_dir=os.path.join(cwd, 'conda-bld'), timeout=60 * 60,
+        status_file=None, show_traceback=False, show_new_procs=False, one=False,
+        push_back=False, build_cache=None, upload_jobs=0, log_batch=log_batch,
+        telemetry_interval=0, telemetry_upload=False, metrics_port=None)
+
+
+def serve(conn, jobs, workload):
+    '''
+    Run the emulator with `jobs` jobs of `workload`, and answer the
+    commands of the benchmark until it says stop
+    '''
+    emulator = Emulator().start()
+    emulator.add_queue(USERNAME, QUEUE)
+    emulator.submit(USERNAME, QUEUE, count=jobs, instructions={'benchmark': workload})
+    conn.send(emulator.url)
+
+    while True:
+        command = conn.recv()
+        if command == 'finished':
+            conn.send(len(emulator.finished))
+        elif command == 'results':
+            latencies = []
+            script_seconds = {}
+            with emulator._lock:
+                for job_id, entries in emulator.entries.items():
+                    timestamps = []
+                    for entry in entries:
+                        for timestamp in TIMESTAMP.findall(entry['msg']):
+                            timestamps.append(float(timestamp))
+                            latencies.append(entry['received'] - float(timestamp))
+                    script_seconds[job_id] = max(timestamps) - min(timestamps)
+                conn.send({'finished': emulator.finished, 'requests': emulator.requests,
+                           'bytes': emulator.bytes, 'log_latencies': latencies,
+                           'script_seconds': script_seconds})
+        else:
+            break
+    emulator.stop()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def mean(values):
+    return sum(values) / len(values) if values else None
+
+
+def work(worker):
+    try:
+        worker.work()
+    except errors.BinstarError:
+        # the worker was removed at the end of the benchmark
+        pass
+
+
+def run_scenario(workload, workers, jobs, log_batch):
+    conn, emulator_conn = multiprocessing.Pipe()
+    emulator = multiprocessing.Process(target=serve, args=(emulator_conn, jobs, WORKLOADS[workload]))
+    emulator.start()
+    url = conn.recv()
+
+    tempdir = tempfile.mkdtemp(prefix='worker-throughput-')
+    process = psutil.Process()
+    try:
+        benchmark_workers = []
+        for i in range(workers):
+            bs = BinstarBuildAPI(token='benchmark', domain=url)
+            name = 'worker-{0}'.format(i)
+            worker_id = bs.register_worker(USERNAME, QUEUE, 'linux-64', 'localhost', 'dist', name)
+            config = WorkerConfiguration(name, worker_id, USERNAME, QUEUE,
+                                         'linux-64', 'localhost', 'dist')
+            cwd = os.path.join(tempdir, name)
+            os.makedirs(cwd)
+            benchmark_workers.append(BenchmarkWorker(bs, config, worker_args(cwd, log_batch)))
+
+        cpu_before = process.cpu_times()
+        start = time.time()
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in benchmark_workers]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        finished = 0
+        while finished < jobs:
+            time.sleep(0.05)
+            conn.send('finished')
+            finished = conn.recv()
+        seconds = time.time() - start
+        cpu_after = process.cpu_times()
+
+        for worker in benchmark_workers:
+            worker.bs.remove_worker(USERNAME, QUEUE, worker.worker_id)
+        for thread in threads:
+            thread.join()
+
+        conn.send('results')
+        results = conn.recv()
+    finally:
+        conn.send('stop')
+        emulator.join()
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    script_seconds = results['script_seconds']
+    overheads = [job['seconds'] - script_seconds[job['job_id']] for job in results['finished']]
+    latencies = results['log_latencies']
+    requests = sum(results['requests'].values())
+    log_requests = sum(results['requests'].get(endpoint, 0) for endpoint in LOG_ENDPOINTS)
+    worker_cpu = (cpu_after.user + cpu_after.system) - (cpu_before.user + cpu_before.system)
+    script_cpu = ((cpu_after.children_user + cpu_after.children_system) -
+                  (cpu_before.children_user + cpu_before.children_system))
+
+    return collections.OrderedDict([
+        ('workload', workload),
+        ('workers', workers),
+        ('log_batch', log_batch),
+        ('jobs', jobs),
+        ('seconds', seconds),
+        ('jobs_per_minute', jobs * 60 / seconds),
+        ('script_seconds_mean', mean(list(script_seconds.values()))),
+        ('overhead_seconds_mean', mean(overheads)),
+        ('overhead_seconds_p95', percentile(overheads, 0.95)),
+        ('log_latency_p50', percentile(latencies, 0.5)),
+        ('log_latency_p95', percentile(latencies, 0.95)),
+        ('log_latency_max', max(latencies) if latencies else None),
+        ('requests_per_job', requests / jobs),
+        ('log_requests_per_job', log_requests / jobs),
+        ('log_bytes_per_job', sum(results['bytes'].get(endpoint, 0)
+                                  for endpoint in LOG_ENDPOINTS) / jobs),
+        ('worker_cpu_seconds', worker_cpu),
+        ('worker_cpu_percent', 100 * worker_cpu / seconds),
+        ('script_cpu_seconds', script_cpu),
+    ])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scenario_key(result):
+    return (result['workload'], result['workers'], result['log_batch'])
+
+
+COLUMNS = [
+    ('jobs_per_minute', 'jobs/min', '{0:8.1f}'),
+    ('overhead_seconds_mean', 'overhead', '{0:7.3f}s'),
+    ('log_latency_p95', 'log p95', '{0:7.3f}s'),
+    ('log_requests_per_job', 'log req/job', '{0:11.1f}'),
+    ('worker_cpu_percent', 'worker CPU', '{0:9.1f}%'),
+]
+
+
+def format_value(column, fmt, value, baseline=None):
+    if value is None:
+        return '{0:>{1}}'.format('-', len(fmt.format(0)))
+    text = fmt.format(value)
+    if baseline and baseline.get(column):
+        text += ' ({0:+.0f}%)'.format(100 * (value - baseline[column]) / baseline[column])
+    return text
+
+
+def print_result(result, baseline=None):
+    label = '{0:8} workers: {1:2}{2}'.format(result['workload'], result['workers'],
+                                             ' batch' if result['log_batch'] else '      ')
+    values = ['{0}: {1}'.format(title, format_value(column, fmt, result[column], baseline))
+              for column, title, fmt in COLUMNS]
+    print(label + '   ' + '   '.join(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workloads', nargs='+', choices=list(WORKLOADS), default=list(WORKLOADS),
+                        help='The workloads to run (default: all)')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1],
+                        help='The numbers of workers to run at once (default: %(default)s)')
+    parser.add_argument('-n', '--jobs', type=int, default=10,
+                        help='Jobs per workload and number of workers (default: %(default)s)')
+    parser.add_argument('--log-batch', action='store_true',
+                        help='Run the workers with --log-batch')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='Save the results as JSON in FILE')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare with the results saved in FILE')
+    args = parser.parse_args()
+
+    baselines = {}
+    if args.compare:
+        with io.open(args.compare, encoding='utf-8') as fd:
+            saved = json.load(fd)
+        print('Comparing with {0} (commit {1})'.format(args.compare, saved.get('commit')))
+        baselines = dict((scenario_key(result), result) for result in saved['results'])
+
+    results = []
+    for workload in args.workloads:
+        for workers in args.workers:
+            result = run_scenario(workload, workers, args.jobs, args.log_batch)
+            print_result(result, baselines.get(scenario_key(result)))
+            results.append(result)
+
+    if args.output:
+        report = collections.OrderedDict([
+            ('commit', git_commit()),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('cpus', psutil.cpu_count()),
+            ('results', results),
+        ])
+        with io.open(args.output, 'w', encoding='utf-8') as fd:
+            fd.write(json.dumps(report, indent=2, ensure_ascii=False))
+        print('Saved the results in {0}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+'''
+A local emulator of the build service, to load test workers offline
+
+The emulator serves the endpoints of the build service used by
+`BuildQueueMixin` and `BuildMixin` on localhost: the registration of workers,
+the build queues and their backlog, popping, pushing back and finishing
+jobs, the build log, the build source and the worker stats. The jobs are
+synthetic `job_data` in an in-memory queue, and every request may be
+delayed or fail on purpose:
+
+    with Emulator(latency=0.05, error_rate=0.01) as emulator:
+        emulator.add_queue('me', 'queue')
+        emulator.submit('me', 'queue', count=100)
+        bs = BinstarBuildAPI(token='token', domain=emulator.url)
+        ...
+        emulator.finished
+
+It also runs standalone, for real workers of this host:
+
+    python -m binstar_build_client.tests.emulator --port 8080 --jobs 100
+    anaconda config --set sites.emulator.url http://127.0.0.1:8080
+    anaconda -s emulator -t token worker register me/queue --name emulated
+    anaconda -s emulator -t token worker run emulated
+'''
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import argparse
+import collections
+import datetime
+import io
+import json
+import random
+import re
+import tarfile
+import time
+
+from binstar_build_client.tests.log_server import LOG_PATH, LogHandler, LogServer
+from binstar_build_client.worker_commands.register import get_platform
+
+SCRIPT = 'echo "building {package}"'
+
+
+def make_source(package='emulated', size=0):
+    '''
+    A build source tarball of a package, with a data file of `size` bytes
+    '''
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:bz2') as tar:
+        files = [('.binstar.yml', 'package: {0}\n'.format(package).encode('utf-8')),
+                 ('data.bin', b'\0' * size)]
+        for name, content in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = time.time()
+            tar.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+def make_job(owner, package, job_id, build_no, script=SCRIPT, platform=None,
+             instructions=None):
+    '''
+    The `job_data` of a synthetic job, as popped from the build queue
+
+    :param script: the build script of the job, formatted with `package`
+    :param instructions: more build instructions, e.g. 'test' or 'iotimeout'
+    '''
+    build_instructions = {'script': script.format(package=package)}
+    build_instructions.update(instructions or {})
+    return {
+        'build_item_info': {
+            'engine': 'python',
+            'platform': platform or get_platform(),
+            'sub_build_no': 0,
+            'build_no': '{0}.0'.format(build_no),
+            'instructions': build_instructions,
+        },
+        'build_info': {
+            'api_endpoint': 'api_endpoint',
+            '_id': 'build-{0}'.format(job_id),
+            'build_no': build_no,
+        },
+        'package': {'name': package},
+        'job': {'_id': job_id},
+        'owner': {'login': owner},
+        'upload_token': 'upload-token',
+        'job_name': '{0}/{1}/{2}.0'.format(owner, package, build_no),
+        'BUILD_UTC_DATETIME': datetime.datetime.utcnow().isoformat(),
+    }
+
+
+def synthetic_jobs(owner, packages=('emulated',), start=1, **kwargs):
+    '''
+    Generate the `job_data` of jobs of the packages in turn, forever
+
+    :param start: the build number of the first job, which numbers its id
+    :param kwargs: the options of `make_job`
+    '''
+    build_no = start
+    while True:
+        for package in packages:
+            yield make_job(owner, package, '{0:024x}'.format(build_no), build_no, **kwargs)
+            build_no += 1
+
+
+class Queue(object):
+    def __init__(self, username, name):
+        self.username = username
+        self.name = name
+        self.workers = collections.OrderedDict()
+        self.jobs = collections.deque()
+
+    def to_dict(self):
+        return {'_id': '{0}/{1}'.format(self.username, self.name),
+                'workers': list(self.workers.values())}
+
+
+class EmulatorHandler(LogHandler):
+    '''
+    Route the requests to the methods of the `Emulator`
+    '''
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+    def route(self, method):
+        body = self.read_body()
+        path = self.path.split('?')[0]
+        server = self.server
+        server.inject_latency()
+        status = server.inject_error()
+        if status:
+            server.received('error', len(body))
+            return self.respond(status, {'error': 'Injected error'})
+
+        if method == 'POST' and self.post_log(LOG_PATH.match(path), body):
+            return
+
+        for route_method, pattern, name in server.ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                server.received(name, len(body))
+                data = json.loads(body.decode('utf-8')) if body else {}
+                with server._lock:
+                    result = getattr(server, name)(data=data, **match.groupdict())
+                return self.send_result(result)
+
+        self.respond(404, {'error': 'Not found'})
+
+    def send_result(self, result):
+        status, content = result
+        if isinstance(content, bytes):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        elif status == 302:
+            self.send_response(status)
+            self.send_header('Location', self.server.url + content)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.respond(status, content)
+
+
+def route(method, template, name):
+    pattern = re.sub(r'\\\{(\w+)\\\}', r'(?P<\1>[^/]+)', re.escape(template))
+    return method, re.compile('^' + pattern + '$'), name
+
+
+class Emulator(LogServer):
+    '''
+    An in-memory build service on localhost
+
+    :param latency: seconds to wait before answering each request
+    :param jitter: up to `jitter` more seconds, at random
+    :param error_rate: the fraction of requests answered with `error_status`
+    :param error_status: the status of the injected errors, 500 is not
+                         retried by the transport of the workers, 503 is
+    :param source_size: the size of the data file of the build sources
+    :param seed: the seed of the random latency and errors
+    '''
+    handler_class = EmulatorHandler
+
+    ROUTES = [
+        route('POST', '/build-worker/{username}/{queue}', 'register_worker'),
+        route('DELETE', '/build-worker/{username}/{queue}/{worker_id}', 'remove_worker'),
+        route('POST', '/build-worker/{username}/{queue}/{worker_id}/jobs', 'pop_build_job'),
+        route('POST', '/build-worker/{username}/{queue}/{worker_id}/jobs/{job_id}/finish',
+              'finish_build'),
+        route('POST', '/build-worker/{username}/{queue}/{worker_id}/jobs/{job_id}/push',
+              'push_build_job'),
+        route('GET', '/build-worker/{username}/{queue}/{worker_id}/jobs/{job_id}/build-source',
+              'fetch_build_source'),
+        route('GET', '/storage/{job_id}/source.tar.bz2', 'storage'),
+        route('POST', '/build-worker/{username}/{queue}/{worker_id}/worker-stats',
+              'upload_worker_stats'),
+        route('GET', '/build-queues', 'build_queues'),
+        route('GET', '/build-queues/{username}', 'build_queues'),
+        route('GET', '/build-queues/{username}/{queue}', 'build_queue'),
+        route('POST', '/build-queues/{username}/{queue}', 'add_build_queue'),
+        route('DELETE', '/build-queues/{username}/{queue}', 'remove_build_queue'),
+        route('GET', '/build-queues/{username}/{queue}/jobs', 'build_backlog'),
+    ]
+
+    def __init__(self, port=0, latency=0, jitter=0, error_rate=0, error_status=500,
+                 source_size=0, seed=None):
+        LogServer.__init__(self, batch=True, port=port)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.source = make_source(size=source_size)
+
+        self.queues = {}
+        # the jobs popped and not finished, by job id
+        self.running = {}
+        # the finished jobs, dicts with the keys `job_id`, `worker_id`,
+        # `status`, `failed`, `timings` and `seconds` since popped
+        self.finished = []
+        self.stats = {}
+        self._worker_ids = 0
+        self._job_numbers = 0
+
+    # -- Setup --
+
+    def add_queue(self, username, name):
+        with self._lock:
+            return self.queues.setdefault((username, name), Queue(username, name))
+
+    def submit(self, username, name, count=1, packages=('emulated',), **kwargs):
+        '''
+        Add `count` synthetic jobs to a queue
+
+        :param packages: the packages of the jobs, in turn
+        :param kwargs: the options of `make_job`
+        :return: the job ids
+        '''
+        queue = self.add_queue(username, name)
+        with self._lock:
+            jobs = synthetic_jobs(username, packages, start=self._job_numbers + 1, **kwargs)
+            job_ids = []
+            for _ in range(count):
+                job = next(jobs)
+                queue.jobs.append(job)
+                job_ids.append(job['job']['_id'])
+            self._job_numbers += count
+            return job_ids
+
+    def inject_latency(self):
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+    def inject_error(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            return self.error_status
+        return None
+
+    def _queue(self, username, queue):
+        return self.queues.get((username, queue))
+
+    def _worker(self, username, queue, worker_id):
+        build_queue = self._queue(username, queue)
+        return build_queue and build_queue.workers.get(worker_id)
+
+    # -- Endpoints, called with the lock held, return (status, content) --
+
+    def register_worker(self, username, queue, data):
+        build_queue = self._queue(username, queue)
+        if build_queue is None:
+            return 404, {'error': 'No build queue {0}/{1}'.format(username, queue)}
+        self._worker_ids += 1
+        worker_id = '{0:024x}'.format(self._worker_ids)
+        build_queue.workers[worker_id] = {
+            'id': worker_id, 'name': data.get('name') or worker_id,
+            'platform': data.get('platform'), 'hostname': data.get('hostname'),
+            'dist': data.get('dist'),
+        }
+        return 200, {'worker_id': worker_id}
+
+    def remove_worker(self, username, queue, worker_id, data):
+        build_queue = self._queue(username, queue)
+        if not build_queue or build_queue.workers.pop(worker_id, None) is None:
+            return 404, {'error': 'No worker {0}'.format(worker_id)}
+        return 200, {}
+
+    def pop_build_job(self, username, queue, worker_id, data):
+        if not self._worker(username, queue, worker_id):
+            return 404, {'error': 'No worker {0}'.format(worker_id)}
+        jobs = self._queue(username, queue).jobs
+        if not jobs:
+            return 200, {}
+        job = jobs.popleft()
+        self.running[job['job']['_id']] = (worker_id, job, time.time())
+        return 200, job
+
+    def finish_build(self, username, queue, worker_id, job_id, data):
+        if job_id not in self.running:
+            return 404, {'error': 'No running job {0}'.format(job_id)}
+        _, job, popped = self.running.pop(job_id)
+        self.finished.append({'job_id': job_id, 'worker_id': worker_id,
+                              'status': data.get('status'), 'failed': data.get('failed'),
+                              'timings': data.get('timings'), 'seconds': time.time() - popped})
+        return 200, {}
+
+    def push_build_job(self, username, queue, worker_id, job_id, data):
+        if job_id not in self.running:
+            return 404, {'error': 'No running job {0}'.format(job_id)}
+        _, job, _ = self.running.pop(job_id)
+        self._queue(username, queue).jobs.appendleft(job)
+        return 201, {}
+
+    def fetch_build_source(self, username, queue, worker_id, job_id, data):
+        # The source is downloaded from the storage, as from the real service
+        return 302, '/storage/{0}/source.tar.bz2'.format(job_id)
+
+    def storage(self, job_id, data):
+        return 200, self.source
+
+    def upload_worker_stats(self, username, queue, worker_id, data):
+        self.stats[worker_id] = data.get('worker_stats')
+        return 201, {}
+
+    def build_queues(self, data, username=None):
+        return 200, [build_queue.to_dict() for build_queue in self.queues.values()
+                     if username is None or build_queue.username == username]
+
+    def build_queue(self, username, queue, data):
+        build_queue = self._queue(username, queue)
+        if build_queue is None:
+            return 404, {'error': 'No build queue {0}/{1}'.format(username, queue)}
+        return 200, build_queue.to_dict()
+
+    def add_build_queue(self, username, queue, data):
+        self.queues.setdefault((username, queue), Queue(username, queue))
+        return 201, {}
+
+    def remove_build_queue(self, username, queue, data):
+        if self.queues.pop((username, queue), None) is None:
+            return 404, {'error': 'No build queue {0}/{1}'.format(username, queue)}
+        return 201, {}
+
+    def build_backlog(self, username, queue, data):
+        build_queue = self._queue(username, queue)
+        if build_queue is None:
+            return 404, {'error': 'No build queue {0}/{1}'.format(username, queue)}
+        return 200, {'jobs': list(build_queue.jobs)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--queue', default='me/queue', help='USERNAME/QUEUE')
+    parser.add_argument('--jobs', type=int, default=10, help='Synthetic jobs to submit')
+    parser.add_argument('--script', default=SCRIPT, help='The build script of the jobs')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds per request')
+    parser.add_argument('--jitter', type=float, default=0, help='Random seconds per request')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of the requests failing')
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--source-size', type=int, default=0,
+                        help='Bytes of data in the build sources')
+    args = parser.parse_args()
+
+    username, queue = args.queue.split('/', 1)
+    emulator = Emulator(port=args.port, latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate, error_status=args.error_status,
+                        source_size=args.source_size)
+    emulator.add_queue(username, queue)
+    emulator.submit(username, queue, count=args.jobs, script=args.script)
+    print('Serving the build service at {0} with {1} jobs in {2}'.format(
+        emulator.url, args.jobs, args.queue))
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.server_close()
+
+    print('{0} jobs finished'.format(len(emulator.finished)))
+
+
+if __name__ == '__main__':
+    main()
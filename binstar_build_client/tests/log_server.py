@@ -0,0 +1,144 @@
+'''
+A local stand-in for the build log endpoints of the Repository server
+
+    with LogServer() as server:
+        bs = BinstarBuildAPI(domain=server.url)
+        ...
+        server.log('123')
+
+It serves the /log, /tagged-log and /tagged-log-batch endpoints of the jobs
+of any worker, keeps the log entries of each job with the time they were
+received, and counts the requests and bytes received. With batch=False the
+/tagged-log-batch endpoint does not exist, as on servers that do not
+support it.
+'''
+from __future__ import print_function, unicode_literals, absolute_import
+
+import gzip
+import io
+import json
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl
+
+LOG_PATH = re.compile(r'^/build-worker/[^/]+/[^/]+/[^/]+/jobs/(?P<job>[^/]+)/'
+                      r'(?P<endpoint>log|tagged-log|tagged-log-batch)$')
+
+
+class LogHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.read_body()
+        if not self.post_log(LOG_PATH.match(self.path.split('?')[0]), body):
+            self.respond(404, {'error': 'Not found'})
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def post_log(self, match, body):
+        '''
+        Serve a log request, False if there is no such endpoint
+        '''
+        server = self.server
+        if not match or (match.group('endpoint') == 'tagged-log-batch' and not server.batch):
+            return False
+
+        server.received(match.group('endpoint'), len(body))
+        job = match.group('job')
+        if match.group('endpoint') == 'log':
+            server.add_entry(job, {'msg': body.decode('utf-8', 'replace')})
+        elif match.group('endpoint') == 'tagged-log':
+            server.add_entry(job, dict((key, value if not isinstance(value, bytes) else
+                                        value.decode('utf-8', 'replace'))
+                                       for key, value in parse_qsl(body.decode('utf-8'))))
+        else:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+            for chunk in json.loads(body.decode('utf-8'))['chunks']:
+                server.add_entry(job, chunk)
+
+        self.respond(200, {'terminate_build': server.terminate_build})
+        return True
+
+    def respond(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LogServer(ThreadingMixIn, HTTPServer):
+    '''
+    Serve the log endpoints on localhost in a background thread
+
+    :param batch: serve the /tagged-log-batch endpoint
+    '''
+    daemon_threads = True
+    handler_class = LogHandler
+
+    def __init__(self, batch=True, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), self.handler_class)
+        self.batch = batch
+        self.terminate_build = False
+        self.entries = {}
+        self._seqs = {}
+        # the number of requests and the bytes received, by endpoint
+        self.requests = {}
+        self.bytes = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def received(self, endpoint, size):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.bytes[endpoint] = self.bytes.get(endpoint, 0) + size
+
+    def add_entry(self, job, entry):
+        with self._lock:
+            # a batch sent again after a failure repeats the chunks received
+            if 'seq' in entry:
+                seqs = self._seqs.setdefault(job, set())
+                if entry['seq'] in seqs:
+                    return
+                seqs.add(entry['seq'])
+            self.entries.setdefault(job, []).append(dict(entry, received=time.time()))
+
+    def log(self, job):
+        'The build log of the job received so far'
+        with self._lock:
+            return ''.join(entry['msg'] for entry in self.entries.get(job, []))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='log-server')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -19,6 +19,7 @@ from binstar_client.utils import get_binstar
 from binstar_client.tests.fixture import CLITestCase
 from binstar_client.tests.urlmock import urlpatch
 from binstar_build_client.scripts.build import main
+from binstar_build_client.build_commands import timings
 from binstar_build_client.worker.register import WorkerConfiguration
 from binstar_build_client import worker
 from binstar_build_client import BinstarBuildAPI
@@ -78,6 +79,27 @@ class Test(CLITestCase):
     def test_tail(self, tail, urls):
         main(['tail', '-f', 'user/package', '0.1'], False)
 
+    @urlpatch
+    @patch('binstar_build_client.mixins.build.BuildMixin.builds')
+    def test_timings(self, builds, urls):
+        builds.return_value = [
+            {'build_no': 1, 'items': [
+                {'timings': [{'section': 'script', 'command': 'make', 'duration': 3.0},
+                             {'section': 'setup_build', 'command': None, 'duration': 1.0}]},
+                {'timings': [{'section': 'script', 'command': 'make', 'duration': 5.0}]},
+            ]},
+            {'build_no': 2, 'items': [{'sub_build_no': 0}]},
+        ]
+        main(['timings', 'user/package'], False)
+
+        rows = timings.aggregate_timings(builds.return_value)
+        self.assertEqual(rows[0]['command'], 'make')
+        self.assertEqual(rows[0]['count'], 2)
+        self.assertEqual(rows[0]['total'], 8.0)
+        self.assertEqual(rows[0]['mean'], 4.0)
+        self.assertEqual(rows[0]['max'], 5.0)
+        self.assertEqual(rows[1]['section'], 'setup_build')
+
     @urlpatch
     @patch('binstar_build_client.mixins.build_queue.BuildQueueMixin.add_build_queue')
     def test_queue(self, add_build_queue, urls):
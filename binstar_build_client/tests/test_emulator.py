@@ -0,0 +1,72 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import io
+import tarfile
+import unittest
+
+from binstar_client import errors
+
+from binstar_build_client import BinstarBuildAPI
+from binstar_build_client.tests.emulator import Emulator
+
+
+class TestEmulator(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(seed=0).start()
+        self.addCleanup(self.emulator.stop)
+        self.emulator.add_queue('me', 'queue')
+        self.bs = BinstarBuildAPI(token='token', domain=self.emulator.url)
+        self.bs.configure_transport(retries=0)
+
+    def test_job_lifecycle(self):
+        job_ids = self.emulator.submit('me', 'queue', count=3, packages=('a', 'b'))
+        worker_id = self.bs.register_worker('me', 'queue', 'linux-64', 'host', 'dist', 'w1')
+
+        [queue] = self.bs.build_queues()
+        self.assertEqual(queue['_id'], 'me/queue')
+        self.assertEqual(queue['workers'][0]['name'], 'w1')
+        self.assertEqual(len(self.bs.build_backlog('me', 'queue')), 3)
+
+        job_data = self.bs.pop_build_job('me', 'queue', worker_id)
+        self.assertEqual(job_data['job']['_id'], job_ids[0])
+        self.assertEqual(job_data['package']['name'], 'a')
+
+        source = self.bs.fetch_build_source('me', 'queue', worker_id, job_ids[0]).read()
+        with tarfile.open(fileobj=io.BytesIO(source), mode='r:bz2') as tar:
+            self.assertIn('.binstar.yml', tar.getnames())
+
+        self.bs.log_build_output_batch('me', 'queue', worker_id, job_ids[0],
+                                       [{'seq': 0, 'msg': b'hello\n', 'section': 'script'}])
+        self.bs.finish_build('me', 'queue', worker_id, job_ids[0], status='success')
+        self.assertEqual(self.emulator.log(job_ids[0]), 'hello\n')
+        self.assertEqual(self.emulator.finished[0]['status'], 'success')
+
+        job_data = self.bs.pop_build_job('me', 'queue', worker_id)
+        self.bs.push_build_job('me', 'queue', worker_id, job_data['job']['_id'])
+        self.assertEqual(len(self.bs.build_backlog('me', 'queue')), 2)
+
+        self.assertTrue(self.bs.remove_worker('me', 'queue', worker_id))
+        with self.assertRaises(errors.NotFound):
+            self.bs.pop_build_job('me', 'queue', worker_id)
+
+    def test_empty_queue(self):
+        worker_id = self.bs.register_worker('me', 'queue', 'linux-64', 'host', 'dist', 'w1')
+        self.assertEqual(self.bs.pop_build_job('me', 'queue', worker_id), {})
+
+    def test_error_injection(self):
+        self.emulator.error_rate = 1
+        with self.assertRaises(errors.ServerError):
+            self.bs.build_queues()
+        self.assertEqual(self.emulator.requests['error'], 1)
+
+        # 503 is retried by the transport of the workers
+        self.emulator.error_status = 503
+        self.bs.configure_transport(retries=2, backoff=0)
+        with self.assertRaises(errors.ServerError):
+            self.bs.build_queues()
+        self.assertEqual(self.emulator.requests['error'], 1 + 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
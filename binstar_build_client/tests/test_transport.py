@@ -0,0 +1,103 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import unittest
+
+from mock import patch
+import requests
+from requests.adapters import HTTPAdapter
+
+from binstar_build_client import BinstarBuildAPI
+from binstar_build_client.mixins import transport
+from binstar_build_client.worker.utils import metrics
+
+
+def response(request, status_code=200, content=b'{}', headers=None):
+    res = requests.Response()
+    res.status_code = status_code
+    res._content = content
+    res.headers.update(headers or {'Content-Length': str(len(content))})
+    res.request = request
+    res.url = request.url
+    return res
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.bs = BinstarBuildAPI(token='token', domain='https://api.example.com')
+        self.sent = []
+
+    def send(self, adapter, request, **kwargs):
+        self.sent.append((adapter, request, kwargs))
+        if request.url.startswith('https://storage.example.com'):
+            return response(request, content=b'source', headers={'Content-Length': '6'})
+        if request.url.endswith('/build-source'):
+            return response(request, 302, b'',
+                            {'location': 'https://storage.example.com/source?sig=1'})
+        return response(request)
+
+    def test_endpoint(self):
+        self.assertEqual(transport.endpoint('/build-worker/u/q/w/jobs')[0],
+                         '/build-worker/{user}/{queue}/{worker}/jobs')
+        self.assertEqual(transport.endpoint('/build-worker/u/q/w/jobs/j/tagged-log'),
+                         ('/build-worker/{user}/{queue}/{worker}/jobs/{job}/tagged-log', (10, 30)))
+        self.assertEqual(transport.endpoint('/build/u/p/stop/1')[0],
+                         '/build/{user}/{package}/stop/{build}')
+        self.assertEqual(transport.endpoint('/build/u/p/3')[0], '/build/{user}/{package}/{build}')
+        self.assertEqual(transport.endpoint('/user'), (transport.OTHER, transport.DEFAULT_TIMEOUT))
+
+    def test_retries_idempotent_only(self):
+        retry = self.bs.session.get_adapter(self.bs.domain).max_retries
+        self.assertEqual(retry.total, transport.DEFAULT_RETRIES)
+        self.assertTrue(retry.is_retry('GET', 503))
+        self.assertTrue(retry.is_retry('DELETE', 502))
+        self.assertFalse(retry.is_retry('POST', 503))
+        self.assertFalse(retry.is_retry('GET', 500))
+
+    def test_configure(self):
+        self.bs.configure_transport(pool_size=32)
+        self.bs.configure_transport(retries=1)
+        adapter = self.bs.session.get_adapter(self.bs.domain)
+        self.assertEqual(adapter._pool_maxsize, 32)
+        self.assertEqual(adapter.max_retries.total, 1)
+        self.assertEqual(self.bs.storage_session.get_adapter('https://s3')._pool_maxsize, 32)
+
+    def test_timeouts_and_metrics(self):
+        endpoint = '/build-worker/{user}/{queue}/{worker}/jobs/{job}/finish'
+        requests_before = metrics.HTTP_REQUESTS.value(endpoint=endpoint, method='POST', code='200')
+        sent_before = metrics.HTTP_SENT_BYTES.value(endpoint=endpoint)
+
+        with patch.object(HTTPAdapter, 'send', autospec=True, side_effect=self.send):
+            self.bs.finish_build('u', 'q', 'w', 'j')
+            self.bs.session.get(self.bs.domain + '/user', timeout=5)
+
+        self.assertEqual(self.sent[0][2]['timeout'], (10, 120))
+        self.assertEqual(self.sent[1][2]['timeout'], 5)
+        self.assertEqual(metrics.HTTP_REQUESTS.value(endpoint=endpoint, method='POST', code='200'),
+                         requests_before + 1)
+        self.assertGreater(metrics.HTTP_SENT_BYTES.value(endpoint=endpoint), sent_before)
+
+    def test_errors_recorded(self):
+        endpoint = '/build-worker/{user}/{queue}/{worker}/jobs'
+        before = metrics.HTTP_REQUESTS.value(endpoint=endpoint, method='POST', code='error')
+        with patch.object(HTTPAdapter, 'send', side_effect=requests.ConnectionError('reset')):
+            with self.assertRaises(requests.ConnectionError):
+                self.bs.pop_build_job('u', 'q', 'w')
+        self.assertEqual(metrics.HTTP_REQUESTS.value(endpoint=endpoint, method='POST', code='error'),
+                         before + 1)
+
+    def test_build_source_from_storage(self):
+        with patch.object(HTTPAdapter, 'send', autospec=True, side_effect=self.send):
+            self.bs.fetch_build_source('u', 'q', 'w', 'j')
+
+        (api_adapter, api_request, _), (storage_adapter, storage_request, kwargs) = self.sent
+        self.assertIs(api_adapter, self.bs.session.get_adapter(self.bs.domain))
+        self.assertIs(storage_adapter, self.bs.storage_session.get_adapter('https://storage'))
+        self.assertEqual(api_request.headers['Authorization'], 'token token')
+        # The API token is never sent to the storage
+        self.assertNotIn('Authorization', storage_request.headers)
+        self.assertEqual(kwargs['timeout'], transport.STORAGE_TIMEOUT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -115,6 +115,26 @@ class Test(CLITestCase):
 
         self.assertEqual(loop.call_count, 1)
 
+    @urlpatch
+    @patch('binstar_build_client.worker.worker.Worker.write_stats')
+    @patch('binstar_build_client.worker.worker.Worker.write_status')
+    @patch('binstar_build_client.worker.worker.Worker.work_forever')
+    @patch('binstar_build_client.worker.register.WorkerConfiguration.load')
+    @patch('binstar_build_client.worker.register.WorkerConfiguration.validate_worker_name')
+    def test_worker_already_running(self, validate, load, loop, write_status, write_stats, urls):
+        worker_config = WorkerConfiguration('worker_name', worker_data['worker_id'], 'username',
+                                            'queue-1', 'platform', 'localhost', 'dist')
+        load.return_value = worker_config
+
+        with worker_config.running():
+            with self.assertRaises(errors.BinstarError):
+                main(['--show-traceback', 'worker', 'run', 'worker_name'], False)
+
+        # The status and the stats of the running worker are left alone
+        self.assertEqual(loop.call_count, 0)
+        self.assertEqual(write_status.call_count, 0)
+        self.assertEqual(write_stats.call_count, 0)
+
     @urlpatch
     @patch('binstar_build_client.worker.docker_worker.DockerWorker.work_forever')
     @patch('binstar_build_client.worker.register.WorkerConfiguration.load')
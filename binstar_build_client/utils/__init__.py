@@ -8,19 +8,65 @@ except ImportError:
     from urlparse import urlparse
 
 CONDA_EXE = 'conda.exe' if os.name == 'nt' else 'conda'
+BIN_DIR = 'Scripts' if os.name == 'nt' else 'bin'
+
+# get_conda_root_prefix results keyed by the environment they were computed in
+_conda_root_prefix_cache = {}
+
+
+def _root_prefix_of(conda_exe):
+    conda_exe_path = os.path.realpath(conda_exe)
+    bin_dir = os.path.dirname(conda_exe_path)
+    return os.path.dirname(bin_dir)
+
+
+def find_conda_root_prefix():
+    """
+    Search for the directory prefix to where conda is installed
+
+    Honors the CONDA_EXE and CONDA_PREFIX environment variables before looking
+    next to the current interpreter and on the PATH. Only stats the candidate
+    paths, no directories are listed.
+    """
+    conda_exe = os.environ.get('CONDA_EXE')
+    if conda_exe and os.path.isfile(conda_exe):
+        return _root_prefix_of(conda_exe)
+
+    paths = [os.path.dirname(os.path.realpath(sys.executable))]
+    if os.environ.get('CONDA_PREFIX'):
+        paths.append(os.path.join(os.environ['CONDA_PREFIX'], BIN_DIR))
+    paths.extend(os.environ.get('PATH', '').split(os.pathsep))
+
+    for entry in paths:
+        conda_exe = os.path.join(entry, CONDA_EXE)
+        if entry and os.path.isfile(conda_exe):
+            return _root_prefix_of(conda_exe)
+
 
 def get_conda_root_prefix():
     """
     get the directory prefix to where conda is installed
+
+    The result is cached until the relevant environment variables change or
+    `clear_conda_root_prefix_cache` is called.
     """
-    canonical_dir_current_executable = os.path.dirname(os.path.realpath(sys.executable))
-    paths = [canonical_dir_current_executable, ] + os.environ.get('PATH').split(os.pathsep)
+    key = (sys.executable,
+           os.environ.get('CONDA_EXE'),
+           os.environ.get('CONDA_PREFIX'),
+           os.environ.get('PATH'))
+    try:
+        return _conda_root_prefix_cache[key]
+    except KeyError:
+        prefix = _conda_root_prefix_cache[key] = find_conda_root_prefix()
+        return prefix
 
-    for entry in paths:
-        if os.path.isdir(entry) and CONDA_EXE in os.listdir(entry):
-            conda_exe_path = os.path.realpath(os.path.join(entry, 'conda'))
-            bin_dir = os.path.dirname(conda_exe_path)
-            return os.path.dirname(bin_dir)
+
+def clear_conda_root_prefix_cache():
+    """
+    Forget the cached results of `get_conda_root_prefix`, e.g. after conda was
+    (re)installed
+    """
+    _conda_root_prefix_cache.clear()
 
 def get_anaconda_url(binstar, path):
     '''
@@ -1,33 +1,59 @@
 import unittest
 import mock
-from binstar_build_client.utils import get_conda_root_prefix, CONDA_EXE
+from binstar_build_client.utils import (get_conda_root_prefix, CONDA_EXE,
+                                        clear_conda_root_prefix_cache)
 import os
 class Test(unittest.TestCase):
 
-    @mock.patch.dict(os.environ, {'PATH': '/does_not_exist!!'})
-    @mock.patch('os.listdir')
-    def test_path_does_not_exist(self, listdir):
-        listdir.return_value = []
+    def setUp(self):
+        clear_conda_root_prefix_cache()
+        self.addCleanup(clear_conda_root_prefix_cache)
+
+    @mock.patch.dict(os.environ, {'PATH': '/does_not_exist!!'}, clear=True)
+    @mock.patch('sys.executable', '/no/python')
+    def test_path_does_not_exist(self):
         prefix = get_conda_root_prefix()
         self.assertIsNone(prefix)
 
-    @mock.patch.dict(os.environ, {'PATH': '/a/bin' + os.pathsep + '/b/bin'})
-    @mock.patch('os.path.isdir')
-    @mock.patch('os.listdir')
-    def test_finds_conda(self, listdir, isdir):
+    @mock.patch.dict(os.environ, {'PATH': '/a/bin' + os.pathsep + '/b/bin'}, clear=True)
+    @mock.patch('os.path.isfile')
+    def test_finds_conda(self, isfile):
 
-        def list_dir(dirname):
-            print("dirname", dirname)
-            if dirname == '/a/bin':
-                return [CONDA_EXE, 'not_conda']
-            else:
-                return ['not_conda']
+        def is_file(filename):
+            return filename == os.path.join('/a/bin', CONDA_EXE)
 
-        listdir.side_effect = list_dir
+        isfile.side_effect = is_file
 
         prefix = get_conda_root_prefix()
         self.assertTrue(prefix in ('/a', "C:\\a"))
 
+    @mock.patch.dict(os.environ, {'PATH': '/a/bin', 'CONDA_EXE': '/c/bin/conda'}, clear=True)
+    @mock.patch('os.path.isfile')
+    def test_conda_exe(self, isfile):
+        isfile.return_value = True
+
+        prefix = get_conda_root_prefix()
+        self.assertTrue(prefix in ('/c', "C:\\c"))
+
+    @mock.patch.dict(os.environ, {'PATH': '/a/bin'}, clear=True)
+    @mock.patch('os.path.isfile')
+    def test_cached(self, isfile):
+        isfile.side_effect = lambda filename: filename == os.path.join('/a/bin', CONDA_EXE)
+
+        prefix = get_conda_root_prefix()
+        calls = isfile.call_count
+        self.assertEqual(prefix, get_conda_root_prefix())
+        self.assertEqual(calls, isfile.call_count)
+
+        clear_conda_root_prefix_cache()
+        get_conda_root_prefix()
+        self.assertEqual(2 * calls, isfile.call_count)
+
+    @mock.patch('os.listdir')
+    def test_no_listdir(self, listdir):
+        get_conda_root_prefix()
+        self.assertFalse(listdir.called)
+
 
 
 
@@ -2,34 +2,88 @@ import unittest
 import mock
 import os
 import platform
+import shutil
+import tempfile
+import threading
 
-from binstar_build_client.utils.worker_stats import worker_stats
+import psutil
 
-expected_keys = {'win': set(('logicaldisk', 'systeminfo',)),
-                 'posix': set(('df',('vm_stat', 'meminfo'),
-                               ))}
+from binstar_build_client.utils.worker_stats import (worker_stats, storage_stats, memory_stats,
+                                                     StatsCache, stats_fingerprint)
 
 class Test(unittest.TestCase):
     def test_keys(self):
         stats = worker_stats()
-        if os.name == 'nt':
-            for key in expected_keys['win']:
-                self.assertIn(key, stats)
-        else:
-            self.assertIn('df', stats)
-            if 'vm_stat' in stats or 'meminfo' in stats:
-                has_mem = True
-            else:
-                has_mem = False
-            self.assertTrue(has_mem)
-            if platform.system().lower() != 'darwin':
-                has_sys = False
-                for key in ('yum', 'dpkg', 'apt'):
-                    if key in stats:
-                        has_sys = True
-                self.assertTrue(has_sys)
+        self.assertIn('df', stats)
+        self.assertIn('meminfo', stats)
+        if os.name != 'nt' and platform.system().lower() != 'darwin':
+            has_sys = False
+            for key in ('yum', 'dpkg', 'apt'):
+                if key in stats:
+                    has_sys = True
+            self.assertTrue(has_sys)
         for key, value in stats.items():
             self.assertEqual(sorted(value.keys()), ['cmd', 'out'])
         self.assertIn('conda list', stats)
         self.assertIn('conda env list', stats)
         self.assertIn('conda info', stats)
+
+    @mock.patch('binstar_build_client.utils.worker_stats._check_output')
+    def test_storage_memory_in_process(self, check_output):
+        storage = storage_stats()['df']['out'].splitlines()
+        self.assertEqual(storage[0].split()[0], 'Filesystem')
+        mountpoints = [line.split()[-1] for line in storage[1:]]
+        self.assertIn(psutil.disk_partitions()[0].mountpoint, mountpoints)
+
+        meminfo = dict(line.split(':') for line in memory_stats()['meminfo']['out'].splitlines())
+        self.assertEqual(int(meminfo['MemTotal'].split()[0]), psutil.virtual_memory().total // 1024)
+        self.assertIn('SwapFree', meminfo)
+
+        # No df, cat /proc/meminfo or systeminfo subprocess
+        self.assertFalse(check_output.called)
+
+    def test_fingerprint(self):
+        self.assertEqual(stats_fingerprint(), stats_fingerprint())
+
+    @mock.patch('binstar_build_client.utils.worker_stats.memory_stats')
+    @mock.patch('binstar_build_client.utils.worker_stats.storage_stats')
+    @mock.patch('binstar_build_client.utils.worker_stats.software_stats')
+    def test_cache(self, collect, storage_stats, memory_stats):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache = StatsCache(os.path.join(cache_dir, 'stats', 'worker-stats.json'))
+        collect.return_value = {'conda list': {'cmd': 'conda list', 'out': []}}
+        storage_stats.return_value = {'df': {'cmd': 'df', 'out': 'disks'}}
+        memory_stats.return_value = {}
+
+        self.assertEqual(cache.collect('fp1'), dict(collect.return_value, **storage_stats.return_value))
+        storage_stats.return_value = {'df': {'cmd': 'df', 'out': 'fuller disks'}}
+        self.assertEqual(cache.collect('fp1')['df']['out'], 'fuller disks')
+        # The software stats are cached, the storage and memory stats are not
+        self.assertEqual(collect.call_count, 1)
+        self.assertEqual(storage_stats.call_count, 2)
+
+        self.assertFalse(cache.is_uploaded('worker_id', 'fp1'))
+        cache.mark_uploaded('worker_id', 'fp1')
+        self.assertTrue(cache.is_uploaded('worker_id', 'fp1'))
+        self.assertFalse(cache.is_uploaded('other_worker_id', 'fp1'))
+
+        # The software of the host changed
+        self.assertFalse(cache.is_uploaded('worker_id', 'fp2'))
+        cache.collect('fp2')
+        self.assertEqual(collect.call_count, 2)
+        self.assertTrue(cache.is_uploaded('worker_id', 'fp1'))
+
+    def test_cache_shared(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        filename = os.path.join(cache_dir, 'worker-stats.json')
+
+        # Workers starting at once do not lose each other's uploads
+        threads = [threading.Thread(target=StatsCache(filename).mark_uploaded, args=(str(i), 'fp'))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(StatsCache(filename).is_uploaded(str(i), 'fp') for i in range(20)))
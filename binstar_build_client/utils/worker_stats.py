@@ -1,14 +1,58 @@
 '''
 worker_stats.py - Gather info on workers' storage, memory, and
 software installed.
+
+The commands run concurrently, the storage and memory stats are read in
+process with psutil. The software stats of a host are cached on
+disk with a fingerprint of the installed software, workers upload the stats
+again only when the fingerprint changes. The storage and memory stats are
+collected every time.
 '''
 from __future__ import print_function
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+import hashlib
+import io
 import json
+import logging
 import os
+import platform
 from subprocess import check_output as _check_output
 
+import psutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from binstar_client import errors
 
+from binstar_build_client.utils import get_conda_root_prefix
+
+log = logging.getLogger('binstar.build')
+
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.anaconda-build', 'worker-stats.json')
+
+# Their modification time changes when software is installed or removed
+FINGERPRINT_PATHS = [
+    '/var/lib/dpkg/status',
+    '/var/lib/rpm/Packages',
+    '/var/lib/rpm/rpmdb.sqlite',
+    '/usr/local/Cellar',
+]
+
+
+def concurrently(funcs):
+    '''
+    The results of calling each function of `funcs`, called at once
+    '''
+    pool = ThreadPool(len(funcs))
+    try:
+        return pool.map(lambda func: func(), funcs)
+    finally:
+        pool.close()
+
 
 def check_output(args, cwd='.', raise_=True):
     try:
@@ -18,74 +62,184 @@ def check_output(args, cwd='.', raise_=True):
             raise errors.BinstarError('Failed on {}'.format(args))
 
 def storage_stats():
-    if os.name == 'nt':
-        disk_args = ['cmd', '/c', 'wmic', 'logicaldisk', 'get',
-                       'size,freespace,caption,description,volumename']
-        disk = check_output(disk_args)
-        return {'logicaldisk': {'cmd': " ".join(disk_args),
-                                'out': disk,
-        }}
-    else:
-        return {'df': {'cmd': 'df', 'out': check_output(['df'])}}
+    '''
+    The usage of the mounted disks, in the format of `df -k`
+    '''
+    lines = ['Filesystem 1K-blocks Used Available Use% Mounted on']
+    for partition in psutil.disk_partitions():
+        try:
+            usage = psutil.disk_usage(partition.mountpoint)
+        except (IOError, OSError):  # e.g. a drive without a disk on Windows
+            continue
+        lines.append('{0} {1} {2} {3} {4:.0f}% {5}'.format(
+            partition.device, usage.total // 1024, usage.used // 1024,
+            usage.free // 1024, usage.percent, partition.mountpoint))
+    return {'df': {'cmd': 'psutil.disk_usage', 'out': '\n'.join(lines) + '\n'}}
 
 def memory_stats():
-    out = {}
-    if os.name == 'nt':
-        out['systeminfo'] = {'out': check_output(['systeminfo']),
-                             'cmd': 'systeminfo'}
-    else:
-        meminfo = os.path.join('/', 'proc', 'meminfo')
-        if os.path.exists(meminfo):
-            out['meminfo'] = {'out': check_output(['cat', meminfo]),
-                              'cmd': 'cat /proc/meminfo',}
-        which_vm_stat = check_output(['which', 'vm_stat'], raise_=False)
-        if which_vm_stat:
-            out['vm_stat'] = {'out': check_output(['vm_stat']),
-                              'cmd': 'vm_stat'}
-
-    return out
+    '''
+    The memory and swap of the host, in the format of /proc/meminfo
+    '''
+    memory = psutil.virtual_memory()
+    swap = psutil.swap_memory()
+    fields = [
+        ('MemTotal', memory.total),
+        ('MemFree', memory.free),
+        ('MemAvailable', memory.available),
+        ('SwapTotal', swap.total),
+        ('SwapFree', swap.free),
+    ]
+    out = ''.join('{0}: {1:>12} kB\n'.format(name, value // 1024) for name, value in fields)
+    return {'meminfo': {'cmd': 'psutil.virtual_memory', 'out': out}}
 
 def conda_stats():
     out = {}
-    args = ['conda', 'list', '--json']
-    conda_list = json.loads(check_output(args))
-    out['conda list'] = {'out': conda_list, 'cmd': " ".join(args)}
-    out['conda env list'] = {'out': json.loads(check_output(['conda','env', 'list', '--json'])),
-                             'cmd': 'conda env list --json'}
-    out['conda info'] = {'out': json.loads(check_output(['conda', 'info', '--json'])),
-                         'cmd': 'conda info --json'}
+    commands = [
+        ('conda list', ['conda', 'list', '--json']),
+        ('conda env list', ['conda', 'env', 'list', '--json']),
+        ('conda info', ['conda', 'info', '--json']),
+    ]
+    outputs = concurrently([lambda args=args: check_output(args) for _, args in commands])
+    for (key, args), output in zip(commands, outputs):
+        out[key] = {'out': json.loads(output), 'cmd': " ".join(args)}
     return out
 
 def system_packages():
     out = {}
     if os.name != 'nt':
-        args = ['apt', '--installed', 'list']
-        apt_installed = check_output(args, raise_=False)
-        if apt_installed:
-            out['apt'] = {'cmd': ' '.join(args),
-                          'out': apt_installed,}
-        args = ['dpkg', '-l']
-        dpkg = check_output(args, raise_=False)
-        if dpkg:
-            out['dpkg'] = {'out': dpkg,
-                           'cmd': ' '.join(args),}
-        args = ['brew', 'list']
-        brew = check_output(args, raise_=False)
-        if brew:
-            out['brew'] = {'out': brew,
-                           'cmd': ' '.join(args)}
-        args = ['yum', 'list', 'installed']
-        yum = check_output(args, raise_=False)
-        if yum:
-            out['yum'] = {'out': yum,
-                          'cmd': ' '.join(args)}
+        commands = [
+            ('apt', ['apt', '--installed', 'list']),
+            ('dpkg', ['dpkg', '-l']),
+            ('brew', ['brew', 'list']),
+            ('yum', ['yum', 'list', 'installed']),
+        ]
+        outputs = concurrently([lambda args=args: check_output(args, raise_=False)
+                                for _, args in commands])
+        for (key, args), output in zip(commands, outputs):
+            if output:
+                out[key] = {'out': output,
+                            'cmd': ' '.join(args)}
     return out
 
 
-def worker_stats():
+def software_stats():
     out = {}
-    for func in (conda_stats, storage_stats,
-                 memory_stats, system_packages):
-        out.update(func())
+    for stats in concurrently([conda_stats, system_packages]):
+        out.update(stats)
     return out
 
+
+def worker_stats(software=software_stats):
+    '''
+    :param software: returns the software stats
+    '''
+    out = {}
+    for stats in concurrently([software, storage_stats, memory_stats]):
+        out.update(stats)
+    return out
+
+
+def stats_fingerprint():
+    '''
+    A fingerprint of the software installed on this host: the modification
+    times of the conda-meta directories and of the system package databases
+    '''
+    paths = list(FINGERPRINT_PATHS)
+    conda_prefix = get_conda_root_prefix()
+    if conda_prefix:
+        paths.append(os.path.join(conda_prefix, 'conda-meta'))
+        envs_dir = os.path.join(conda_prefix, 'envs')
+        paths.append(envs_dir)
+        if os.path.isdir(envs_dir):
+            paths.extend(os.path.join(envs_dir, env, 'conda-meta')
+                         for env in sorted(os.listdir(envs_dir)))
+
+    items = [platform.node()]
+    for path in paths:
+        try:
+            items.append('{0}:{1}'.format(path, os.stat(path).st_mtime))
+        except OSError:
+            pass
+    return hashlib.sha1('\n'.join(items).encode('utf-8')).hexdigest()
+
+
+class StatsCache(object):
+    '''
+    The software stats of this host, collected once per fingerprint, and the
+    fingerprint of the stats each worker uploaded last
+
+    :param filename: the cache file, shared by the workers of the host
+    '''
+    def __init__(self, filename=CACHE_FILE):
+        self.filename = filename
+
+    def _read(self):
+        try:
+            with io.open(self.filename, 'r', encoding='utf-8') as fd:
+                return json.load(fd)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, data):
+        try:
+            tmp = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+            with io.open(tmp, 'wb') as fd:
+                fd.write(json.dumps(data).encode('utf-8'))
+            os.rename(tmp, self.filename)
+        except (IOError, OSError) as err:
+            log.warn('Could not write the worker stats cache %s: %s', self.filename, err)
+
+    @contextmanager
+    def _update(self):
+        '''
+        The cache data, written back when the context exits. The workers of
+        the host starting at once take turns.
+        '''
+        cache_dir = os.path.dirname(self.filename)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        with open(self.filename + '.lock', 'a') as fd:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                data = self._read()
+                yield data
+                self._write(data)
+            finally:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def is_uploaded(self, worker_id, fingerprint):
+        return self._read().get('uploaded', {}).get(worker_id) == fingerprint
+
+    def software(self, fingerprint):
+        '''
+        The software stats of `fingerprint`, collected if they are not cached
+        '''
+        data = self._read()
+        if data.get('fingerprint') == fingerprint and data.get('software'):
+            return data['software']
+
+        # Not under the lock, the commands take seconds
+        stats = software_stats()
+        try:
+            with self._update() as data:
+                data.pop('stats', None)
+                data.update(fingerprint=fingerprint, software=stats)
+        except (IOError, OSError) as err:
+            log.warn('Could not write the worker stats cache %s: %s', self.filename, err)
+        return stats
+
+    def collect(self, fingerprint):
+        '''
+        The worker stats, with the cached software stats of `fingerprint`
+        '''
+        return worker_stats(software=lambda: self.software(fingerprint))
+
+    def mark_uploaded(self, worker_id, fingerprint):
+        try:
+            with self._update() as data:
+                data.setdefault('uploaded', {})[worker_id] = fingerprint
+        except (IOError, OSError) as err:
+            log.warn('Could not write the worker stats cache %s: %s', self.filename, err)
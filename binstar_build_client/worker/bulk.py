@@ -0,0 +1,124 @@
+"""
+Register and deregister many workers at once
+
+Each worker registration or removal is one HTTP request. Rotating a fleet of
+workers issues them concurrently, over a connection pool of the API session
+as large as the number of requests in flight, after fetching the worker
+registry once.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from multiprocessing.pool import ThreadPool
+import logging
+import time
+
+import requests
+
+from binstar_client import errors
+
+log = logging.getLogger('binstar.build')
+
+RETRIES = 3
+RETRY_DELAY = 1
+
+# A removal can be sent again, anything may have removed the worker already
+REMOVE_RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, errors.ServerError)
+
+# A registration is only sent again if it never reached the server
+REGISTER_RETRY_ERRORS = (requests.exceptions.ConnectTimeout,)
+
+
+def pool_session(bs, jobs):
+    '''
+    Keep up to `jobs` connections to the API server open
+    '''
+    bs.configure_transport(pool_size=jobs)
+
+
+def call_with_retries(func, retry_errors):
+    '''
+    :return: (value, error, attempts), error is None on success
+    '''
+    for attempt in range(1, RETRIES + 1):
+        try:
+            return func(), None, attempt
+        except retry_errors as err:
+            error = err
+            if attempt < RETRIES:
+                time.sleep(RETRY_DELAY * attempt)
+        except Exception as err:
+            return None, err, attempt
+    return None, error, RETRIES
+
+
+def run_concurrently(func, items, jobs):
+    '''
+    The results of `func` over `items` with up to `jobs` calls at once, in
+    the order of `items`
+    '''
+    if not items:
+        return []
+    pool = ThreadPool(max(1, min(jobs, len(items))))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+
+
+def register_workers(bs, username, queue, platform, hostname, dist, names, jobs=8):
+    '''
+    Register a worker of each name of `names`, None registers a worker
+    named after its id
+
+    :return: the list of results, dicts with the keys `name`, `worker_id`,
+             `error` and `attempts`
+    '''
+    def register(name):
+        worker_id, error, attempts = call_with_retries(
+            lambda: bs.register_worker(username, queue, platform, hostname, dist, name=name),
+            REGISTER_RETRY_ERRORS)
+        return {'name': name or worker_id, 'worker_id': worker_id,
+                'error': error, 'attempts': attempts}
+
+    pool_session(bs, jobs)
+    return run_concurrently(register, names, jobs)
+
+
+def deregister_workers(bs, workers, jobs=8):
+    '''
+    Remove each WorkerConfiguration of `workers` from the server
+
+    :return: the list of results, dicts with the keys `name`, `worker_id`,
+             `error` and `attempts`
+    '''
+    def deregister(worker):
+        removed, error, attempts = call_with_retries(
+            lambda: bs.remove_worker(worker.username, worker.queue, worker.worker_id),
+            REMOVE_RETRY_ERRORS)
+        if error is None and not removed:
+            error = errors.NotFound('The worker does not exist')
+        return {'name': worker.name, 'worker_id': worker.worker_id,
+                'error': error, 'attempts': attempts}
+
+    pool_session(bs, jobs)
+    return run_concurrently(deregister, workers, jobs)
+
+
+def format_results(results, success):
+    '''
+    The lines of a table of worker results
+
+    :param success: the result of the workers without error
+    '''
+    rows = [('NAME', 'WORKER ID', 'RESULT')]
+    for result in results:
+        if result['error'] is None:
+            outcome = success
+        else:
+            outcome = 'failed: {0}'.format(result['error'])
+        if result['attempts'] > 1:
+            outcome += ' ({0} attempts)'.format(result['attempts'])
+        rows.append((result['name'] or '-', result['worker_id'] or '-', outcome))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(2)]
+    return ['{0:{w0}}  {1:{w1}}  {2}'.format(*row, w0=widths[0], w1=widths[1]) for row in rows]
@@ -1,17 +1,23 @@
 from __future__ import print_function, unicode_literals, absolute_import
 
-import json
+from contextlib import contextmanager
 import logging
 import os
-import tarfile
-from io import BytesIO
 from os.path import basename
+import threading
 
 from binstar_client import errors
 from requests import ConnectionError
 
 from binstar_build_client.worker.utils.build_log import BuildLog
+from binstar_build_client.worker.utils.container_pool import ContainerPool, ENTRYPOINT, entrypoint_script
+from binstar_build_client.worker.utils import metrics
+from binstar_build_client.worker.utils import script_generator
+from binstar_build_client.worker.utils.docker_images import ImageCache, PullManager, PullError
+from binstar_build_client.worker.utils.docker_resources import ResourceLimits
+from binstar_build_client.worker.utils.pkgs_cache import PackageCache, GB
 from binstar_build_client.worker.utils.process_wrappers import DockerBuildProcess
+from binstar_build_client.worker.utils.tar_stream import tar_stream
 from binstar_build_client.worker.utils.timeout import read_with_timeout
 from binstar_build_client.worker.worker import Worker
 
@@ -25,6 +31,32 @@ except ImportError:
     docker = None
     kwargs_from_env = None
 
+# Where --bind-staging mounts the staging directory of a build
+STAGING_MOUNT = '/anaconda-build-staging'
+
+# Pull locks and image usage, shared by the docker workers of a host
+PULL_STATE_DIR = os.path.join(os.path.expanduser('~'), '.anaconda-build', 'docker-images')
+
+
+@contextmanager
+def no_lock():
+    yield True
+
+
+class SynchronizedJournal(object):
+    '''
+    The journal file, shared by the build slots of a worker
+    '''
+    def __init__(self, fd):
+        self.fd = fd
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        with self.lock:
+            self.fd.write(data)
+            self.fd.flush()
+
+
 class DockerWorker(Worker):
     """
     """
@@ -37,35 +69,178 @@ class DockerWorker(Worker):
         )
         log.info('Connecting to docker daemon ...')
         try:
-            image = args.image
-            if ':' in image:
-                self.image, self.tag = image.split(':', 1)
-            else:
-                self.image, self.tag = image, None
-            images = self.client.images(self.image)
+            self.images = ImageCache(self.client)
+            self.images.image_id(args.image)
         except ConnectionError as err:
             raise errors.BinstarError(
                 "Docker client could not connect to daemon (is docker installed?)\n"
                 "You may need to set your DOCKER_HOST environment variable")
-        if not images:
+        except KeyError:
             raise errors.BinstarError(
                 "You do not have the docker image '{image}'\n"
                 "You may need to run:\n\n\tdocker pull {image}s\n".format(image=args.image))
 
+        try:
+            self.limits = ResourceLimits.from_args(self.args)
+        except ValueError as err:
+            raise errors.UserError(str(err))
+        log.info("Container resource limits: %s", self.limits.describe())
+
+        # --one runs a single build
+        self.concurrency = 1 if self.args.one else max(self.args.concurrency, 1)
+        if self.concurrency > 1 and self.limits.memory is None:
+            log.warn("Running %s builds at once without a --memory limit per container",
+                     self.concurrency)
+
+        self.pkgs_cache = None
+        self._trim_thread = None
+        if self.args.conda_pkgs_volume:
+            self.pkgs_cache = PackageCache(self.args.conda_pkgs_volume,
+                                           int(self.args.conda_pkgs_volume_size * GB))
+            log.info("Sharing the conda package cache %s between builds", self.pkgs_cache.root)
+
+        if self.args.bind_staging and self.args.container_pool:
+            # Pooled containers are created before the staging directory is known
+            log.warn("The container pool is not used with --bind-staging")
+            self.args.container_pool = 0
+
+        self.container_pool = None
+        if self.args.container_pool:
+            self.container_pool = ContainerPool(self.client, self.args.container_pool,
+                                                self.worker_id, self.container_options())
+            self.container_pool.remove_leftovers()
+
+        self.pulls = None
         if self.args.allow_user_images:
             log.warn("Allowing users to specify docker images")
+            self.pulls = PullManager(self.client, self.images, PULL_STATE_DIR,
+                                     budget=int(self.args.user_image_budget * GB),
+                                     ttl=self.args.user_image_ttl,
+                                     protected=[self.args.image])
+
+        if self.build_cache:
+            # The build targets only exist inside of the container
+            log.warn("The build cache is not supported by docker workers")
+            self.build_cache = None
+
+        if self.upload_jobs:
+            # The build targets only exist inside of the container
+            log.warn("Uploading build targets from the worker is not supported by docker workers")
+            self.upload_jobs = 0
 
     def working_dir(self, build_data):
-        if not self.tag:
-            find_match = self.image # no tag
-            image = [img for img in self.client.images()
-                     if find_match in {i.split(':', 1)[0] for i in img['RepoTags']}][0]
+        return self.images.working_dir(self.args.image)
+
+    def build_script_context(self):
+        context = Worker.build_script_context(self)
+        context['shared_pkgs_cache'] = self.pkgs_cache is not None
+        return context
+
+    def container_options(self, binds=None, limits=None):
+        '''
+        The extra arguments of `create_container` for build containers
+
+        :param binds: the build specific binds
+        :param limits: the resource limits of the build, defaults to the
+                       limits of the worker
+        '''
+        binds = dict(binds or {})
+        environment = {}
+        if self.pkgs_cache:
+            binds.update(self.pkgs_cache.binds())
+            environment.update(self.pkgs_cache.environment())
+
+        host_config = (limits or self.limits).host_config()
+        if binds:
+            host_config['binds'] = binds
+
+        options = {}
+        if binds:
+            options['volumes'] = sorted(bind['bind'] for bind in binds.values())
+        if host_config:
+            options['host_config'] = self.client.create_host_config(**host_config)
+        if environment:
+            options['environment'] = environment
+        return options
+
+    def trim_pkgs_cache(self):
+        '''
+        Trim the package cache in the background, once at a time
+        '''
+        if self._trim_thread and self._trim_thread.is_alive():
+            return
+        self._trim_thread = threading.Thread(target=self.pkgs_cache.trim, name='trim-pkgs-cache')
+        self._trim_thread.daemon = True
+        self._trim_thread.start()
+
+    def work_forever(self):
+        try:
+            Worker.work_forever(self)
+        finally:
+            if self.container_pool:
+                self.container_pool.close()
+
+    def work(self):
+        if self.concurrency > 1:
+            self.work_concurrently()
         else:
-            find_match = self.args.image # with the tag
-            image = [img for img in self.client.images()
-                     if find_match in img['RepoTags']][0]
-
-        return self.client.inspect_image(image)['Config']['WorkingDir']
+            Worker.work(self)
+
+    def work_slot(self, slot, journal):
+        '''
+        Build jobs one after the other in the build slot `slot`
+        '''
+        for job_data in self.job_loop():
+            job_data['worker_slot'] = slot
+            with self.job_context(journal, job_data):
+                self._handle_job(job_data)
+
+    def work_concurrently(self):
+        '''
+        Run `concurrency` build slots, each pops and builds its own jobs
+        '''
+        log.info('Running %s builds at once', self.concurrency)
+        errors_raised = []
+
+        def work_slot(slot, journal):
+            try:
+                self.work_slot(slot, journal)
+            except BaseException as err:
+                errors_raised.append(err)
+
+        with open(self.JOURNAL_FILE, 'a') as fd:
+            journal = SynchronizedJournal(fd)
+            slots = []
+            for slot in range(self.concurrency):
+                thread = threading.Thread(target=work_slot, args=(slot, journal),
+                                          name='build-slot-{0}'.format(slot))
+                thread.daemon = True
+                thread.start()
+                slots.append(thread)
+
+            # Join with a timeout so that the main thread still gets KeyboardInterrupt
+            while any(thread.is_alive() for thread in slots):
+                if errors_raised:
+                    raise errors_raised[0]
+                for thread in slots:
+                    thread.join(1)
+
+        if errors_raised:
+            raise errors_raised[0]
+
+    def staging_dir(self, job_data):
+        '''
+        Concurrent builds of a package use the staging directory of their slot
+        '''
+        slot = job_data.get('worker_slot')
+        if slot is None:
+            return Worker.staging_dir(self, job_data)
+
+        owner = job_data['owner']['login']
+        package = job_data['package']['name']
+        working_dir = os.path.join(self.args.cwd, 'builds', 'slot-{0}'.format(slot),
+                                   owner, package)
+        return os.path.abspath(working_dir)
 
     def run(self, build_data, script_filename, build_log, timeout, iotimeout,
             api_token=None, git_oauth_token=None, build_filename=None, instructions=None,
@@ -81,7 +256,14 @@ class DockerWorker(Worker):
 
         # TODO: working_dir should probably be extracted from the docker image definition (WORKDIR)
         working_dir = self.working_dir(build_data)
-        container_script_filename = '{0}/{1}'.format(working_dir, script_basename)
+
+        # The build inputs are either bind mounted or copied into the working directory
+        if self.args.bind_staging:
+            staging_dir = os.path.dirname(os.path.abspath(script_filename))
+            input_dir = STAGING_MOUNT
+        else:
+            input_dir = working_dir
+        container_script_filename = '{0}/{1}'.format(input_dir, script_basename)
 
         args = ["bash", container_script_filename, '--api-token', api_token]
 
@@ -90,7 +272,7 @@ class DockerWorker(Worker):
 
         elif build_filename:
             build_basename = basename(build_filename)
-            container_build_filename = '{0}/{1}'.format(working_dir, build_basename)
+            container_build_filename = '{0}/{1}'.format(input_dir, build_basename)
             args.extend(['--build-tarball', container_build_filename])
             transfer_files.append((build_filename, build_basename))
 
@@ -98,20 +280,15 @@ class DockerWorker(Worker):
         if self.args.allow_user_images:
             if instructions and instructions.get('docker_image'):
                 image = instructions['docker_image']
-                if ':' in image:
-                    repository, tag = image.rsplit(':', 1)
-                else:
-                    repository, tag = image, None
-
-                build_log.writeline(b'Docker: Pull {0}\n'.format(image))
-                for index, line in enumerate(cli.pull(repository, tag=tag, stream=True)):
-                    msg = json.loads(line)
-                    if msg.get('status') == 'Downloading':
-                        build_log.writeline(b'.' * index + '\r')
-                    elif msg.get('status'):
-                        build_log.writeline(msg.get('status', '').encode('utf-8', 'replace') + b'\n')
-                    else:
-                        build_log.writeline(line.encode('utf-8', 'replace') + b'\n')
+
+                def write(msg):
+                    build_log.writeline(msg.encode('utf-8', 'replace'))
+                try:
+                    pulled = self.pulls.pull(image, write)
+                except PullError as err:
+                    write('{0}\n'.format(err))
+                    return script_generator.EXIT_CODE_ERROR
+                metrics.CACHE_LOOKUPS.inc(cache='user_image', result='miss' if pulled else 'hit')
 
         else:
             if instructions and instructions.get('docker_image'):
@@ -123,45 +300,78 @@ class DockerWorker(Worker):
 
         build_log.writeline("Docker Image: {0}\n".format(image).encode('utf8'))
 
-        build_log.writeline(b"Docker: Create container\n")
-        cont = cli.create_container(image, command=command)
+        limits, warnings = self.limits.override((instructions or {}).get('resources'))
+        for warning in warnings:
+            build_log.writeline("WARNING: {0}\n".format(warning).encode('utf8'))
+        if limits != self.limits:
+            build_log.writeline("Docker: Resource limits {0}\n".format(limits.describe()).encode('utf8'))
+
+        # Only the worker's own image with the worker's limits is pooled,
+        # user images are pulled per build
+        pooled = (self.container_pool is not None and image == self.args.image
+                  and limits == self.limits)
+        if pooled:
+            cont, warm = self.container_pool.get(image, self.images.image_id(image), working_dir)
+            metrics.CACHE_LOOKUPS.inc(cache='container_pool', result='hit' if warm else 'miss')
+            if warm:
+                build_log.writeline(b"Docker: Use warm container\n")
+            else:
+                build_log.writeline(b"Docker: Create container\n")
+        elif self.args.bind_staging:
+            build_log.writeline(b"Docker: Create container\n")
+            binds = {staging_dir: {'bind': STAGING_MOUNT, 'mode': 'ro'}}
+            cont = cli.create_container(image, command=command,
+                                        **self.container_options(binds, limits))
+        else:
+            build_log.writeline(b"Docker: Create container\n")
+            cont = cli.create_container(image, command=command,
+                                        **self.container_options(limits=limits))
 
         build_log.writeline(b"Docker: Attach output\n")
 
-        archive = BytesIO()
-        with tarfile.open(fileobj=archive, mode='w') as tf:
-            for filename, arcname in transfer_files:
-                tf.add(filename, arcname)
-        archive.seek(0)
+        if not self.args.bind_staging:
+            data = []
+            if pooled:
+                # The command of a pooled container is fixed, it runs this script
+                data.append((ENTRYPOINT, entrypoint_script(args).encode('utf-8'), 0o755))
 
-        put_success = cli.put_archive(cont, working_dir, archive)
-        # build_log.write(b"Docker: Inserted script: %s\n" % put_success)
+            # Stream the archive, the source tarball may not fit in memory
+            put_success = cli.put_archive(cont, working_dir, tar_stream(transfer_files, data))
+            # build_log.write(b"Docker: Inserted script: %s\n" % put_success)
 
         build_log.writeline(b"Docker: Start\n")
         p0 = DockerBuildProcess(cli, cont)
 
-        cli.start(cont)
-
-        try:
-            read_with_timeout(
-                p0,
-                build_log,
-                timeout,
-                iotimeout,
-                BuildLog.INTERVAL,
-                build_was_stopped_by_user
-            )
-        except BaseException:
-            log.error("Binstar build process caught an exception while waiting for the build to finish")
-            p0.kill()
-            p0.wait()
-            p0.remove()
-            raise
-
-        exit_code = p0.wait()
+        # The stale conda locks of the package cache are not removed while a container uses it
+        with self.pkgs_cache.shared() if self.pkgs_cache else no_lock():
+            cli.start(cont)
+
+            try:
+                read_with_timeout(
+                    p0,
+                    build_log,
+                    timeout,
+                    iotimeout,
+                    BuildLog.INTERVAL,
+                    build_was_stopped_by_user
+                )
+            except BaseException:
+                log.error("Binstar build process caught an exception while waiting for the build to finish")
+                p0.kill()
+                p0.wait()
+                p0.remove()
+                raise
+
+            exit_code = p0.wait()
 
         log.info("Remove Container: {0}".format(cont))
-        cli.remove_container(cont, v=True)
+        if pooled:
+            self.container_pool.release(cont)
+        else:
+            cli.remove_container(cont, v=True)
+
+        if self.pkgs_cache:
+            self.trim_pkgs_cache()
 
         return exit_code
 
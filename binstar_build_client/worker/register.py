@@ -1,9 +1,14 @@
 from __future__ import print_function, unicode_literals, division, absolute_import
 
+import hashlib
+import json
 import logging
 import os
 import platform
 import re
+import tempfile
+import time
+import weakref
 
 from binstar_client import errors
 import yaml
@@ -12,8 +17,22 @@ import io
 from contextlib import contextmanager
 import psutil
 
+from binstar_build_client.worker import bulk
+from binstar_build_client.worker.utils.worker_status import STATUS_SUFFIX
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 log = logging.getLogger("binstar.build")
 
+# A running worker holds an exclusive lock on ~/.workers/NAME.lock
+LOCK_SUFFIX = '.lock'
+
+# The C YAML parser, when libyaml is available
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 def split_queue_arg(queue):
     '''
     Support old and new style queue
@@ -43,12 +62,138 @@ def pid_is_running(pid):
     except psutil.NoSuchProcess:
         return False
 
+
+def lock_holder(lock_file):
+    '''
+    The pid written in `lock_file` if a process holds its lock, None if
+    no process does. The pid is 0 while the holder has not written it yet
+    '''
+    try:
+        fd = os.open(lock_file, os.O_RDONLY)
+    except OSError:
+        return None
+
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            content = os.read(fd, 32).strip()
+            return int(content) if content.isdigit() else 0
+
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return None
+    finally:
+        os.close(fd)
+
 class InvalidWorkerConfigFile(errors.BinstarError):
     pass
 
+
+class WorkerRegistry(object):
+    '''
+    The workers of all the build queues visible to a user, from a single
+    `build_queues` request, indexed by worker id and name
+
+    :param build_queues: the response of `build_queues(username=None)`
+    '''
+    # Where --registry-ttl caches the build queues
+    CACHE_DIR = os.path.join(os.path.expanduser('~'), '.anaconda-build', 'registry')
+
+    def __init__(self, build_queues):
+        self.build_queues = [{'_id': build_info['_id'], 'workers': build_info.get('workers')}
+                             for build_info in build_queues]
+        self.workers = list(self._workers())
+        self.by_id = {worker.worker_id: worker for worker in self.workers}
+        self.by_name = {}
+        for worker in self.workers:
+            self.by_name.setdefault(worker.name, []).append(worker)
+
+    def _workers(self):
+        for build_info in self.build_queues:
+            queue_name, workers = build_info['_id'], build_info['workers']
+            if not workers:
+                continue
+            try:
+                user, queue = split_queue_arg(queue_name)
+            except Exception as e:
+                raise ValueError(repr(queue_name))
+            for worker in workers:
+                try:
+                    yield WorkerConfiguration(name=worker.get('name', worker['id']),
+                                              worker_id=worker['id'],
+                                              username=user,
+                                              queue=queue,
+                                              platform=worker['platform'],
+                                              hostname=worker['hostname'],
+                                              dist=worker['dist'])
+                except Exception as e:
+                    print('Failed with', repr(e))
+                    raise
+
+    def find(self, worker_name):
+        'The workers with the id or name `worker_name`'
+        if worker_name in self.by_id:
+            return [self.by_id[worker_name]]
+        return list(self.by_name.get(worker_name, []))
+
+    @classmethod
+    def cache_file(cls, bs):
+        'The cache file of the build queues of the user of `bs`'
+        key = '{0}\n{1}'.format(bs.domain, getattr(bs, 'token', None))
+        return os.path.join(cls.CACHE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    @classmethod
+    def fetch(cls, bs, ttl=0):
+        '''
+        Fetch the build queues, or read them from the cache file if it was
+        written less than `ttl` seconds ago
+        '''
+        cache_file = cls.cache_file(bs) if ttl else None
+        if cache_file and os.path.isfile(cache_file):
+            if time.time() - os.path.getmtime(cache_file) < ttl:
+                try:
+                    with io.open(cache_file, 'r', encoding='utf-8') as fd:
+                        return cls(json.load(fd))
+                except (IOError, ValueError, KeyError):
+                    log.warn('Ignoring invalid worker registry cache %s', cache_file)
+
+        registry = cls(bs.build_queues(username=None))
+        if cache_file:
+            registry.save(cache_file)
+        return registry
+
+    def save(self, cache_file):
+        'Write the cache file atomically, workers starting at once read either version'
+        try:
+            if not os.path.isdir(self.CACHE_DIR):
+                os.makedirs(self.CACHE_DIR)
+            fd, tmp = tempfile.mkstemp(dir=self.CACHE_DIR, suffix='.tmp')
+            with io.open(fd, 'wb') as out:
+                out.write(json.dumps(self.build_queues).encode('utf-8'))
+            os.rename(tmp, cache_file)
+        except (IOError, OSError) as err:
+            log.warn('Could not write the worker registry cache %s: %s', cache_file, err)
+
+    @classmethod
+    def invalidate(cls, bs):
+        'Remove the cache file, after registering or removing workers'
+        cache_file = cls.cache_file(bs)
+        if os.path.isfile(cache_file):
+            os.unlink(cache_file)
+
 class WorkerConfiguration(object):
     REGISTERED_WORKERS_DIR = os.path.join(os.path.expanduser('~'), '.workers')
+    # Not REGISTERED_WORKERS_DIR, rewriting the status files on each poll
+    # would change it and invalidate the backwards_compat_lookup
+    STATUS_DIR = os.path.join(os.path.expanduser('~'), '.anaconda-build', 'status')
     HOSTNAME = platform.node()
+
+    # The worker registry of each API client, fetched once
+    _registries = weakref.WeakKeyDictionary()
+
+    # backwards_compat_lookup of each directory: (directory mtime, result)
+    _compat_lookups = {}
+
     def __init__(self, name, worker_id, username, queue, platform, hostname, dist):
         worker_id_to_name = WorkerConfiguration.backwards_compat_lookup()
         self.name = worker_id_to_name.get(worker_id, None) or name
@@ -109,32 +254,31 @@ class WorkerConfiguration(object):
                                       ' one of the worker id\'s below'
                                       ' instead.\n\n' + msg)
     @classmethod
-    def registered_workers(cls, bs):
-        "Iterate over the registered workers on this machine"
+    def registry(cls, bs, ttl=0, refresh=False):
+        '''
+        The worker registry of `bs`, fetched on first use
 
-        build_query = bs.build_queues(username=None)
-        for build_info in build_query:
-            queue_name, workers = build_info['_id'], build_info.get('workers', None)
-            if not workers:
-                continue
-            try:
-                user, queue = split_queue_arg(queue_name)
-            except Exception as e:
-                raise ValueError(repr(queue_name))
-            for worker in workers:
-                try:
-                    worker = cls(name=worker.get('name', worker['id']),
-                                 worker_id=worker['id'],
-                                 username=user,
-                                 queue=queue,
-                                 platform=worker['platform'],
-                                 hostname=worker['hostname'],
-                                 dist=worker['dist'])
-                    yield worker
+        :param ttl: reuse the build queues cached on disk by another worker
+                    if they are less than `ttl` seconds old
+        :param refresh: fetch the build queues again
+        '''
+        registry = None if refresh else cls._registries.get(bs)
+        if registry is None:
+            if refresh:
+                ttl = 0
+            registry = cls._registries[bs] = WorkerRegistry.fetch(bs, ttl)
+        return registry
 
-                except Exception as e:
-                    print('Failed with', repr(e))
-                    raise
+    @classmethod
+    def invalidate_registry(cls, bs):
+        'Forget the registry of `bs`, after registering or removing workers'
+        cls._registries.pop(bs, None)
+        WorkerRegistry.invalidate(bs)
+
+    @classmethod
+    def registered_workers(cls, bs):
+        "Iterate over the registered workers on this machine"
+        return iter(cls.registry(bs).workers)
 
     @property
     def filename(self):
@@ -142,15 +286,30 @@ class WorkerConfiguration(object):
         return os.path.join(self.REGISTERED_WORKERS_DIR, self.name)
 
 
+    @property
+    def status_file(self):
+        'The file a running worker writes its live status to'
+        return os.path.join(self.STATUS_DIR, self.name + STATUS_SUFFIX)
+
+    @property
+    def lock_file(self):
+        'The file a running worker holds a lock on'
+        return self.filename + LOCK_SUFFIX
+
     @property
     def pid(self):
+        if fcntl is None:
+            return self._legacy_pid()
+        return lock_holder(self.lock_file)
+
+    def _legacy_pid(self):
+        'Without fcntl, running workers are flagged by NAME.PID files'
         for fn in glob(self.filename + '.*'):
 
             try:
                 pid = int(fn.rsplit('.', 1)[-1])
             except ValueError:
-                os.unlink(fn)
-
+                continue
 
             if pid_is_running(pid):
                 return pid
@@ -162,15 +321,91 @@ class WorkerConfiguration(object):
     def is_running(self):
         'Test if this worker is running'
 
-        if self.pid is None:
-            return False
+        return self.pid is not None
 
-        return pid_is_running(self.pid)
+    @classmethod
+    def running_workers(cls):
+        '''
+        The pids of the running workers of this host by worker name, from a
+        single pass over the registered workers directory
+        '''
+        try:
+            filenames = os.listdir(cls.REGISTERED_WORKERS_DIR)
+        except OSError:
+            return {}
+
+        running = {}
+        for fn in filenames:
+            if fcntl is None:
+                name, _, pid = fn.rpartition('.')
+                if name and pid.isdigit() and pid_is_running(int(pid)):
+                    running[name] = int(pid)
+            elif fn.endswith(LOCK_SUFFIX):
+                pid = lock_holder(os.path.join(cls.REGISTERED_WORKERS_DIR, fn))
+                if pid is not None:
+                    running[fn[:-len(LOCK_SUFFIX)]] = pid
+        return running
+
+    def _lock(self):
+        '''
+        Lock the lock file of this worker
+
+        :return: the locked file descriptor, None if another process holds it
+        '''
+        while True:
+            fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                os.close(fd)
+                return None
+
+            # The previous holder removes the file before unlocking it,
+            # lock the file at this path, not one that was removed
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.lock_file).st_ino:
+                    return fd
+            except OSError:
+                pass
+            os.close(fd)
 
     @contextmanager
     def running(self):
         'Flag this worker id as running'
 
+        if fcntl is None:
+            with self._legacy_running():
+                yield
+            return
+
+        try:
+            if not os.path.isdir(self.REGISTERED_WORKERS_DIR):
+                os.makedirs(self.REGISTERED_WORKERS_DIR)
+            fd = self._lock()
+        except OSError:
+            log.warning("Could not create the lock file of this worker", exc_info=True)
+            fd = False
+
+        if fd is False:
+            yield
+            return
+        elif fd is None:
+            msg = "This worker appears to already be running with pid {}".format(self.pid)
+            raise errors.BinstarError(msg)
+
+        try:
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode('ascii'))
+            yield
+        finally:
+            try:
+                os.unlink(self.lock_file)
+            except OSError:
+                pass
+            os.close(fd)
+
+    @contextmanager
+    def _legacy_running(self):
         if self.is_running():
             msg = "This worker appears to already be running with pid {}".format(self.pid)
             raise errors.BinstarError(msg)
@@ -187,15 +422,13 @@ class WorkerConfiguration(object):
             if os.path.isfile(dst):
                 os.unlink(dst)
 
-
-
     @classmethod
-    def load(cls, worker_name, bs, warn=False):
+    def load(cls, worker_name, bs, warn=False, ttl=0):
 
         'Load a worker config from a worker_id'
-        for worker in cls.registered_workers(bs):
-            if worker_name in (worker.worker_id, worker.name):
-                return worker
+        workers = cls.registry(bs, ttl).find(worker_name)
+        if workers:
+            return workers[0]
 
         raise errors.BinstarError('Worker with id '
                                   '{} not found'.format(worker_name))
@@ -205,11 +438,11 @@ class WorkerConfiguration(object):
         '''
         Register the worker with anaconda server
         '''
-        for worker in cls.registered_workers(bs):
-            if name in (worker.name, worker.worker_id):
-                raise errors.BinstarError('Cannot have duplicate worker '
-                                          '--name or id: {}'.format(name))
+        if cls.registry(bs, refresh=True).find(name):
+            raise errors.BinstarError('Cannot have duplicate worker '
+                                      '--name or id: {}'.format(name))
         worker_id = bs.register_worker(username, queue, platform, hostname, dist,name=name)
+        cls.invalidate_registry(bs)
         log.info('Registered worker with worker_id:\t{}'.format(worker_id))
 
         if name is None:
@@ -217,6 +450,26 @@ class WorkerConfiguration(object):
 
         return WorkerConfiguration(name, worker_id, username, queue, platform, hostname, dist)
 
+    @classmethod
+    def register_many(cls, bs, username, queue, platform, hostname, dist, names, jobs=8):
+        '''
+        Register a worker of each name of `names` with anaconda server,
+        up to `jobs` at once
+
+        :return: the list of results of `bulk.register_workers`
+        '''
+        registry = cls.registry(bs, refresh=True)
+        taken = [name for name in names if name and registry.find(name)]
+        taken += sorted(set(name for name in names if name and names.count(name) > 1))
+        if taken:
+            raise errors.BinstarError('Cannot have duplicate worker '
+                                      '--name or id: {}'.format(', '.join(taken)))
+
+        results = bulk.register_workers(bs, username, queue, platform, hostname, dist,
+                                        names, jobs=jobs)
+        cls.invalidate_registry(bs)
+        return results
+
 
     def deregister(self, bs, as_json=False):
         'Deregister the worker from anaconda server'
@@ -229,6 +482,7 @@ class WorkerConfiguration(object):
                 raise errors.BinstarError('Failed to remove_worker with argument of ' + \
                                           'worker_id\t{}\tqueue\t{}'.format(self.worker_id, self.queue))
 
+            self.invalidate_registry(bs)
             log.info('Deregistered worker with worker-id {}'.format(self.worker_id))
         except Exception:
 
@@ -238,10 +492,31 @@ class WorkerConfiguration(object):
             raise
 
     @classmethod
-    def deregister_all(cls, bs):
+    def deregister_many(cls, bs, workers, jobs=8):
+        '''
+        Deregister `workers` from anaconda server, up to `jobs` at once
 
-        for worker in cls.registered_workers(bs):
-            worker.deregister(bs)
+        Logs a table of the results, and raises an error if any failed
+        '''
+        results = bulk.deregister_workers(bs, workers, jobs=jobs)
+        cls.invalidate_registry(bs)
+        for line in bulk.format_results(results, 'deregistered'):
+            log.info(line)
+
+        failed = [result for result in results if result['error'] is not None]
+        if failed:
+            raise errors.BinstarError('Failed to deregister {} of {} workers'.format(
+                len(failed), len(results)))
+        return results
+
+    @classmethod
+    def deregister_all(cls, bs, jobs=8):
+
+        workers = list(cls.registered_workers(bs))
+        if not workers:
+            log.info('(No registered workers)')
+            return []
+        return cls.deregister_many(bs, workers, jobs=jobs)
 
     @classmethod
     def backwards_compat_lookup(cls):
@@ -260,32 +535,55 @@ class WorkerConfiguration(object):
         where ps_abc1 is a --name for a worker registration.
 
         Returns a dictionary of worker name to worker id from
-        these files, if any.
-
+        these files, if any. The result is computed once per
+        change of the directory.
         '''
+        workers_dir = cls.REGISTERED_WORKERS_DIR
+        try:
+            stat = os.stat(workers_dir)
+        except OSError:
+            return {}
+
+        mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+        cached = cls._compat_lookups.get(workers_dir)
+        if cached and cached[0] == mtime:
+            return dict(cached[1])
 
+        worker_id_to_name = cls._read_worker_files(workers_dir)
+
+        # Removing invalid files changes the directory, stat it again
+        stat = os.stat(workers_dir)
+        mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+        cls._compat_lookups[workers_dir] = (mtime, worker_id_to_name)
+        return dict(worker_id_to_name)
+
+    @classmethod
+    def _read_worker_files(cls, workers_dir):
         worker_id_to_name = {}
-        if os.path.exists(cls.REGISTERED_WORKERS_DIR):
-            possible_names = os.listdir(cls.REGISTERED_WORKERS_DIR)
-            for name in possible_names:
-                worker_file = os.path.join(cls.REGISTERED_WORKERS_DIR, name)
-                parts = worker_file.split('.')
-                if len(parts) > 1:
-                    if re.search('^\d+$', parts[-1]):
-                        continue # it is a PID file not config
-                with open(worker_file, 'r') as f:
-                    try:
-                        config = yaml.safe_load(f.read())
-                    except:
-                        log.info('Removing non-yaml file {}'
-                                 'from worker pid dir: '
-                                 '{}'.format(worker_file,
-                                             cls.REGISTERED_WORKERS_DIR))
-                        os.unlink(worker_file)
-                        config = {}
-                if hasattr(config, 'get') and config.get('worker_id', None):
-                    if name != config['worker_id']:
-                        worker_id_to_name[config['worker_id']] = name
+        for name in os.listdir(workers_dir):
+            if name.startswith('.'):
+                continue
+            parts = name.split('.')
+            if len(parts) > 1:
+                if re.search('^\d+$', parts[-1]):
+                    continue # it is a PID file not config
+            if name.endswith(LOCK_SUFFIX) or name.endswith(STATUS_SUFFIX):
+                continue
+            worker_file = os.path.join(workers_dir, name)
+            if not os.path.isfile(worker_file):
+                continue
+            with open(worker_file, 'r') as f:
+                try:
+                    config = yaml.load(f, Loader=SafeLoader)
+                except:
+                    log.info('Removing non-yaml file {}'
+                             'from worker pid dir: '
+                             '{}'.format(worker_file, workers_dir))
+                    os.unlink(worker_file)
+                    config = {}
+            if hasattr(config, 'get') and config.get('worker_id', None):
+                if name != config['worker_id']:
+                    worker_id_to_name[config['worker_id']] = name
 
         return worker_id_to_name
 
@@ -0,0 +1,135 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from mock import patch
+
+from binstar_build_client.worker.tests.test_jobs import MyWorker, default_build_data, data_path
+from binstar_build_client.worker.utils.build_cache import BuildCache
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.cache = BuildCache(os.path.join(self.root, 'cache'))
+
+    def test_fingerprint(self):
+        tarball = data_path('example_package.tar.gz')
+        fingerprint = self.cache.fingerprint(default_build_data(), tarball)
+        self.assertEqual(fingerprint, self.cache.fingerprint(default_build_data(), tarball))
+
+        job_data = default_build_data()
+        job_data['build_item_info']['engine'] = 'python=3'
+        self.assertNotEqual(fingerprint, self.cache.fingerprint(job_data, tarball))
+
+        job_data = default_build_data()
+        job_data['build_item_info']['instructions']['install_channels'] = ['other']
+        self.assertNotEqual(fingerprint, self.cache.fingerprint(job_data, tarball))
+
+        job_data = default_build_data()
+        job_data['build_info']['github_info'] = {
+            'repository': {'name': 'repo', 'owner': {'login': 'owner'}},
+            'ref': 'refs/heads/master',
+            'after': 'abc123',
+        }
+        git_fingerprint = self.cache.fingerprint(job_data)
+        self.assertNotEqual(fingerprint, git_fingerprint)
+        job_data['build_info']['github_info']['after'] = 'def456'
+        self.assertNotEqual(git_fingerprint, self.cache.fingerprint(job_data))
+
+    def test_fingerprint_identity(self):
+        tarball = data_path('example_package.tar.gz')
+        fingerprint = self.cache.fingerprint(default_build_data(), tarball)
+
+        job_data = default_build_data()
+        job_data['package']['name'] = 'other_package'
+        self.assertNotEqual(fingerprint, self.cache.fingerprint(job_data, tarball))
+
+        job_data = default_build_data()
+        job_data['owner']['login'] = 'other_owner'
+        self.assertNotEqual(fingerprint, self.cache.fingerprint(job_data, tarball))
+
+        # Without a git commit or a tarball, the build is not cached
+        self.assertIsNone(self.cache.fingerprint(default_build_data()))
+
+    def test_store_and_lookup(self):
+        target = os.path.join(self.root, 'pkg-1.0-0.tar.bz2')
+        with open(target, 'w') as fd:
+            fd.write('package')
+
+        self.assertIsNone(self.cache.lookup('abc'))
+        cached = self.cache.store('abc', [target])
+        self.assertEqual(cached, self.cache.lookup('abc'))
+        self.assertEqual([os.path.basename(f) for f in cached], ['pkg-1.0-0.tar.bz2'])
+
+        os.unlink(cached[0])
+        self.assertIsNone(self.cache.lookup('abc'))
+
+    def test_trim(self):
+        cache = BuildCache(os.path.join(self.root, 'cache'))
+        target = os.path.join(self.root, 'pkg-1.0-0.tar.bz2')
+        with open(target, 'w') as fd:
+            fd.write('x' * 1000)
+
+        for i, fingerprint in enumerate(['old', 'used', 'new']):
+            cache.store(fingerprint, [target])
+            os.utime(os.path.join(cache.path(fingerprint), cache.MANIFEST), (i, i))
+        # A lookup is a use of the entry
+        self.assertIsNotNone(cache.lookup('used'))
+        os.utime(os.path.join(cache.path('new'), cache.MANIFEST), (100, 100))
+
+        # The entries of 1000 bytes and a manifest, used long enough ago
+        cache.max_size = 1500
+        self.assertGreater(cache.trim(), 2000)
+        self.assertIsNone(cache.lookup('old'))
+        self.assertIsNone(cache.lookup('new'))
+        self.assertIsNotNone(cache.lookup('used'))
+        self.assertEqual(cache.trim(), 0)
+
+
+@unittest.skipIf(os.name == 'nt', 'Uses a bash build script')
+class TestWorkerBuildCache(unittest.TestCase):
+
+    def write_script(self, gen_build_script):
+        script_path = os.path.join(tempfile.mkdtemp(), 'script_filename.sh')
+        self.addCleanup(shutil.rmtree, os.path.dirname(script_path))
+        with open(script_path, 'w') as fd:
+            print('#!/bin/bash', file=fd)
+            print('mkdir -p source', file=fd)
+            print('echo package > source/pkg-1.0-0.tar.bz2', file=fd)
+            print('exit 0', file=fd)
+        os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IEXEC)
+        gen_build_script.return_value = script_path
+
+    @patch('binstar_build_client.worker.utils.script_generator.gen_build_script')
+    def test_second_build_uses_cache(self, gen_build_script):
+        self.write_script(gen_build_script)
+
+        worker = MyWorker()
+        worker.args.conda_build_dir = None
+        worker.build_cache = BuildCache(os.path.join(worker.args.cwd, 'cache'))
+
+        def job_data():
+            job_data = default_build_data()
+            job_data['build_item_info']['instructions']['build_targets'] = '*.tar.bz2'
+            return job_data
+
+        failed, status = worker.build(job_data())
+        self.assertEqual(status, 'success')
+        self.assertIsNone(gen_build_script.call_args[1]['cached_files'])
+
+        failed, status = worker.build(job_data())
+        self.assertEqual(status, 'success')
+        cached_files = gen_build_script.call_args[1]['cached_files']
+        self.assertEqual([os.path.basename(f) for f in cached_files], ['pkg-1.0-0.tar.bz2'])
+        self.assertTrue(cached_files[0].startswith(worker.build_cache.root))
+
+
+if __name__ == '__main__':
+    unittest.main()
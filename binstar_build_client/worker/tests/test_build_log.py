@@ -1,7 +1,9 @@
 from __future__ import print_function, unicode_literals, absolute_import
 
+import io
 import os
 import tempfile
+import threading
 import unittest
 
 import time
@@ -13,6 +15,7 @@ from six import text_type
 from six.moves import urllib
 
 from binstar_build_client import BinstarBuildAPI
+from binstar_build_client.tests.log_server import LogServer
 from binstar_build_client.worker.utils import build_log
 from binstar_build_client.worker.utils.build_log import BuildLog, wrap_file
 from binstar_build_client.worker.utils.generator_file import GeneratorFile
@@ -185,6 +188,65 @@ nope
         )
 
 
+class TestTimings(unittest.TestCase):
+    def setUp(self):
+        tempdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(tempdir, 'build-log-timings.txt')
+        self.bs = mock.Mock()
+        self.bs.log_build_output_structured.return_value = False
+
+    def tearDown(self):
+        try:
+            os.unlink(self.filepath)
+        except (OSError, IOError):
+            pass
+
+    def mk_log(self):
+        return BuildLog(self.bs, "user_name", "queue_name", "worker_id", 123,
+                        filename=self.filepath)
+
+    @mock.patch('binstar_build_client.worker.utils.build_log.monotonic')
+    def test_commands_and_sections_are_timed(self, monotonic):
+        monotonic.side_effect = [0, 1, 2, 5, 6, 9, 10]
+        with self.mk_log() as log:
+            log.writeline(build_log.encode_metadata({'section': 'script'}))
+            log.writeline(build_log.encode_metadata({'command': 'make'}))
+            log.writeline(b'building\n')
+            log.writeline(build_log.encode_metadata({'command': None}))
+            log.writeline(build_log.encode_metadata({'command': 'make test'}))
+            log.writeline(build_log.encode_metadata({'command': None}))
+            timings = log.finish_timings()
+
+        self.assertEqual(timings, [
+            {'section': 'dequeue_build', 'command': None, 'duration': 1},
+            {'section': 'script', 'command': 'make', 'duration': 3},
+            {'section': 'script', 'command': 'make test', 'duration': 3},
+            {'section': 'script', 'command': None, 'duration': 9},
+        ])
+
+    def test_summary(self):
+        with self.mk_log() as log:
+            log.writeline(build_log.encode_metadata({'section': 'script'}))
+            log.writeline(build_log.encode_metadata({'command': 'make'}))
+            log.writeline(build_log.encode_metadata({'command': None}))
+            log.write_timing_summary()
+
+        with open(self.filepath, 'rb') as fd:
+            output = fd.read()
+
+        self.assertIn(b'[Slowest Steps]', output)
+        self.assertIn(b'script                 make\n', output)
+        self.assertEqual(log.metadata['section'], 'timing_summary')
+
+    def test_no_summary_without_steps(self):
+        with self.mk_log() as log:
+            log.writeline(b'hello\n')
+            log.write_timing_summary()
+
+        with open(self.filepath, 'rb') as fd:
+            self.assertEqual(fd.read(), b'hello\n')
+
+
 class TestServer(unittest.TestCase):
     def setUp(self):
         tempdir = tempfile.mkdtemp()
@@ -266,6 +328,116 @@ class TestServer(unittest.TestCase):
             self.assertTrue(log.terminated(), "Should terminate after MAX_WRITE_ATTEMPTS")
 
 
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        tempdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(tempdir, 'build-log-batch.txt')
+
+    def tearDown(self):
+        try:
+            os.unlink(self.filepath)
+        except (OSError, IOError):
+            pass
+
+    def write_build(self, log):
+        log.writeline(build_log.encode_metadata({'section': 'script', 'command': 'make'}))
+        for i in range(100):
+            log.writeline('compiling module_{0}.c\n'.format(i).encode('utf-8'))
+        log.writeline(build_log.encode_metadata({'section': 'test', 'command': 'make test'}))
+        log.writeline(b'ok\n')
+
+    def test_batch(self):
+        with LogServer() as server:
+            with BuildLog(BinstarBuildAPI(domain=server.url), 'user_name', 'queue_name',
+                          'worker_id', 123, filename=self.filepath, batch=True) as log:
+                self.write_build(log)
+
+        with open(self.filepath, 'rb') as fd:
+            self.assertEqual(server.log('123').encode('utf-8'), fd.read())
+        self.assertEqual(server.requests, {'tagged-log-batch': 1})
+        # compressed, the batch is smaller than the log itself
+        self.assertLess(server.bytes['tagged-log-batch'], os.path.getsize(self.filepath))
+
+        entries = server.entries['123']
+        self.assertEqual([entry['seq'] for entry in entries], list(range(len(entries))))
+        self.assertEqual(entries[0]['section'], 'script')
+        self.assertEqual(entries[-1]['section'], 'test')
+        self.assertEqual(entries[-1]['msg'], 'ok\n')
+
+    def test_batch_falls_back(self):
+        with LogServer(batch=False) as server:
+            with BuildLog(BinstarBuildAPI(domain=server.url), 'user_name', 'queue_name',
+                          'worker_id', 123, filename=self.filepath, batch=True) as log:
+                self.write_build(log)
+
+        with open(self.filepath, 'rb') as fd:
+            self.assertEqual(server.log('123').encode('utf-8'), fd.read())
+        self.assertEqual(list(server.requests), ['tagged-log'])
+        self.assertEqual(server.entries['123'][-1]['section'], 'test')
+
+    def test_batch_sent_again_after_failure(self):
+        bs = mock.Mock()
+        bs.log_build_output_batch.side_effect = [build_log.BinstarError('oops'), False, False]
+        log = BuildLog(bs, 'user_name', 'queue_name', 'worker_id', 123,
+                       filename=self.filepath, batch=True)
+        with log:
+            log.writeline(b'first\n')
+            log.flush()
+            log.send_batch()
+            self.assertEqual(log.write_failures, 1)
+            log.writeline(b'second\n')
+            log.flush()
+            log.send_batch()
+            self.assertEqual(log.write_failures, 0)
+
+        chunks = bs.log_build_output_batch.call_args_list[1][0][4]
+        self.assertEqual([(chunk['seq'], chunk['msg']) for chunk in chunks],
+                         [(0, b'first\n'), (1, b'second\n')])
+        # nothing is pending, closing the log does not send an empty batch
+        self.assertEqual(bs.log_build_output_batch.call_count, 2)
+
+    def test_batch_sent_while_silent(self):
+        bs = mock.Mock()
+        bs.log_build_output_batch.return_value = False
+        log = BuildLog(bs, 'user_name', 'queue_name', 'worker_id', 123,
+                       filename=self.filepath, batch=True)
+        with log:
+            log.writeline(b'first\n')
+            log.flush()
+            self.assertEqual(bs.log_build_output_batch.call_count, 0)
+            self.assertEqual(log.pending_bytes, len(b'first\n'))
+
+            # the build prints nothing for INTERVAL seconds
+            log._last_send -= BuildLog.INTERVAL
+            log.flush()
+            self.assertEqual(bs.log_build_output_batch.call_count, 1)
+            self.assertEqual((log.pending, log.pending_bytes), ([], 0))
+
+    def test_fallback_failure_not_sent_again(self):
+        with LogServer(batch=False) as server:
+            bs = BinstarBuildAPI(domain=server.url)
+            log = BuildLog(bs, 'user_name', 'queue_name', 'worker_id', 123,
+                           filename=self.filepath, batch=True)
+            log.writeline(b'first\n')
+            log.flush()
+            log.writeline(b'second\n')
+            log.flush()
+
+            # the second request of the fallback fails
+            structured = bs.log_build_output_structured
+            responses = [structured, mock.Mock(side_effect=build_log.BinstarError('oops'))]
+            with mock.patch.object(bs, 'log_build_output_structured',
+                                   side_effect=lambda *args: responses.pop(0)(*args)):
+                log.send_batch()
+            self.assertEqual(log.write_failures, 1)
+            self.assertEqual([chunk['msg'] for chunk in log.pending], [b'second\n'])
+            self.assertEqual(log.pending_bytes, len(b'second\n'))
+
+            log.close()
+
+        self.assertEqual(server.log('123'), 'first\nsecond\n')
+
+
 class TestBuffering(unittest.TestCase):
 
     def test_wrapper(self):
@@ -290,6 +462,35 @@ class TestBuffering(unittest.TestCase):
             'Windows output\r\n',
         ], lines)
 
+    def test_wrapper_pipe(self):
+        # A line of a buffered stdout is read without waiting for more output
+        read_end, write_end = os.pipe()
+        stdout = io.open(read_end, 'rb')
+        self.addCleanup(stdout.close)
+        self.addCleanup(os.close, write_end)
+        os.write(write_end, b'first line\n')
+
+        fd = wrap_file(stdout)
+        self.assertIs(fd.buffer, stdout)
+        line = []
+        reader = threading.Thread(target=lambda: line.append(fd.readline()))
+        reader.daemon = True
+        reader.start()
+        reader.join(5)
+        self.assertEqual(line, ['first line\n'])
+
+    def test_wrapper_generator_file_read1(self):
+        def output():
+            yield b'x' * 100
+            yield b'tail\n'
+        generator_file = GeneratorFile(output())
+        self.assertIs(wrap_file(generator_file).buffer, generator_file)
+
+        self.assertEqual(generator_file.read1(60), b'x' * 60)
+        self.assertEqual(generator_file.read1(), b'x' * 40)
+        self.assertEqual(generator_file.read1(), b'tail\n')
+        self.assertEqual(generator_file.read1(), b'')
+
     def test_generator_file(self):
         def output():
             yield b'Some '
@@ -324,6 +525,22 @@ class TestBuffering(unittest.TestCase):
         self.assertEqual(b''.join(bufs),
                          b'Some output that is larger than the buffer\nAnd more')
 
+    def test_generator_file_memoryview(self):
+        def output():
+            yield b'x' * 1000
+            yield b'tail'
+        fd = GeneratorFile(output())
+
+        buf = bytearray(64)
+        self.assertEqual(fd.readinto(buf), 64)
+        # The rest of a chunk is a view on the chunk, not a copy
+        self.assertIsInstance(fd.pending, memoryview)
+        self.assertEqual(len(fd.pending), 1000 - 64)
+
+        self.assertEqual(fd.readinto(buf), 64)
+        self.assertEqual(fd.readall(), b'x' * (1000 - 128) + b'tail')
+        self.assertEqual(fd.readinto(buf), 0)
+
     def test_buffer_send_when_available(self):
         def output():
             yield b'Data\r'
@@ -7,8 +7,13 @@ import unittest
 import tempfile
 
 
+import mock
+import shutil
+
 from binstar_build_client.worker_commands.register import get_platform
+from binstar_build_client.worker.utils import script_generator, templates
 from binstar_build_client.worker.utils.script_generator import gen_build_script
+from binstar_build_client.worker.utils.templates import TemplateCache
 
 def default_build_data():
     return {
@@ -324,6 +329,76 @@ class TestContent(unittest.TestCase):
         self.assertIn('README.md', content)
         self.assertIn('--force', content)
 
+    def test_native_upload(self):
+        build_data = default_build_data()
+        build_data['build_item_info']['instructions']['build_targets'] = ['README.md']
+
+        content = self.generate_script(build_data, native_upload=True)
+
+        self.assertIn('The build targets are uploaded by the worker', content)
+        self.assertNotIn('README.md', content)
+
+    def test_shared_pkgs_cache(self):
+        build_data = default_build_data()
+
+        content = self.generate_script(build_data)
+        self.assertIn('conda clean --lock', content)
+        self.assertNotIn('pkgs_dirs', content)
+
+        content = self.generate_script(build_data, shared_pkgs_cache=True)
+        self.assertNotIn('conda clean', content)
+        self.assertIn('--add pkgs_dirs "$CONDA_PKGS_DIRS"', content)
+
+    def test_cached_build_targets(self):
+        build_data = default_build_data()
+        build_data['build_item_info']['instructions']['build_targets'] = 'conda'
+
+        content = self.generate_script(build_data, conda_build_dir='/conda-bld',
+                                       cached_files=['/cache/abc/pkg 1.0.tar.bz2'])
+
+        self.assertIn('Build cache hit', content)
+        self.assertNotIn('/conda-bld/*.tar.bz2', content)
+        self.assertNotIn('UNIQUE SCRIPT MARKER\n', content.split('main(){')[1])
+        if os.name != 'nt':
+            self.assertIn("'/cache/abc/pkg 1.0.tar.bz2' --build-id", content)
+
+
+class TestTemplateCache(unittest.TestCase):
+
+    def test_templates_are_cached(self):
+        cache = TemplateCache(globals=script_generator.GLOBALS)
+        template = cache.get_template('build_script.sh')
+        self.assertIs(template, cache.get_template('build_script.sh'))
+
+        cache.clear()
+        self.assertIsNot(template, cache.get_template('build_script.sh'))
+
+    def test_precompiled_templates(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        for name in os.listdir(templates.DATA_DIR):
+            if templates.is_template(name):
+                shutil.copy(path.join(templates.DATA_DIR, name), data_dir)
+
+        self.assertIsNone(templates.compiled_templates_dir(data_dir))
+        compiled = templates.precompile_templates(data_dir)
+        self.assertEqual(templates.compiled_templates_dir(data_dir), compiled)
+
+        build_data = default_build_data()
+        cache = TemplateCache(data_dir, globals=script_generator.GLOBALS)
+        with mock.patch.object(script_generator, 'TEMPLATES', cache):
+            precompiled = script_generator.render_build_script('/working_dir', build_data)
+        self.assertEqual(precompiled, script_generator.render_build_script('/working_dir', default_build_data()))
+
+    def test_stale_precompiled_templates(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        shutil.copy(path.join(templates.DATA_DIR, 'build_script.sh'), data_dir)
+        templates.precompile_templates(data_dir)
+
+        with mock.patch('jinja2.__version__', '0.0'):
+            self.assertIsNone(templates.compiled_templates_dir(data_dir))
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.test_timeout']
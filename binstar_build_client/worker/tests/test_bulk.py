@@ -0,0 +1,89 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock, patch
+import requests
+
+from binstar_client import errors
+from binstar_build_client.worker import bulk
+from binstar_build_client.worker.register import WorkerConfiguration, WorkerRegistry
+
+
+@patch.object(bulk, 'RETRY_DELAY', 0)
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.addCleanup(setattr, WorkerRegistry, 'CACHE_DIR', WorkerRegistry.CACHE_DIR)
+        WorkerRegistry.CACHE_DIR = cache_dir
+
+        self.bs = Mock(domain='https://api.anaconda.org', token='token')
+        self.bs.build_queues.return_value = [
+            {'_id': 'build-username-queue', 'workers': [
+                {'id': 'id{0}'.format(i), 'name': 'old-{0}'.format(i), 'platform': 'linux-64',
+                 'hostname': 'host', 'dist': 'dist'} for i in range(5)]},
+        ]
+
+    def test_register_many(self):
+        self.bs.register_worker.side_effect = lambda *args, **kwargs: 'id-' + kwargs['name']
+        names = ['new-{0}'.format(i) for i in range(10)]
+
+        results = WorkerConfiguration.register_many(self.bs, 'username', 'queue', 'linux-64',
+                                                    'host', 'dist', names, jobs=4)
+
+        self.assertEqual([result['worker_id'] for result in results],
+                         ['id-' + name for name in names])
+        self.assertEqual(self.bs.register_worker.call_count, 10)
+        self.assertEqual(self.bs.build_queues.call_count, 1)
+
+    def test_register_duplicates(self):
+        with self.assertRaises(errors.BinstarError):
+            WorkerConfiguration.register_many(self.bs, 'username', 'queue', 'linux-64',
+                                              'host', 'dist', ['new-1', 'old-2'])
+        with self.assertRaises(errors.BinstarError):
+            WorkerConfiguration.register_many(self.bs, 'username', 'queue', 'linux-64',
+                                              'host', 'dist', ['new-1', 'new-1'])
+        self.assertFalse(self.bs.register_worker.called)
+
+    def test_register_not_retried(self):
+        self.bs.register_worker.side_effect = requests.ConnectionError('reset')
+        results = bulk.register_workers(self.bs, 'username', 'queue', 'linux-64',
+                                        'host', 'dist', ['new-1'])
+        self.assertEqual(results[0]['attempts'], 1)
+        self.assertEqual(self.bs.register_worker.call_count, 1)
+
+    def test_deregister_all(self):
+        attempts = []
+
+        def remove_worker(username, queue, worker_id):
+            attempts.append(worker_id)
+            if worker_id == 'id1' and attempts.count('id1') == 1:
+                raise requests.ConnectionError('reset')
+            return worker_id != 'id3'
+        self.bs.remove_worker.side_effect = remove_worker
+
+        with self.assertRaises(errors.BinstarError):
+            WorkerConfiguration.deregister_all(self.bs, jobs=3)
+
+        self.assertEqual(sorted(set(attempts)), ['id0', 'id1', 'id2', 'id3', 'id4'])
+        self.assertEqual(attempts.count('id1'), 2)
+
+    def test_format_results(self):
+        lines = bulk.format_results([
+            {'name': 'w1', 'worker_id': 'id1', 'error': None, 'attempts': 2},
+            {'name': 'worker2', 'worker_id': 'id2', 'error': errors.NotFound('gone'), 'attempts': 1},
+        ], 'deregistered')
+
+        self.assertEqual(lines, [
+            'NAME     WORKER ID  RESULT',
+            'w1       id1        deregistered (2 attempts)',
+            'worker2  id2        failed: gone',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
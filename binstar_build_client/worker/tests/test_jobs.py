@@ -81,6 +81,12 @@ class MyWorker(Worker):
         args = Mock()
         args.status_file = None
         args.timeout = 100
+        args.build_cache = None
+        args.upload_jobs = 0
+        args.log_batch = False
+        args.telemetry_interval = 0
+        args.telemetry_upload = False
+        args.metrics_port = None
         args.show_new_procs = False
         args.cwd = tempfile.mkdtemp()
 
@@ -226,6 +232,37 @@ class Test(unittest.TestCase):
         self.assertTrue(failed)
         self.assertEqual(status, 'error')
 
+    @patch('binstar_build_client.worker.utils.uploader.Uploader')
+    @patch('binstar_build_client.worker.utils.script_generator.gen_build_script')
+    def test_build_upload_jobs(self, gen_build_script, Uploader):
+
+        self.write_script(gen_build_script, script_generator.EXIT_CODE_OK)
+
+        worker = self.get_worker()
+        worker.upload_jobs = 2
+        worker.build_targets = Mock(return_value=['/build/pkg-1.0-0.tar.bz2'])
+        result = {'filename': '/build/pkg-1.0-0.tar.bz2', 'basename': 'pkg-1.0-0.tar.bz2',
+                  'size': 2 * 1024 * 1024, 'seconds': 0.5, 'attempts': 1, 'error': None}
+        Uploader.return_value.upload.return_value = [result]
+
+        job_data = default_build_data()
+        job_data['build_item_info']['instructions']['build_targets'] = 'pkg-*.tar.bz2'
+        failed, status = worker.build(job_data)
+
+        self.assertFalse(failed)
+        self.assertEqual(status, 'success')
+        self.assertTrue(gen_build_script.call_args[1]['native_upload'])
+        with open(worker.build_logfile(job_data)) as fd:
+            self.assertIn('Uploaded pkg-1.0-0.tar.bz2 (2.0 MB in 0.5s, 4.0 MB/s)', fd.read())
+
+        result['error'] = 'Conflict: file exists'
+        failed, status = worker.build(default_build_data())
+        self.assertEqual(status, 'success', 'a build without build targets has nothing to upload')
+
+        failed, status = worker.build(job_data)
+        self.assertTrue(failed)
+        self.assertEqual(status, 'error')
+
 
     expected_output_timeout = (
         "Building on worker test_hostname (platform test_platform)\n"
@@ -373,8 +410,22 @@ class TestDockerWorker(DockerWorker):
         args = Mock()
         args.status_file = None
         args.timeout = 100
+        args.build_cache = None
+        args.upload_jobs = 0
+        args.log_batch = False
+        args.telemetry_interval = 0
+        args.telemetry_upload = False
+        args.metrics_port = None
         args.show_new_procs = False
         args.image = 'binstar/linux-64'
+        args.allow_user_images = False
+        args.container_pool = 0
+        args.bind_staging = False
+        args.conda_pkgs_volume = None
+        args.one = False
+        args.concurrency = 1
+        args.cpus = args.cpu_shares = args.pids_limit = None
+        args.memory = args.memory_swap = args.tmpfs = None
         args.cwd = tempfile.mkdtemp()
 
         worker_config = WorkerConfiguration(
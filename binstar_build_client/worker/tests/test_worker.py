@@ -4,11 +4,14 @@ from mock import Mock, patch
 import io
 import os
 import re
+import shutil
 import unittest
 
 import requests
 
+from binstar_build_client import BinstarBuildAPI
 from binstar_build_client.worker.register import WorkerConfiguration
+from binstar_build_client.worker.utils.build_log import BuildLog
 from binstar_build_client.worker.worker import Worker
 from binstar_client import errors
 import tempfile
@@ -22,6 +25,12 @@ class MockWorker(Worker):
         args = Mock()
         args.status_file = None
         args.timeout = 100
+        args.build_cache = None
+        args.upload_jobs = 0
+        args.log_batch = False
+        args.telemetry_interval = 0
+        args.telemetry_upload = False
+        args.metrics_port = None
 
         worker_config = WorkerConfiguration(
             'worker_name',
@@ -46,6 +55,51 @@ class Test(unittest.TestCase):
         self.assertEqual(worker.bs.finish_build.call_count, 1)
         self.assertEqual(worker.bs.finish_build.call_args[1], {'status': 'success', 'failed': False})
 
+    @patch('binstar_build_client.worker.worker.worker_stats.stats_fingerprint')
+    def test_upload_stats(self, stats_fingerprint):
+        stats_fingerprint.return_value = 'fingerprint'
+        cache = Mock()
+        cache.is_uploaded.return_value = False
+        cache.collect.return_value = {'df': {'cmd': 'df', 'out': ''}}
+
+        worker = MockWorker()
+        worker.upload_stats(cache)
+        self.assertEqual(worker.bs.upload_worker_stats.call_args[1],
+                         {'stats': {'df': {'cmd': 'df', 'out': ''}}})
+        cache.mark_uploaded.assert_called_once_with('worker_id', 'fingerprint')
+
+        # Not uploaded again until the fingerprint changes
+        cache.is_uploaded.return_value = True
+        worker.upload_stats(cache)
+        self.assertEqual(worker.bs.upload_worker_stats.call_count, 1)
+
+    @patch('binstar_build_client.worker.worker.worker_stats.stats_fingerprint')
+    def test_upload_telemetry(self, stats_fingerprint):
+        stats_fingerprint.return_value = 'fingerprint'
+        cache = Mock()
+        cache.is_uploaded.return_value = True
+        cache.collect.return_value = {'df': {'cmd': 'df', 'out': ''}}
+
+        worker = MockWorker()
+        worker.args.telemetry_upload = True
+        worker.telemetry = Mock()
+        worker.telemetry.stats.return_value = {'host telemetry': {'cmd': 'psutil', 'out': []}}
+
+        # Uploaded on schedule even if the stats did not change
+        worker.upload_telemetry(cache)
+        self.assertEqual(sorted(worker.bs.upload_worker_stats.call_args[1]['stats']),
+                         ['df', 'host telemetry'])
+
+    @patch('binstar_build_client.worker.worker.log')
+    def test_telemetry_upload_without_interval(self, log):
+        worker = MockWorker()
+        self.assertFalse(log.warn.called)
+
+        worker.args.telemetry_upload = True
+        Worker.__init__(worker, worker.bs, worker.config, worker.args)
+        self.assertIsNone(worker.telemetry)
+        self.assertIn('--telemetry-interval', log.warn.call_args[0][0])
+
     def test_failed_job(self):
 
         class MyWorker(MockWorker):
@@ -124,6 +178,34 @@ class Test(unittest.TestCase):
             worker.write_status.assert_called_with(False, "worker not found")
 
 
+    def test_read_timeouts(self):
+        # The read timeouts of the transport are not retried for POST requests
+        worker = MockWorker()
+        worker.args.one = True
+        worker.args.push_back = False
+        worker.bs = BinstarBuildAPI(token='token', domain='https://api.example.com')
+        job = requests.Response()
+        job.status_code = 200
+        job._content = b'{"job": {"_id": "test_job_id"}, "job_name": "job_name"}'
+
+        with patch.object(worker.bs.session, 'post',
+                          side_effect=[requests.ReadTimeout(), job]) as post:
+            jobs = list(worker.job_loop())
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(jobs[0]['job']['_id'], 'test_job_id')
+
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        filename = os.path.join(tempdir, 'build-log.txt')
+        with patch.object(worker.bs.session, 'post', side_effect=requests.ReadTimeout()):
+            with BuildLog(worker.bs, 'username', 'queue', 'worker_id', 'test_job_id',
+                          filename=filename) as build_log:
+                build_log.writeline(b'x' * 100 + b'\n')
+                self.assertEqual(build_log.write_failures, 1)
+                self.assertFalse(build_log.terminated())
+
+            worker._finish_job(jobs[0], False, 'success')
+
     def test_job_context(self):
 
         worker = MockWorker()
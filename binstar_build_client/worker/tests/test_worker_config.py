@@ -1,9 +1,15 @@
 from glob import glob
 import os
+import shutil
+import tempfile
 import unittest
 
+from mock import Mock, patch
+import yaml
+
 from binstar_client import errors
-from binstar_build_client.worker.register import WorkerConfiguration
+from binstar_build_client.worker.register import WorkerConfiguration, WorkerRegistry, fcntl
+from binstar_build_client.worker.utils.worker_status import WorkerStatus
 
 
 test_workers = os.path.abspath('./test-workers')
@@ -83,5 +89,117 @@ class Test(unittest.TestCase):
 
         self.assertFalse(wc.is_running())
 
+    @unittest.skipIf(fcntl is None, 'requires fcntl')
+    def test_running_workers(self):
+        wc = WorkerConfiguration(
+            'worker_name',
+            'worker_id', 'username', 'queue',
+            'platform', 'hostname', 'dist'
+        )
+
+        # A lock file left by a worker that died is not locked
+        with open(wc.lock_file, 'w') as fd:
+            fd.write('1')
+        self.assertEqual(WorkerConfiguration.running_workers(), {})
+        self.assertIsNone(wc.pid)
+
+        with wc.running():
+            self.assertEqual(WorkerConfiguration.running_workers(),
+                             {'worker_name': os.getpid()})
+            self.assertEqual(wc.pid, os.getpid())
+
+        self.assertEqual(WorkerConfiguration.running_workers(), {})
+        self.assertFalse(os.path.exists(wc.lock_file))
+
+    def test_backwards_compat_cached(self):
+        with open(os.path.join(test_workers, 'old_name'), 'w') as fd:
+            fd.write(yaml.safe_dump({'worker_id': 'old_id'}))
+
+        with patch('binstar_build_client.worker.register.yaml.load', wraps=yaml.load) as load:
+            for _ in range(10):
+                wc = WorkerConfiguration('new_name', 'old_id', 'username', 'queue',
+                                         'platform', 'hostname', 'dist')
+                self.assertEqual(wc.name, 'old_name')
+            self.assertEqual(load.call_count, 1)
+
+            # Adding a file to the directory computes the lookup again
+            open(os.path.join(test_workers, 'old_name.123'), 'w').close()
+            self.assertEqual(WorkerConfiguration.backwards_compat_lookup(), {'old_id': 'old_name'})
+            self.assertEqual(load.call_count, 2)
+
+    def test_status_does_not_invalidate_lookup(self):
+        with open(os.path.join(test_workers, 'old_name'), 'w') as fd:
+            fd.write(yaml.safe_dump({'worker_id': 'old_id'}))
+        status_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, status_dir)
+
+        with patch.object(WorkerConfiguration, 'STATUS_DIR', status_dir), \
+                patch('binstar_build_client.worker.register.yaml.load', wraps=yaml.load) as load:
+            wc = WorkerConfiguration('new_name', 'old_id', 'username', 'queue',
+                                     'platform', 'hostname', 'dist')
+            status = WorkerStatus(wc.status_file, wc.to_dict())
+            for _ in range(3):
+                status.update(True, 'ok')
+                self.assertEqual(WorkerConfiguration.backwards_compat_lookup(), {'old_id': 'old_name'})
+            self.assertEqual(load.call_count, 1)
+            self.assertEqual(os.listdir(status_dir), ['old_name.status.json'])
+
+
+def build_queues():
+    return [
+        {'_id': 'build-username-queue', 'workers': [
+            {'id': 'id1', 'name': 'worker1', 'platform': 'linux-64',
+             'hostname': 'host', 'dist': 'dist'},
+            {'id': 'id2', 'platform': 'linux-64', 'hostname': 'host', 'dist': 'dist'},
+        ]},
+        {'_id': 'build-username-empty'},
+    ]
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.addCleanup(setattr, WorkerRegistry, 'CACHE_DIR', WorkerRegistry.CACHE_DIR)
+        WorkerRegistry.CACHE_DIR = cache_dir
+
+    def get_binstar(self):
+        bs = Mock(domain='https://api.anaconda.org', token='token')
+        bs.build_queues.side_effect = lambda username: build_queues()
+        return bs
+
+    def test_fetch_once(self):
+        bs = self.get_binstar()
+
+        worker = WorkerConfiguration.load('worker1', bs)
+        self.assertEqual(worker.worker_id, 'id1')
+        self.assertEqual(worker.queue, 'queue')
+        self.assertEqual(WorkerConfiguration.load('id2', bs).name, 'id2')
+        WorkerConfiguration.validate_worker_name(bs, 'worker1')
+        with self.assertRaises(errors.BinstarError):
+            WorkerConfiguration.load('worker3', bs)
+
+        self.assertEqual(bs.build_queues.call_count, 1)
+
+    def test_ttl(self):
+        WorkerConfiguration.load('worker1', self.get_binstar(), ttl=60)
+
+        # Another worker of this host reads the cached build queues
+        bs = self.get_binstar()
+        self.assertEqual(WorkerConfiguration.load('worker1', bs, ttl=60).worker_id, 'id1')
+        self.assertFalse(bs.build_queues.called)
+
+        # Registering a worker removes the cache
+        bs.register_worker.return_value = 'id3'
+        WorkerConfiguration.register(bs, 'username', 'queue', 'linux-64', 'host', 'dist',
+                                     name='worker3')
+        self.assertEqual(os.listdir(WorkerRegistry.CACHE_DIR), [])
+
+        with self.assertRaises(errors.BinstarError):
+            WorkerConfiguration.register(bs, 'username', 'queue', 'linux-64', 'host', 'dist',
+                                         name='worker1')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,197 @@
+"""
+Cache the build targets of successful builds on the worker
+
+Re-triggered builds with the same source, engine, environment and
+instructions can reuse the build targets of a previous build and skip
+straight to uploading them. The least recently used entries are evicted
+when the cache grows over its maximum size.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import time
+
+from binstar_build_client.utils.rm import rm_rf
+from binstar_build_client.worker.utils.script_generator import create_git_context
+
+log = logging.getLogger('binstar.build')
+
+
+def file_sha256(filename, blocksize=2 ** 20):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as fd:
+        data = fd.read(blocksize)
+        while data:
+            digest.update(data)
+            data = fd.read(blocksize)
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+    '''
+    A directory of build targets keyed by the fingerprint of the build inputs
+
+    Each entry is a directory named after the fingerprint, containing the
+    build targets and a manifest listing them. The modification time of the
+    manifest is the last use of the entry.
+
+    :param root: the directory of the cache
+    :param max_size: evict the least recently used entries when the cache
+                     grows over this many bytes, None to never evict
+    :param min_age: never evict the entries used less than `min_age`
+                    seconds ago, a build may be uploading them
+    '''
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, root, max_size=None, min_age=60 * 60):
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self.min_age = min_age
+
+    def fingerprint(self, job_data, build_filename=None):
+        '''
+        Compute the fingerprint of the inputs of a build
+
+        :param job_data: The job information
+        :param build_filename: The source tarball of the build (if the build
+                               is not built from a git repository)
+        :return: (str) hex digest, or None if the source of the build is
+                 unknown and the build can not be cached
+        '''
+        build_item = job_data['build_item_info']
+        build = job_data['build_info']
+        instructions = build_item.get('instructions') or {}
+
+        git_info = create_git_context(build)
+        if git_info:
+            source = {'git': git_info['full_name'], 'commit': git_info['commit']}
+        elif build_filename:
+            source = {'tarball': file_sha256(build_filename)}
+        else:
+            return None
+
+        inputs = {
+            'owner': (job_data.get('owner') or {}).get('login'),
+            'package': (job_data.get('package') or {}).get('name'),
+            'source': source,
+            'sub_dir': build.get('sub_dir'),
+            'platform': build_item.get('platform'),
+            'engine': build_item.get('engine'),
+            'env': build_item.get('envvars', build_item.get('env')),
+            'instructions': instructions,
+            'install_channels': instructions.get('install_channels'),
+        }
+        payload = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, fingerprint):
+        return os.path.join(self.root, fingerprint)
+
+    def lookup(self, fingerprint):
+        '''
+        Return the list of cached build targets for `fingerprint` or
+        None if there is no complete cache entry
+        '''
+        entry = self.path(fingerprint)
+        manifest_file = os.path.join(entry, self.MANIFEST)
+        try:
+            with io.open(manifest_file) as fd:
+                manifest = json.load(fd)
+        except (IOError, OSError, ValueError):
+            return None
+
+        files = [os.path.join(entry, basename) for basename in manifest.get('files', [])]
+        if not files or not all(os.path.isfile(filename) for filename in files):
+            log.warn('Ignoring incomplete build cache entry %s', entry)
+            return None
+
+        try:
+            os.utime(manifest_file, None)
+        except OSError:
+            pass
+        return files
+
+    def store(self, fingerprint, files):
+        '''
+        Copy the build targets `files` of a successful build into the cache
+
+        :return: the list of cached files
+        '''
+        entry = self.path(fingerprint)
+        tmp_entry = '{0}.tmp-{1}'.format(entry, os.getpid())
+        rm_rf(tmp_entry)
+        os.makedirs(tmp_entry)
+
+        basenames = []
+        for filename in files:
+            basename = os.path.basename(filename)
+            if basename in basenames or basename == self.MANIFEST:
+                log.warn('Not caching build targets with the duplicate name %s', basename)
+                rm_rf(tmp_entry)
+                return []
+            shutil.copy2(filename, os.path.join(tmp_entry, basename))
+            basenames.append(basename)
+
+        with io.open(os.path.join(tmp_entry, self.MANIFEST), 'wb') as fd:
+            fd.write(json.dumps({'files': basenames}).encode('utf-8'))
+
+        rm_rf(entry)
+        os.rename(tmp_entry, entry)
+        log.info('Cached %s build targets in %s', len(basenames), entry)
+
+        if self.max_size is not None:
+            self.trim()
+
+        return [os.path.join(entry, basename) for basename in basenames]
+
+    def entries(self):
+        '''
+        The complete entries of the cache
+
+        :return: list of (last_used, size, path), the least recently used first
+        '''
+        result = []
+        for name in os.listdir(self.root):
+            entry = os.path.join(self.root, name)
+            try:
+                last_used = os.path.getmtime(os.path.join(entry, self.MANIFEST))
+                size = sum(os.path.getsize(os.path.join(entry, basename))
+                           for basename in os.listdir(entry))
+            except OSError:
+                # An entry being stored, or not an entry
+                continue
+            result.append((last_used, size, entry))
+
+        result.sort()
+        return result
+
+    def trim(self):
+        '''
+        Evict the least recently used entries, not used for `min_age`
+        seconds, until the cache fits in `max_size`
+
+        :return: the number of bytes evicted
+        '''
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.min_age
+        evicted = 0
+        for last_used, size, entry in entries:
+            if total - evicted <= self.max_size or last_used > cutoff:
+                break
+            try:
+                rm_rf(entry)
+            except (IOError, OSError) as err:
+                log.warn('Could not evict %s from the build cache: %s', entry, err)
+                continue
+            evicted += size
+
+        if evicted:
+            log.info('Evicted %s bytes from the build cache (%s bytes left)',
+                     evicted, total - evicted)
+        return evicted
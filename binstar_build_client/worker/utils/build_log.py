@@ -9,17 +9,29 @@ import functools
 import io
 import json
 import logging
+import time
 
 import requests
 from binstar_client import BinstarError
 
+from binstar_build_client.worker.utils import metrics
+
 log = logging.getLogger('binstar.build')
 
 # write to the servers when more than BUF_SIZE of data has been buffered
 BUF_SIZE = 72 # bytes
+# with batch=True, send the log chunks when more than BATCH_SIZE of data is pending
+BATCH_SIZE = 64 * 1024 # bytes
 METADATA_PREFIX = b'anaconda-build-metadata:'
 # number of write attempts to make before giving up
 MAX_WRITE_ATTEMPTS = 5
+# number of steps to show in the timing summary at the end of the build log
+TIMING_SUMMARY_SIZE = 10
+
+try:
+    monotonic = time.monotonic
+except AttributeError:  # Python 2
+    monotonic = time.time
 
 def encode_metadata(metadata):
     '''
@@ -63,8 +75,11 @@ def wrap_file(fd):
     Returns:
         a text-based file-like object
     '''
-    fd = fd if isinstance(fd, io.IOBase) else io.open(fd.fileno(), 'rb', buffering=0, closefd=False)
-    fd = io.BufferedReader(fd)
+    if not hasattr(fd, 'read1'):
+        fd = fd if isinstance(fd, io.RawIOBase) else io.open(fd.fileno(), 'rb', buffering=0, closefd=False)
+        fd = io.BufferedReader(fd)
+    # A buffered stdout or a GeneratorFile is read as is: read1 returns what
+    # is available, another buffer would wait for 8 KB or the end of output
     fd = io.TextIOWrapper(fd, encoding='utf-8', errors='replace', newline='')
     return fd
 
@@ -73,11 +88,15 @@ class BuildLog(object):
     """
     This IO object writes data build log output to the
     anaconda server and also to a file.
+
+    With batch=True the log chunks, each with its metadata and sequence
+    number, are sent together in one compressed request every `INTERVAL`
+    seconds or `BATCH_SIZE` bytes, instead of one request per chunk.
     """
 
     INTERVAL = 10  # Send logs to server every `INTERVAL` seconds
     def __init__(self, bs, username, queue, worker_id,
-                 job_id, filename=None, quiet=False):
+                 job_id, filename=None, quiet=False, batch=False):
 
         self.bs = bs
         self.username = username
@@ -97,6 +116,18 @@ class BuildLog(object):
         # MAX_WRITE_ATTEMPTS, terminate the build
         self.write_failures = 0
 
+        self.batch = batch
+        # the log chunks not sent yet, and the sequence number of the next one
+        self.pending = []
+        self.pending_bytes = 0
+        self.seq = 0
+        self._last_send = time.time()
+
+        # durations of the sections and commands reported by the build script
+        self.timings = []
+        self._section_start = monotonic()
+        self._command_start = None
+
         self.buf = io.BytesIO()
 
         log.info("Writing build log to %s", filename)
@@ -106,9 +137,79 @@ class BuildLog(object):
         return self.terminate_build
 
     def update_metadata(self, metadata):
+        now = monotonic()
+        new_section = 'section' in metadata and metadata['section'] != self.metadata.get('section')
+        if 'command' in metadata or new_section:
+            self._end_command(now)
+        if new_section:
+            self._end_section(now)
+            self._section_start = now
+
         self.metadata.update(metadata)
+
         if 'section' in metadata:
             log.info('Started section %s', metadata['section'])
+        if metadata.get('command') is not None:
+            self._command_start = now
+
+    def _end_command(self, now):
+        if self._command_start is None:
+            return
+        self.timings.append({
+            'section': self.metadata.get('section'),
+            'command': self.metadata.get('command'),
+            'duration': now - self._command_start,
+        })
+        self._command_start = None
+
+    def _end_section(self, now):
+        if self._section_start is None:
+            return
+        self.timings.append({
+            'section': self.metadata.get('section'),
+            'command': None,
+            'duration': now - self._section_start,
+        })
+        self._section_start = None
+
+    def finish_timings(self):
+        '''
+        Stop the clocks of the current section and command
+
+        Returns:
+            (list) the recorded steps, each a dict with the keys
+            `section`, `command` (None for a whole section) and `duration`
+            in seconds
+        '''
+        now = monotonic()
+        self._end_command(now)
+        self._end_section(now)
+        return self.timings
+
+    def write_timing_summary(self, limit=TIMING_SUMMARY_SIZE):
+        '''
+        Write a table of the slowest steps of this build to the build log
+        '''
+        timings = self.finish_timings()
+        if len(timings) <= 1:
+            # Only the worker's own dequeue step, the build script did not
+            # report any sections or commands
+            return
+
+        self.flush()
+        self.metadata.update({'section': 'timing_summary', 'command': None})
+
+        slowest = sorted(timings, key=lambda step: step['duration'], reverse=True)
+        lines = ['\n', '[Slowest Steps]\n']
+        for step in slowest[:limit]:
+            label = step['command'] or '[{0}]'.format(step['section'])
+            label = label.strip().split('\n')[0]
+            lines.append('{0:>10.1f}s  {1:<22} {2}\n'.format(
+                step['duration'], step['section'], label))
+
+        for line in lines:
+            self.writeline(line.encode('utf-8', 'replace'))
+        self.flush()
 
     def detect_metadata(self, msg):
         # TODO: this call is duplicated in decode_metadata... but exceptions
@@ -161,6 +262,8 @@ class BuildLog(object):
 
     def close(self):
         self.flush()
+        if self.batch:
+            self.send_batch()
         self.buf.close()
         self.fd.close()
         return
@@ -170,16 +273,63 @@ class BuildLog(object):
         msg = self.buf.getvalue()
 
         if not msg:
-            # don't send empty messages to the server
+            # don't send empty messages to the server, but send the pending
+            # chunks of a build which stopped printing
+            self.buf.seek(0)
+            if self.batch and self.pending and time.time() - self._last_send >= self.INTERVAL:
+                self.send_batch()
+            return
+
+        self.fd.write(msg)
+        self.fd.flush()
+
+        if self.batch:
+            self.pending.append(dict(self.metadata, seq=self.seq, msg=msg))
+            self.pending_bytes += len(msg)
+            self.seq += 1
             self.buf.seek(0)
+            if (self.pending_bytes >= BATCH_SIZE or
+                    time.time() - self._last_send >= self.INTERVAL):
+                self.send_batch()
             return
 
+        if self._upload(functools.partial(self.write_to_server, msg, self.metadata), len(msg)):
+            # we have successfully written this data, remove from the buffer
+            self.buf.seek(0)
+
+    def send_batch(self):
+        '''
+        Send the pending log chunks in one request
+        '''
+        self._last_send = time.time()
+        if not self.pending:
+            return
+        send = functools.partial(self.bs.log_build_output_batch, self.username, self.queue,
+                                 self.worker_id, self.job_id, self.pending)
+        # after a failure the chunks are sent again with the next ones, the
+        # server drops the sequence numbers it already has
+        if self._upload(send, self.pending_bytes):
+            self.pending = []
+            self.pending_bytes = 0
+        else:
+            # the fallback to one request per chunk drops the chunks it sent
+            self.pending_bytes = sum(len(chunk['msg']) for chunk in self.pending)
+
+    def _upload(self, send, size):
+        '''
+        Send `size` bytes of build log with `send`
+
+        Returns:
+            (bool) True if the log was sent
+        '''
         terminate_build = False
+        sent = False
         try:
-            self.fd.write(msg)
-            self.fd.flush()
-            terminate_build = self.write_to_server(msg, self.metadata)
-        except (BinstarError, requests.HTTPError, requests.ConnectionError):
+            start = time.time()
+            terminate_build = send()
+            metrics.LOG_UPLOAD_DURATION.observe(time.time() - start)
+        except (BinstarError, requests.HTTPError, requests.ConnectionError, requests.Timeout):
+            metrics.LOG_UPLOAD_FAILURES.inc()
             self.write_failures += 1
             log.warn('Failed to write log to server, %s attempts remaining', MAX_WRITE_ATTEMPTS - self.write_failures)
 
@@ -187,14 +337,14 @@ class BuildLog(object):
                 terminate_build = True
                 log.error('Failed to write log to server %s times in a row, terminating build', self.write_failures)
         else:
-            # we have successfully written this data, remove from the buffer
-            self.buf.seek(0)
+            sent = True
+            metrics.LOG_BYTES.inc(size)
             # reset consecutive failures
             self.write_failures = 0
 
-        log.info('Wrote %s bytes of build output to anaconda-server', len(msg))
+        log.info('Wrote %s bytes of build output to anaconda-server', size)
 
         self.terminate_build = terminate_build
         if terminate_build:
             log.info('anaconda-server responded that the build should be terminated')
-
+        return sent
@@ -0,0 +1,162 @@
+"""
+A pool of created, not yet started, docker containers
+
+Creating a container is on the critical path of every docker build. The
+pool creates the containers of the next builds in the background, while
+a build runs, and removes the containers of finished builds off the
+critical path too.
+
+Pooled containers are created before the job is known, so they all run the
+same command: a fixed entrypoint script in the working directory of the
+image. Each job copies its own entrypoint script into the container before
+starting it.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import logging
+import pipes
+import threading
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+log = logging.getLogger('binstar.build')
+
+ENTRYPOINT = 'anaconda-build-entrypoint.sh'
+POOL_LABEL = 'org.anaconda.build.pool'
+
+
+def entrypoint_script(args):
+    '''
+    The content of the entrypoint script running `args`
+    '''
+    return '#!/bin/bash\nexec {0}\n'.format(' '.join(pipes.quote(arg) for arg in args))
+
+
+class ContainerPool(object):
+    '''
+    Keep `size` containers created for the image a worker builds with
+
+    :param client: the docker client
+    :param size: the number of warm containers per image
+    :param name: identifies the containers of this pool, containers left
+                 over by a previous pool of the same name are removed
+    :param options: extra arguments of `create_container`
+    '''
+    def __init__(self, client, size, name, options=None):
+        self.client = client
+        self.size = size
+        self.labels = {POOL_LABEL: name}
+        self.options = options or {}
+        self._containers = {}
+        self._lock = threading.Lock()
+
+        self._tasks = Queue()
+        self._thread = threading.Thread(target=self._run_tasks, name='container-pool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def command(working_dir):
+        return 'bash {0}/{1}'.format(working_dir, ENTRYPOINT)
+
+    def _run_tasks(self):
+        while True:
+            task = self._tasks.get()
+            try:
+                if task is None:
+                    return
+                task()
+            except Exception:
+                log.warn('Container pool task failed', exc_info=True)
+            finally:
+                self._tasks.task_done()
+
+    def drain(self):
+        '''
+        Wait for the pending creations and removals
+        '''
+        self._tasks.join()
+
+    def _create(self, image, working_dir):
+        return self.client.create_container(image, command=self.command(working_dir),
+                                            labels=self.labels, **self.options)
+
+    def _remove(self, container):
+        self.client.remove_container(container, v=True, force=True)
+
+    def _replenish(self, image, image_id, working_dir):
+        with self._lock:
+            missing = self.size - len(self._containers.get(image_id, []))
+        for _ in range(missing):
+            container = self._create(image, working_dir)
+            with self._lock:
+                self._containers.setdefault(image_id, []).append(container)
+        if missing > 0:
+            log.info('Created %s warm containers for %s', missing, image)
+
+    def get(self, image, image_id, working_dir):
+        '''
+        A created container of `image`, it runs the entrypoint script of the
+        working directory `working_dir` when started
+
+        :param image_id: the current id of `image`, containers of other ids
+                         (images pulled since) are discarded
+        :return: (container, warm) warm is False if the container was
+                 created on demand
+        '''
+        with self._lock:
+            stale = [(other_id, containers) for other_id, containers in self._containers.items()
+                     if other_id != image_id]
+            for other_id, containers in stale:
+                del self._containers[other_id]
+            warm = self._containers.get(image_id)
+            container = warm.pop(0) if warm else None
+
+        for other_id, containers in stale:
+            log.info('Discarding %s warm containers of the previous image %s',
+                     len(containers), other_id)
+            for old in containers:
+                self.release(old)
+
+        created = container is None
+        if created:
+            container = self._create(image, working_dir)
+
+        self._tasks.put(lambda: self._replenish(image, image_id, working_dir))
+        return container, not created
+
+    def release(self, container):
+        '''
+        Remove a container in the background
+        '''
+        self._tasks.put(lambda: self._remove(container))
+
+    def remove_leftovers(self):
+        '''
+        Remove the containers of a previous pool of the same name
+        '''
+        label = '{0}={1}'.format(POOL_LABEL, self.labels[POOL_LABEL])
+        leftovers = self.client.containers(all=True, filters={'label': label})
+        for container in leftovers:
+            log.info('Removing left over container %s', container['Id'])
+            self._remove(container)
+
+    def close(self):
+        '''
+        Stop the background thread and remove the warm containers
+        '''
+        self._tasks.put(None)
+        self._thread.join()
+
+        with self._lock:
+            containers = [c for cs in self._containers.values() for c in cs]
+            self._containers = {}
+
+        for container in containers:
+            try:
+                self._remove(container)
+            except Exception:
+                log.warn('Could not remove container %s', container, exc_info=True)
@@ -75,6 +75,9 @@ goto:eof
     set BINSTAR_BUILD_RESULT=
 
 
+    {% if cached_files %}
+    call:restore_build_cache
+    {% else %}
     {% if ignore_setup_build %}
     echo [ignore setup_build]
     {% else %}
@@ -101,6 +104,7 @@ goto:eof
 
     call:binstar_build
     call:binstar_post_build
+    {% endif %}
 
     call:upload_build_targets
 
@@ -347,6 +351,26 @@ goto:eof
 goto:eof
 
 
+{% if cached_files %}
+:restore_build_cache
+    {{ start_section('build_cache') }}
+
+    echo Build cache hit: reusing the build targets of a previous build with identical inputs
+    {% for filename in cached_files -%}
+    echo {{filename}}
+    {% endfor %}
+
+    echo "set BINSTAR_CONFIG_DIR=%WORKING_DIR%\binstar"
+    set "BINSTAR_CONFIG_DIR=%WORKING_DIR%\binstar"
+    if not exist "%BINSTAR_CONFIG_DIR%" mkdir "%BINSTAR_CONFIG_DIR%"
+    echo "anaconda config --set url %BINSTAR_API_SITE%"
+    anaconda config --set url "%BINSTAR_API_SITE%"
+
+    set "BINSTAR_BUILD_RESULT=success"
+
+goto:eof
+
+{% endif %}
 :upload_build_targets
 
     :: call deactivate
@@ -354,9 +378,8 @@ goto:eof
     set "PATH=%DEACTIVATE_PATH%"
     set "CONDARC="
 
-    {% if instructions.get('test_results') %}
+    {% if instructions.get('test_results') and not cached_files %}
     {{ start_section('upload_test_results') }}
-    {% endif %}
 
     {%for test_result, filename in instructions.get('test_results', {}).items() %}
 
@@ -364,6 +387,7 @@ goto:eof
     anaconda build -q -t "%BINSTAR_API_TOKEN%" results {{test_result}} "%BINSTAR_OWNER%/%BINSTAR_PACKAGE%" "%BINSTAR_BUILD%" {{filename}}
 
     {% endfor %}
+    {% endif %}
 
     if not "%BINSTAR_BUILD_RESULT%" == "success" (
         goto:eof
@@ -374,12 +398,18 @@ goto:eof
     echo.
     echo Running Build in "Test Only" mode, not uploading build targets
 
+    {% elif native_upload %}
+
+    echo.
+    echo The build targets are uploaded by the worker
+
     {% else %}
 
 
     {{ start_section('upload_build_targets') }}
 
-    {% for tgt in files %}
+    {% for tgt in cached_files or files %}
+    {% set tgt = '"%s"' % tgt if cached_files else tgt %}
     echo anaconda -q -t %%TOKEN%% upload {{force_upload}} --user %BINSTAR_OWNER% --package %BINSTAR_PACKAGE% {{labels}} {{tgt}} --build-id %BINSTAR_BUILD_MAJOR%
     anaconda -q -t "%BINSTAR_API_TOKEN%" upload {{force_upload}} --user "%BINSTAR_OWNER%" --package "%BINSTAR_PACKAGE%" {{labels}} {{tgt}} --build-id "%BINSTAR_BUILD%" || ( {{ set_error() }} )
     {% else %}
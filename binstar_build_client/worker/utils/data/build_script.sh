@@ -82,14 +82,21 @@ setup_build(){
     echo "Host:" `hostname`
     echo 'Setting engine'
 
+    {% if shared_pkgs_cache %}
+    # The package cache is shared with other builds, the worker cleans it
+    echo "Using the shared package cache $CONDA_PKGS_DIRS"
+    {% else %}
     echo "conda clean -pt > /dev/null"
     conda clean -pt > /dev/null
+    {% endif %}
 
     echo "conda-clean-build-dir"
     conda-clean-build-dir
 
+    {% if not shared_pkgs_cache %}
     echo "conda clean --lock"
     conda clean --lock
+    {% endif %}
 
     export CONDARC="${WORKING_DIR}/condarc"
 
@@ -98,6 +105,9 @@ setup_build(){
     {% for install_channel in install_channels -%}
     conda config --file "$CONDARC" --add channels {{install_channel}}
     {% endfor %}
+    {% if shared_pkgs_cache %}
+    conda config --file "$CONDARC" --add pkgs_dirs "$CONDA_PKGS_DIRS"
+    {% endif %}
     conda config --file "$CONDARC" \
                  --set binstar_upload no \
                  --set always_yes yes \
@@ -250,6 +260,25 @@ bb_after_script() {
 
 }
 
+{% if cached_files %}
+restore_build_cache(){
+    {{ start_section('build_cache') }}
+
+    echo "Build cache hit: reusing the build targets of a previous build with identical inputs"
+    {% for filename in cached_files -%}
+    echo {{ quote(filename) }}
+    {% endfor %}
+
+    echo "export BINSTAR_CONFIG_DIR=${WORKING_DIR}/binstar"
+    export BINSTAR_CONFIG_DIR="${WORKING_DIR}/binstar"
+    mkdir -p "${BINSTAR_CONFIG_DIR}"
+    echo "anaconda config --set url \"${BINSTAR_API_SITE}\""
+    anaconda config --set url "${BINSTAR_API_SITE}"
+
+    export BINSTAR_BUILD_RESULT="success"
+}
+{% endif %}
+
 #### #### #### #### #### #### #### #### #### #### #### #### #### ####
 # Assemble build commands
 #### #### #### #### #### #### #### #### #### #### #### #### #### ####
@@ -284,9 +313,8 @@ upload_build_targets(){
     unset CONDARC
     source deactivate
 
-    {% if instructions.get('test_results') %}
+    {% if instructions.get('test_results') and not cached_files %}
     {{ start_section('upload_test_results') }}
-    {% endif %}
 
     {%for test_result, filename in instructions.get('test_results', {}).items() %}
 
@@ -294,6 +322,7 @@ upload_build_targets(){
     anaconda build -q -t "$BINSTAR_API_TOKEN" results {{test_result}} "$BINSTAR_OWNER/$BINSTAR_PACKAGE" "$BINSTAR_BUILD" {{filename}}
 
     {% endfor %}
+    {% endif %}
 
 
     if [ "$BINSTAR_BUILD_RESULT" != "success" ]; then
@@ -301,11 +330,14 @@ upload_build_targets(){
     fi
     {% if test_only %}
     echo -e '\nRunning Build in "Test Only" mode, not uploading build targets'
+    {% elif native_upload %}
+    echo -e '\nThe build targets are uploaded by the worker'
     {% else %}
 
     {{ start_section('upload_build_targets') }}
     eval $bb_check_command_error
-    {% for tgt in files %}
+    {% for tgt in cached_files or files %}
+    {% set tgt = quote(tgt) if cached_files else tgt %}
     echo "anaconda -q -t \$TOKEN upload {{force_upload}} --user $BINSTAR_OWNER --package $BINSTAR_PACKAGE {{labels}} {{tgt}} --build-id $BINSTAR_BUILD"
     anaconda -q -t "$BINSTAR_API_TOKEN" upload {{force_upload}} --user "$BINSTAR_OWNER" --package "$BINSTAR_PACKAGE" {{labels}} {{tgt}} --build-id "$BINSTAR_BUILD"
     eval $bb_check_command_error
@@ -318,6 +350,9 @@ upload_build_targets(){
 
 main(){
 
+    {% if cached_files %}
+    restore_build_cache;
+    {% else %}
     {% if ignore_setup_build %}
     echo "[Ignore Setup Build]"
     {% else %}
@@ -341,6 +376,7 @@ main(){
     fi
     binstar_build
     binstar_post_build
+    {% endif %}
     upload_build_targets
 
     echo "Exit BINSTAR_BUILD_RESULT=$BINSTAR_BUILD_RESULT"
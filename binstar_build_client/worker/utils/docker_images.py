@@ -0,0 +1,351 @@
+"""
+Resolve and pull the docker images used by the docker worker
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from contextlib import contextmanager
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger('binstar.build')
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+
+def split_image(image):
+    '''
+    Split an image name into (repository, tag), tag is None if not given
+    or if the image is referenced by digest (repository@sha256:...)
+    '''
+    if '@' in image:
+        return image.split('@', 1)[0], None
+    # The registry of an image name may contain a port (host:port/repo)
+    if ':' in image.rsplit('/', 1)[-1]:
+        repository, tag = image.rsplit(':', 1)
+    else:
+        repository, tag = image, None
+    return repository, tag
+
+
+class ImageCache(object):
+    '''
+    Cache the resolution of image names to image ids and of image ids
+    to their configuration
+
+    An image name resolves to the same image until it is pulled again,
+    call `invalidate` after pulling, and for at most `ttl` seconds: the
+    image may also be pulled or tagged outside the worker. Image ids are
+    immutable so their configuration never has to be invalidated.
+    '''
+    def __init__(self, client, ttl=60):
+        self.client = client
+        self.ttl = ttl
+        self._ids = {}
+        self._configs = {}
+        self._lock = threading.Lock()
+
+    def image_id(self, image):
+        '''
+        The id of the image `image`
+
+        A name without a tag matches any tag of the repository
+        '''
+        try:
+            image_id, resolved = self._ids[image]
+            if time.time() - resolved < self.ttl:
+                return image_id
+        except KeyError:
+            pass
+
+        repository, tag = split_image(image)
+        for img in self.client.images(repository):
+            repo_tags = img.get('RepoTags') or []
+            if '@' in image:
+                found = image in (img.get('RepoDigests') or [])
+            elif tag:
+                found = image in repo_tags
+            else:
+                found = repository in {i.rsplit(':', 1)[0] for i in repo_tags}
+            if found:
+                with self._lock:
+                    self._ids[image] = (img['Id'], time.time())
+                return img['Id']
+
+        raise KeyError('No docker image named {0}'.format(image))
+
+    def config(self, image):
+        '''
+        The configuration of the image `image` (as in `docker inspect`)
+        '''
+        image_id = self.image_id(image)
+        try:
+            return self._configs[image_id]
+        except KeyError:
+            pass
+
+        config = self.client.inspect_image(image_id)['Config']
+        with self._lock:
+            self._configs[image_id] = config
+        return config
+
+    def working_dir(self, image):
+        return self.config(image)['WorkingDir']
+
+    def invalidate(self, image=None):
+        '''
+        Forget the resolution of `image`, or of all images
+        '''
+        with self._lock:
+            if image is None:
+                self._ids.clear()
+            else:
+                # A pull may move any tag of the repository
+                repository = split_image(image)[0]
+                for name in list(self._ids):
+                    if split_image(name)[0] == repository:
+                        del self._ids[name]
+
+
+class PullError(Exception):
+    pass
+
+
+class PullProgress(object):
+    '''
+    Summarize the progress messages of a pull into one line, written at
+    most once every `interval` seconds
+    '''
+    def __init__(self, image, write, interval=1.0):
+        self.image = image
+        self.write = write
+        self.interval = interval
+        self.layers = {}
+        self.status = None
+        self.last_write = 0
+
+    def line(self):
+        done = sum(1 for layer in self.layers.values() if layer['done'])
+        current = sum(layer['current'] for layer in self.layers.values())
+        total = sum(layer['total'] for layer in self.layers.values())
+        return 'Docker: Pull {0}: {1}/{2} layers, {3:.1f}/{4:.1f} MB'.format(
+            self.image, done, len(self.layers), current / MB, total / MB)
+
+    def update(self, msg):
+        layer_id = msg.get('id')
+        status = msg.get('status') or ''
+        if not layer_id or status.startswith('Pulling from'):
+            # Not about a layer, like "Status: Downloaded newer image for ..."
+            if status:
+                self.status = status
+        else:
+            layer = self.layers.setdefault(layer_id, {'current': 0, 'total': 0, 'done': False})
+            detail = msg.get('progressDetail') or {}
+            if status == 'Downloading' and detail.get('total'):
+                layer['current'] = detail.get('current', 0)
+                layer['total'] = detail['total']
+            elif status in ('Verifying Checksum', 'Download complete'):
+                layer['current'] = layer['total']
+            elif status in ('Pull complete', 'Already exists'):
+                layer['current'] = layer['total']
+                layer['done'] = True
+
+        now = time.time()
+        if now - self.last_write >= self.interval:
+            self.last_write = now
+            self.write(self.line() + '\r')
+
+    def finish(self):
+        self.write(self.line() + '\n')
+        if self.status:
+            self.write('Docker: {0}\n'.format(self.status))
+
+
+class PullManager(object):
+    '''
+    Pull the docker images of user builds
+
+    * Images present locally and pulled less than `ttl` seconds ago, or
+      referenced by digest, are not pulled again.
+    * Concurrent pulls of the same image, by the threads of this worker or
+      by other workers of this host, are coalesced into one.
+    * The least recently used user images are removed when they take more
+      than `budget` bytes of disk. The `protected` images never are.
+
+    :param state_dir: the directory of the pull locks and the image usage,
+                      shared by the workers of a host
+    '''
+    USAGE_FILE = 'usage.json'
+
+    def __init__(self, client, images, state_dir, budget, ttl, protected=()):
+        self.client = client
+        self.images = images
+        self.state_dir = state_dir
+        self.budget = budget
+        self.ttl = ttl
+        self.protected = set(protected)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+
+    def _lock_file(self, name):
+        return os.path.join(self.state_dir, name + '.lock')
+
+    def _pulled_file(self, image):
+        # The modification time of this file is the time of the last pull
+        return os.path.join(self.state_dir, self._image_key(image) + '.pulled')
+
+    @contextmanager
+    def _lock(self, name):
+        '''
+        An exclusive lock between the threads and processes of this host
+        '''
+        with self._locks_lock:
+            thread_lock = self._locks.setdefault(name, threading.Lock())
+
+        with thread_lock:
+            with open(self._lock_file(name), 'a') as fd:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _image_key(self, image):
+        return hashlib.sha1(image.encode('utf-8')).hexdigest()
+
+    def is_present(self, image):
+        try:
+            self.images.image_id(image)
+            return True
+        except KeyError:
+            return False
+
+    def is_fresh(self, image):
+        '''
+        The local image can be used without pulling it
+        '''
+        if not self.is_present(image):
+            return False
+        if '@' in image:
+            # A digest always names the same image
+            return True
+        try:
+            pulled = os.path.getmtime(self._pulled_file(image))
+        except OSError:
+            return False
+        return time.time() - pulled < self.ttl
+
+    def pull(self, image, write):
+        '''
+        Make sure `image` is present and up to date
+
+        :param write: a function writing a line to the build log
+        :return: True if the image was pulled
+        '''
+        key = self._image_key(image)
+        pulled = False
+
+        if self.is_fresh(image):
+            write('Docker: Using local image {0}\n'.format(image))
+        else:
+            with self._lock(key):
+                # Another worker may have pulled it while we waited for the lock
+                if self.is_fresh(image):
+                    write('Docker: Using local image {0}\n'.format(image))
+                else:
+                    self._pull(image, write)
+                    with open(self._pulled_file(image), 'w') as fd:
+                        fd.write(image)
+                    pulled = True
+
+        self.record_use(image)
+        return pulled
+
+    def _pull(self, image, write):
+        if '@' in image:
+            repository, tag = image, None
+        else:
+            repository, tag = split_image(image)
+
+        progress = PullProgress(image, write)
+        for line in self.client.pull(repository, tag=tag, stream=True):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', 'replace')
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if msg.get('error'):
+                progress.finish()
+                raise PullError('Could not pull {0}: {1}'.format(image, msg['error']))
+            progress.update(msg)
+        progress.finish()
+
+        self.images.invalidate(image)
+
+    @contextmanager
+    def _usage(self):
+        with self._lock('usage'):
+            filename = os.path.join(self.state_dir, self.USAGE_FILE)
+            try:
+                with io.open(filename) as fd:
+                    usage = json.load(fd)
+            except (IOError, OSError, ValueError):
+                usage = {}
+
+            yield usage
+
+            with io.open(filename + '.tmp', 'wb') as fd:
+                fd.write(json.dumps(usage).encode('utf-8'))
+            os.rename(filename + '.tmp', filename)
+
+    def record_use(self, image):
+        '''
+        Record that a build uses `image`, and remove the least recently used
+        user images over the disk budget
+        '''
+        try:
+            config = self.client.inspect_image(self.images.image_id(image))
+            size = config.get('VirtualSize') or config.get('Size') or 0
+        except KeyError:
+            size = 0
+
+        with self._usage() as usage:
+            usage[image] = {'last_used': time.time(), 'size': size}
+            self._evict(usage, keep=image)
+
+    def _evict(self, usage, keep):
+        total = sum(entry['size'] for name, entry in usage.items()
+                    if name not in self.protected)
+        by_age = sorted(usage.items(), key=lambda item: item[1]['last_used'])
+        for name, entry in by_age:
+            if total <= self.budget:
+                break
+            if name == keep or name in self.protected:
+                continue
+            try:
+                self.client.remove_image(name)
+            except Exception as err:
+                # The image may be used by a running container
+                log.warn('Could not remove the docker image %s: %s', name, err)
+                continue
+            log.info('Removed the least recently used docker image %s (%.1f GB)',
+                     name, entry['size'] / GB)
+            total -= entry['size']
+            del usage[name]
+            self.images.invalidate(name)
@@ -0,0 +1,169 @@
+"""
+CPU, memory, pids and tmpfs limits of build containers
+
+The limits of a worker are the defaults of its builds, and the caps of the
+limits a build requests in the `resources` section of its .binstar.yml:
+a build can ask for less than the worker allows, never for more.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import re
+
+# The period of the CFS scheduler, in microseconds, --cpus is a quota of it
+CPU_PERIOD = 100000
+
+UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_bytes(value):
+    '''
+    The number of bytes of a size such as 512m or 2g, sizes without a
+    unit are in bytes
+    '''
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([bkmgt]?)b?\s*$', str(value).lower())
+    if not match:
+        raise ValueError('Invalid size {0!r}, expected a number of bytes such as 512m or 2g'.format(value))
+    number, unit = match.groups()
+    return int(float(number) * UNITS[unit])
+
+
+def format_bytes(value):
+    if value % 1024 ** 3 == 0:
+        return '{0}g'.format(value // 1024 ** 3)
+    return '{0}m'.format(value // 1024 ** 2)
+
+
+def parse_tmpfs(value):
+    '''
+    Parse a tmpfs mount PATH[:OPTIONS] as docker run --tmpfs does
+    '''
+    path, _, options = value.partition(':')
+    if not path.startswith('/'):
+        raise ValueError('Invalid tmpfs mount {0!r}, the path must be absolute'.format(value))
+    return path, options
+
+
+class ResourceLimits(object):
+    '''
+    The resource limits of a container, None is no limit
+
+    :param cpus: number of CPUs, fractions allowed
+    :param cpu_shares: relative CPU weight
+    :param memory: memory limit in bytes
+    :param memory_swap: memory plus swap limit in bytes
+    :param pids: maximum number of processes
+    :param tmpfs: dict of tmpfs mounts, path: mount options
+    '''
+    # The limits a build may lower, with the function parsing their values
+    OVERRIDES = [
+        ('cpus', float),
+        ('cpu_shares', int),
+        ('memory', parse_bytes),
+        ('memory_swap', parse_bytes),
+        ('pids', int),
+    ]
+
+    def __init__(self, cpus=None, cpu_shares=None, memory=None, memory_swap=None,
+                 pids=None, tmpfs=None):
+        self.cpus = cpus
+        self.cpu_shares = cpu_shares
+        self.memory = memory
+        self.memory_swap = memory_swap
+        self.pids = pids
+        self.tmpfs = dict(tmpfs or {})
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(cpus=args.cpus,
+                   cpu_shares=args.cpu_shares,
+                   memory=parse_bytes(args.memory),
+                   memory_swap=parse_bytes(args.memory_swap),
+                   pids=args.pids_limit,
+                   tmpfs=dict(parse_tmpfs(value) for value in args.tmpfs or []))
+
+    def __eq__(self, other):
+        return isinstance(other, ResourceLimits) and vars(self) == vars(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def override(self, requested):
+        '''
+        The limits of a build requesting the limits `requested`
+
+        :param requested: the `resources` section of the build instructions
+        :return: (limits, warnings) the requested limits, capped by these
+                 ones, and the messages for the build log
+        '''
+        limits = ResourceLimits(**vars(self))
+        warnings = []
+        if not requested:
+            return limits, warnings
+        if not isinstance(requested, dict):
+            warnings.append('Ignoring resources {0!r}, expected a mapping'.format(requested))
+            return limits, warnings
+
+        overrides = dict(self.OVERRIDES)
+        for name in sorted(set(requested) - set(overrides)):
+            warnings.append('Ignoring unsupported resource {0!r}'.format(name))
+
+        for name, parse in self.OVERRIDES:
+            if name not in requested:
+                continue
+            try:
+                value = parse(requested[name])
+            except (TypeError, ValueError):
+                warnings.append('Ignoring invalid {0} {1!r}'.format(name, requested[name]))
+                continue
+            if value <= 0:
+                warnings.append('Ignoring invalid {0} {1!r}'.format(name, requested[name]))
+                continue
+
+            cap = getattr(self, name)
+            if cap is not None and value > cap:
+                warnings.append('The requested {0} {1} exceed the limit of this worker, '
+                                'using {2}'.format(name, requested[name],
+                                                   self.describe_value(name, cap)))
+                value = cap
+            setattr(limits, name, value)
+
+        return limits, warnings
+
+    @staticmethod
+    def describe_value(name, value):
+        if name in ('memory', 'memory_swap'):
+            return format_bytes(value)
+        return '{0:g}'.format(value)
+
+    def describe(self):
+        '''
+        A summary of the limits for the build log
+        '''
+        items = ['{0}={1}'.format(name, self.describe_value(name, getattr(self, name)))
+                 for name, _ in self.OVERRIDES if getattr(self, name) is not None]
+        items.extend('tmpfs={0}'.format(path) for path in sorted(self.tmpfs))
+        return ', '.join(items) or 'none'
+
+    def host_config(self):
+        '''
+        The arguments of `create_host_config` to apply these limits
+        '''
+        config = {}
+        if self.cpus is not None:
+            config['cpu_period'] = CPU_PERIOD
+            config['cpu_quota'] = int(self.cpus * CPU_PERIOD)
+        if self.cpu_shares is not None:
+            config['cpu_shares'] = self.cpu_shares
+        if self.memory is not None:
+            config['mem_limit'] = self.memory
+        if self.memory_swap is not None:
+            config['memswap_limit'] = self.memory_swap
+        if self.pids is not None:
+            config['pids_limit'] = self.pids
+        if self.tmpfs:
+            config['tmpfs'] = dict(self.tmpfs)
+        return config
@@ -1,19 +1,44 @@
 from __future__ import unicode_literals, print_function, absolute_import
+import array
 import io
 
 
+def byte_view(b):
+    '''
+    A writable memoryview of the bytes of the buffer object `b`
+    '''
+    view = memoryview(b)
+    if getattr(view, 'format', 'B') != 'B':
+        # e.g. array.array('b'), only Python 3 can cast
+        view = view.cast('B')
+    return view
+
+
 class GeneratorFile(io.RawIOBase):
     '''
     A file-like object to wrap a generator that yields bytes
+
+    The unread part of the current chunk is kept as a memoryview, so each
+    byte of a chunk is copied once, into the caller's buffer, however small
+    the buffer is.
     '''
 
     def __init__(self, generator):
         self.generator = generator
-        self.buffer = None
+        self.pending = None
 
     def readable(self):
         return True
 
+    def _next_chunk(self):
+        '''
+        A memoryview of the next chunk, or None at the end
+
+        The end is the end of the generator, or an empty chunk
+        '''
+        data = next(self.generator, b'')
+        return memoryview(data) if data else None
+
     def readinto(self, b):
         '''
         Read at most `len(b)` bytes into the buffer object `b`
@@ -24,27 +49,50 @@ class GeneratorFile(io.RawIOBase):
         Returns:
             The number of bytes read
         '''
-        if self.buffer:
-            # We still have some data left over from the last iteration, consume that
-            data, self.buffer = self.buffer, None
-        else:
-            # Fetch some more data.
-            data = next(self.generator, b'')
-
-        bufsize = len(b)
-        n = len(data)
-        if n > bufsize:
-            # We can only output bufsize bytes at a time, save the rest for later
-            n = bufsize
-            data, self.buffer = data[:n], data[n:]
-
-        # See: https://github.com/python/cpython/blob/2.7/Lib/_pyio.py#L641
+        if not self.pending:
+            self.pending = self._next_chunk()
+            if self.pending is None:
+                return 0
+
+        data = self.pending
+        n = min(len(b), len(data))
+
         try:
-            b[:n] = data
-        except TypeError:
-            import array
+            byte_view(b)[:n] = data[:n]
+        except (TypeError, AttributeError):
+            # Python 2 arrays do not support the buffer protocol
+            # See: https://github.com/python/cpython/blob/2.7/Lib/_pyio.py#L641
             if not isinstance(b, array.array):
                 raise
-            b[:n] = array.array('b', data)
+            b[:n] = array.array(b.typecode, data[:n].tobytes())
+
+        self.pending = data[n:] if n < len(data) else None
+        return n
 
-        return n
\ No newline at end of file
+    def read1(self, size=-1):
+        '''
+        Read at most `size` bytes of the current chunk, never waiting for
+        the next one. The line reader of the build log reads through it
+        without another buffer.
+        '''
+        if not self.pending:
+            self.pending = self._next_chunk()
+            if self.pending is None:
+                return b''
+
+        data = self.pending
+        n = len(data) if size is None or size < 0 else min(size, len(data))
+        self.pending = data[n:] if n < len(data) else None
+        return data[:n].tobytes()
+
+    def readall(self):
+        '''
+        Read until the end of the generator, joining the chunks at once
+        '''
+        chunks = []
+        data = self.pending or self._next_chunk()
+        while data is not None:
+            chunks.append(data.tobytes())
+            data = self._next_chunk()
+        self.pending = None
+        return b''.join(chunks)
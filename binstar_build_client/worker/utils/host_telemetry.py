@@ -0,0 +1,165 @@
+"""
+Periodic host telemetry of a worker, sampled in process with psutil
+
+Every `interval` seconds a background thread samples the load, CPU, memory,
+swap and the free disk of the worker directory, and writes the sample to a
+ring buffer file of fixed size records: the file holds the last `capacity`
+samples and never grows.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import io
+import logging
+import os
+import struct
+import threading
+import time
+
+import psutil
+
+log = logging.getLogger('binstar.build')
+
+FIELDS = (
+    'time',
+    'load1',
+    'cpu_percent',
+    'mem_available',
+    'mem_percent',
+    'swap_percent',
+    'disk_free',
+    'disk_percent',
+)
+
+MAGIC = b'BSHT'
+HEADER = struct.Struct(str('<4sII'))  # magic, capacity, index of the next record
+RECORD = struct.Struct(str('<{0}d'.format(len(FIELDS))))
+
+
+def load1():
+    if hasattr(psutil, 'getloadavg'):
+        return psutil.getloadavg()[0]
+    if hasattr(os, 'getloadavg'):
+        return os.getloadavg()[0]
+    return -1.0
+
+
+def sample(path):
+    '''
+    A sample of the host metrics, with the disk usage of `path`
+    '''
+    memory = psutil.virtual_memory()
+    disk = psutil.disk_usage(path)
+    return {
+        'time': time.time(),
+        'load1': load1(),
+        'cpu_percent': psutil.cpu_percent(interval=None),
+        'mem_available': float(memory.available),
+        'mem_percent': memory.percent,
+        'swap_percent': psutil.swap_memory().percent,
+        'disk_free': float(disk.free),
+        'disk_percent': disk.percent,
+    }
+
+
+class RingFile(object):
+    '''
+    The last `capacity` samples, in a file of fixed size
+
+    :param filename: the ring buffer file, created if it does not exist or
+                     has another capacity
+    '''
+    def __init__(self, filename, capacity):
+        self.filename = filename
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+        size = HEADER.size + capacity * RECORD.size
+        header = None
+        if os.path.isfile(filename) and os.path.getsize(filename) == size:
+            with io.open(filename, 'rb') as fd:
+                header = HEADER.unpack(fd.read(HEADER.size))
+        if not header or header[0] != MAGIC or header[1] != capacity:
+            ring_dir = os.path.dirname(filename)
+            if ring_dir and not os.path.isdir(ring_dir):
+                os.makedirs(ring_dir)
+            with io.open(filename, 'wb') as fd:
+                fd.write(HEADER.pack(MAGIC, capacity, 0))
+                fd.write(b'\0' * (capacity * RECORD.size))
+
+    def append(self, values):
+        record = RECORD.pack(*[float(values[field]) for field in FIELDS])
+        with self._lock, io.open(self.filename, 'r+b') as fd:
+            _, capacity, index = HEADER.unpack(fd.read(HEADER.size))
+            fd.seek(HEADER.size + index * RECORD.size)
+            fd.write(record)
+            fd.seek(0)
+            fd.write(HEADER.pack(MAGIC, capacity, (index + 1) % capacity))
+
+    def read(self, last=None):
+        '''
+        The samples from the oldest to the newest, or the `last` newest
+        '''
+        with self._lock, io.open(self.filename, 'rb') as fd:
+            _, capacity, index = HEADER.unpack(fd.read(HEADER.size))
+            data = fd.read(capacity * RECORD.size)
+
+        records = [RECORD.unpack_from(data, i * RECORD.size) for i in range(capacity)]
+        records = records[index:] + records[:index]
+        samples = [dict(zip(FIELDS, record)) for record in records if record[0]]
+        return samples[-last:] if last else samples
+
+
+class HostSampler(object):
+    '''
+    Sample the host every `interval` seconds in a background thread
+
+    :param filename: the ring buffer file
+    :param interval: seconds between samples
+    :param path: the directory whose disk usage is sampled
+    :param capacity: the number of samples kept
+    :param upload: called every `upload_interval` seconds, after a sample
+    :param upload_interval: seconds between the calls of `upload`
+    '''
+    def __init__(self, filename, interval, path, capacity=1440,
+                 upload=None, upload_interval=15 * 60):
+        self.ring = RingFile(filename, capacity)
+        self.interval = interval
+        self.path = path
+        self.upload = upload
+        self.upload_interval = upload_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        try:
+            self.ring.append(sample(self.path))
+        except (IOError, OSError, psutil.Error) as err:
+            log.warn('Could not sample the host telemetry: %s', err)
+
+    def _run(self):
+        # The first cpu_percent of a process is meaningless, it starts the measure
+        psutil.cpu_percent(interval=None)
+        last_upload = time.time()
+        while not self._stop.wait(self.interval):
+            self.sample()
+            if self.upload and time.time() - last_upload >= self.upload_interval:
+                last_upload = time.time()
+                self.upload()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='host-telemetry')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self, last=60):
+        '''
+        The recent samples, in the format of the worker stats
+        '''
+        return {'host telemetry': {'cmd': 'psutil', 'out': self.ring.read(last)}}
@@ -0,0 +1,243 @@
+"""
+Metrics of a worker, in the Prometheus text format
+
+The metrics are plain in-process counters, always updated. With
+`anaconda worker run --metrics-port PORT` a localhost HTTP server renders
+them at http://127.0.0.1:PORT/metrics for Prometheus to scrape.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import bisect
+import logging
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+log = logging.getLogger('binstar.build')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from a fast API call to a long build
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    items = ['{0}="{1}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"')
+                                .replace('\n', r'\n'))
+             for name, value in labels]
+    return '{' + ','.join(items) + '}'
+
+
+class Registry(object):
+    '''
+    The metrics rendered by the metrics endpoint
+    '''
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.TYPE))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric(object):
+    '''
+    A metric with a value per combination of label values
+
+    :param name: the metric name
+    :param help: a description of the metric
+    :param labels: the label names, given as keyword arguments when updated
+    '''
+    TYPE = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError('{0} has the labels {1}, not {2}'.format(
+                self.name, self.label_names, tuple(sorted(labels))))
+        return tuple((name, labels[name]) for name in self.label_names)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.label_names:
+            values = [((), 0)]
+        return ['{0}{1} {2}'.format(self.name, format_labels(key), format_value(value))
+                for key, value in values]
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    '''
+    Count the observed values in cumulative buckets, with their sum
+    '''
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        Metric.__init__(self, name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def value(self, **labels):
+        '''
+        The number of observed values
+        '''
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels)) or ([0], 0)
+        return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total))
+                            for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('{0}_bucket{1} {2}'.format(
+                    self.name, format_labels(key + (('le', format_value(float(bound))),)), cumulative))
+            lines.append('{0}_sum{1} {2}'.format(self.name, format_labels(key), format_value(total)))
+            lines.append('{0}_count{1} {2}'.format(self.name, format_labels(key), cumulative))
+        return lines
+
+
+# -- The metrics of a worker --
+
+JOBS_STARTED = Counter('anaconda_build_jobs_started_total', 'Build jobs started')
+JOBS_FINISHED = Counter('anaconda_build_jobs_finished_total', 'Build jobs finished, by status',
+                        labels=['status'])
+JOB_DURATION = Histogram('anaconda_build_job_duration_seconds', 'Duration of the build jobs')
+PHASE_DURATION = Histogram('anaconda_build_phase_duration_seconds',
+                           'Duration of the sections of the build script', labels=['section'])
+SLOTS = Gauge('anaconda_build_slots', 'Builds the worker runs at once')
+SLOTS_BUSY = Gauge('anaconda_build_slots_busy', 'Builds running now')
+
+POLL_DURATION = Histogram('anaconda_build_poll_duration_seconds',
+                          'Latency of polling the build queue for a job')
+POLLS = Counter('anaconda_build_polls_total', 'Polls of the build queue, by result',
+                labels=['result'])
+
+LOG_BYTES = Counter('anaconda_build_log_bytes_total', 'Bytes of build log sent to the server')
+LOG_UPLOAD_DURATION = Histogram('anaconda_build_log_upload_duration_seconds',
+                                'Latency of sending build log to the server')
+LOG_UPLOAD_FAILURES = Counter('anaconda_build_log_upload_failures_total',
+                              'Failures to send build log to the server')
+
+CACHE_LOOKUPS = Counter('anaconda_build_cache_lookups_total',
+                        'Cache lookups, by cache and result', labels=['cache', 'result'])
+
+HTTP_REQUEST_DURATION = Histogram('anaconda_build_http_request_duration_seconds',
+                                  'Latency of the HTTP requests, retries included, by endpoint',
+                                  labels=['endpoint', 'method'])
+HTTP_REQUESTS = Counter('anaconda_build_http_requests_total',
+                        'HTTP requests, by endpoint and response status',
+                        labels=['endpoint', 'method', 'code'])
+HTTP_SENT_BYTES = Counter('anaconda_build_http_sent_bytes_total',
+                          'Bytes of the HTTP request bodies, by endpoint', labels=['endpoint'])
+HTTP_RECEIVED_BYTES = Counter('anaconda_build_http_received_bytes_total',
+                              'Bytes of the HTTP response bodies, as declared by their '
+                              'Content-Length, by endpoint', labels=['endpoint'])
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug('Metrics endpoint: ' + format, *args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(port, host='127.0.0.1'):
+    '''
+    Serve the metrics in a background thread
+
+    :return: the server, `shutdown` it to stop
+    '''
+    server = MetricsServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server')
+    thread.daemon = True
+    thread.start()
+    log.info('Serving metrics at http://%s:%s/metrics', host, server.server_address[1])
+    return server
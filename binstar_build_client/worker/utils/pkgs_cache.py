@@ -0,0 +1,196 @@
+"""
+A conda package and pip cache shared by the containers of docker builds
+
+The cache is a host directory with a `pkgs` directory, mounted as the conda
+`pkgs_dirs` of every build container, and a `pip` directory mounted as the
+pip cache. Several builds, of one or more workers, can use it at the same
+time: every build holds a shared lock on the cache while its container
+runs. Trimming the cache only evicts the entries no build used recently,
+so evicting holds a shared lock too and never waits for, or blocks, builds.
+The stale conda locks are removed under an exclusive lock, when no build is
+using the cache.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from contextlib import contextmanager
+import logging
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from binstar_build_client.utils.rm import rm_rf
+
+log = logging.getLogger('binstar.build')
+
+GB = 1024 ** 3
+
+# The mount points of the cache in the containers
+PKGS_MOUNT = '/anaconda-build-cache/pkgs'
+PIP_MOUNT = '/anaconda-build-cache/pip'
+
+
+def entry_usage(path):
+    '''
+    The last use and the size in bytes of the files under `path`
+
+    The last use is the latest access or modification of a file: listing
+    a directory, as this module does, changes its access time.
+
+    :return: (last_used, size)
+    '''
+    st = os.lstat(path)
+    if not os.path.isdir(path) or os.path.islink(path):
+        return max(st.st_atime, st.st_mtime), st.st_size
+
+    last_used = st.st_mtime
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            last_used = max(last_used, st.st_atime, st.st_mtime)
+            total += st.st_size
+    return last_used, total
+
+
+class PackageCache(object):
+    '''
+    :param root: the host directory of the cache
+    :param max_size: trim the cache to this many bytes after builds
+    :param min_age: never evict the entries used less than `min_age`
+                    seconds ago, a running build may be using them. With
+                    the relatime mount option, the access time of a file
+                    changes at most once a day.
+    '''
+    LOCK_FILE = '.lock'
+
+    def __init__(self, root, max_size, min_age=2 * 24 * 60 * 60):
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self.min_age = min_age
+        self.pkgs_dir = os.path.join(self.root, 'pkgs')
+        self.pip_dir = os.path.join(self.root, 'pip')
+
+        for path in (self.pkgs_dir, self.pip_dir):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def binds(self):
+        '''
+        The docker binds of the cache
+        '''
+        return {
+            self.pkgs_dir: {'bind': PKGS_MOUNT, 'mode': 'rw'},
+            self.pip_dir: {'bind': PIP_MOUNT, 'mode': 'rw'},
+        }
+
+    def environment(self):
+        '''
+        The environment of build containers using the cache
+        '''
+        return {'CONDA_PKGS_DIRS': PKGS_MOUNT, 'PIP_CACHE_DIR': PIP_MOUNT}
+
+    @contextmanager
+    def _lock(self, operation):
+        if fcntl is None:
+            yield True
+            return
+
+        with open(os.path.join(self.root, self.LOCK_FILE), 'a') as fd:
+            try:
+                fcntl.flock(fd, operation)
+            except (IOError, OSError):
+                # Only raised for LOCK_NB
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def shared(self):
+        '''
+        A context to run a build that uses the cache in
+        '''
+        return self._lock(fcntl.LOCK_SH if fcntl else None)
+
+    def entries(self):
+        '''
+        The evictable entries of the cache
+
+        :return: list of (last_used, size, path), the least recently used first
+        '''
+        entries = []
+        for name in os.listdir(self.pkgs_dir):
+            # Keep conda's own index of the cache (urls, urls.txt)
+            if name.startswith('.') or name.startswith('urls'):
+                continue
+            entries.append(os.path.join(self.pkgs_dir, name))
+
+        for root, dirs, files in os.walk(self.pip_dir):
+            entries.extend(os.path.join(root, name) for name in files)
+
+        result = []
+        for path in entries:
+            try:
+                last_used, size = entry_usage(path)
+                result.append((last_used, size, path))
+            except OSError:
+                pass
+
+        result.sort()
+        return result
+
+    def remove_stale_locks(self):
+        '''
+        Remove the lock files of conda processes that did not exit cleanly
+        '''
+        for root, dirs, files in os.walk(self.pkgs_dir):
+            for name in dirs + files:
+                if name.startswith('.conda_lock'):
+                    rm_rf(os.path.join(root, name))
+
+    def trim(self):
+        '''
+        Evict the least recently used entries, not used for `min_age`
+        seconds, until the cache fits in `max_size`
+
+        :return: the number of bytes evicted
+        '''
+        with self._lock(fcntl.LOCK_EX | fcntl.LOCK_NB if fcntl else None) as locked:
+            if locked:
+                # No build is running, so every conda lock is stale.
+                # Builds sharing the cache can not run `conda clean --lock`.
+                self.remove_stale_locks()
+            else:
+                log.info('Not removing the stale conda locks of the package cache, it is in use')
+
+        with self.shared():
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            cutoff = time.time() - self.min_age
+            evicted = 0
+            for last_used, size, path in entries:
+                if total - evicted <= self.max_size or last_used > cutoff:
+                    break
+                try:
+                    rm_rf(path)
+                except (IOError, OSError) as err:
+                    log.warn('Could not evict %s from the package cache: %s', path, err)
+                    continue
+                evicted += size
+
+            if evicted:
+                log.info('Evicted %.1f GB from the package cache (%.1f GB left)',
+                         evicted / GB, (total - evicted) / GB)
+            if total - evicted > self.max_size:
+                log.info('The package cache is %.1f GB over its maximum size, '
+                         'its other entries were used in the last %s seconds',
+                         (total - evicted - self.max_size) / GB, self.min_age)
+            return evicted
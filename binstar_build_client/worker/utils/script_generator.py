@@ -3,15 +3,15 @@
 """
 from __future__ import print_function, unicode_literals, absolute_import
 
+import glob
 import logging
 import os
 import pipes
 import shlex
 
-import jinja2
-
 from binstar_build_client.utils import get_conda_root_prefix
 from binstar_build_client.worker.utils import build_log
+from binstar_build_client.worker.utils.templates import TemplateCache
 
 try:
     unicode
@@ -39,9 +39,9 @@ def metadata(**kwargs):
     '''
     return build_log.encode_metadata(kwargs)
 
-def get_labels(job_data):
+def get_label_list(job_data):
     """
-    Return `--label` arguments to pass to `anaconda upload`
+    Return the list of labels the build targets are uploaded to
     """
 
     build_targets = job_data['build_item_info'].get('instructions', {}).get('build_targets')
@@ -68,6 +68,14 @@ def get_labels(job_data):
         except (KeyError, ValueError):
             log.info('Bad channel value %r' % ch)
 
+    return _channels
+
+
+def get_labels(job_data):
+    """
+    Return `--label` arguments to pass to `anaconda upload`
+    """
+    _channels = get_label_list(job_data)
     channels = ' --label ' + ' --label '.join(_channels) if _channels else 'dev'
     return channels
 
@@ -83,6 +91,8 @@ def get_files(context, job_data):
         build_targets = [build_targets]
     elif isinstance(build_targets, dict):
         build_targets = get_list(build_targets, 'files', default=[])
+    else:
+        build_targets = list(build_targets)
 
     if 'conda' in build_targets:
         idx = build_targets.index('conda')
@@ -96,6 +106,34 @@ def get_files(context, job_data):
     return build_targets
 
 
+def get_source_dir(working_dir, job_data):
+    """
+    The directory the build script runs the build commands in
+    """
+    source_dir = os.path.join(working_dir, 'source')
+    sub_dir = job_data['build_info'].get('sub_dir')
+    if sub_dir and os.path.isdir(os.path.join(source_dir, sub_dir)):
+        source_dir = os.path.join(source_dir, sub_dir)
+    return source_dir
+
+
+def expand_files(files, source_dir):
+    """
+    Expand the build targets returned by `get_files` into a list of
+    existing files, like the build script would.
+
+    Relative patterns are relative to `source_dir`
+    """
+    expanded = []
+    for target in files:
+        for pattern in shlex.split(target, posix=os.name != 'nt'):
+            pattern = os.path.join(source_dir, os.path.expanduser(pattern))
+            for filename in sorted(glob.glob(pattern)):
+                if os.path.isfile(filename) and filename not in expanded:
+                    expanded.append(filename)
+    return expanded
+
+
 def get_force_upload(job_data):
     build_targets = job_data['build_item_info'].get('instructions', {}).get('build_targets')
     force = False
@@ -188,6 +226,16 @@ GLOBALS = {
     'metadata': metadata,
 }
 
+# The build script templates are only parsed once per process
+TEMPLATES = TemplateCache(globals=GLOBALS)
+
+
+def script_extension(platform):
+    '''
+    The file extension of the build script for `platform`
+    '''
+    return '.bat' if platform in ['win-32', 'win-64'] else '.sh'
+
 
 # ===============================================================================
 # Generate
@@ -201,10 +249,6 @@ def render_build_script(working_dir, build_data, **context):
     :return: the content of the build script to execute
     """
 
-
-    env = jinja2.Environment(loader=jinja2.PackageLoader(__name__, 'data'))
-    env.globals.update(GLOBALS)
-
     exports = create_exports(build_data, working_dir)
     instructions = build_data['build_item_info'].get('instructions', {})
     install_channels = instructions.get('install_channels', None) or ['defaults']
@@ -221,6 +265,9 @@ def render_build_script(working_dir, build_data, **context):
         'sub_dir': build_data['build_info'].get('sub_dir'),
         'labels': get_labels(build_data),
         'files': get_files(context, build_data),
+        'cached_files': context.get('cached_files') or [],
+        'native_upload': context.get('native_upload', False),
+        'shared_pkgs_cache': context.get('shared_pkgs_cache', False),
         'force_upload': get_force_upload(build_data),
         'install_channels': install_channels,
         'EXIT_CODE_OK': 0,
@@ -229,9 +276,7 @@ def render_build_script(working_dir, build_data, **context):
     })
 
     platform = build_data['build_item_info']['platform']
-    extension = '.bat' if platform in ['win-32', 'win-64'] else '.sh'
-    template_name = 'build_script' + extension
-    template = env.get_or_select_template(template_name)
+    template = TEMPLATES.get_template('build_script' + script_extension(platform))
 
     return template.render(**context)
 
@@ -246,8 +291,7 @@ def gen_build_script(staging_dir, working_dir, build_data, **context):
     build_script = render_build_script(working_dir, build_data, **context)
 
     platform = build_data['build_item_info']['platform']
-    extension = '.bat' if platform in ['win-32', 'win-64'] else '.sh'
-    script_filename = 'build_script' + extension
+    script_filename = 'build_script' + script_extension(platform)
     script_path = os.path.join(staging_dir, script_filename)
 
     with open(script_path, 'w') as fd:
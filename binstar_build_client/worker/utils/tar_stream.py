@@ -0,0 +1,69 @@
+"""
+Stream a tar archive of files on disk without holding it in memory
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+from io import BytesIO
+import logging
+import os
+import tarfile
+import threading
+
+log = logging.getLogger('binstar.build')
+
+CHUNK_SIZE = 2 ** 16
+
+
+def write_tar(fileobj, files=(), data=()):
+    '''
+    Write an uncompressed tar stream to `fileobj`
+
+    :param files: list of (filename, arcname) of files on disk
+    :param data: list of (arcname, content, mode) of files in memory
+    '''
+    with tarfile.open(fileobj=fileobj, mode='w|') as tf:
+        for filename, arcname in files:
+            tf.add(filename, arcname)
+        for arcname, content, mode in data:
+            info = tarfile.TarInfo(arcname)
+            info.size = len(content)
+            info.mode = mode
+            tf.addfile(info, BytesIO(content))
+
+
+def tar_stream(files=(), data=(), chunk_size=CHUNK_SIZE):
+    '''
+    A generator of the chunks of a tar archive of `files` and `data`
+
+    The archive is written to a pipe by a background thread, so only
+    a pipe buffer and one chunk are in memory at any time, whatever the
+    size of the files. See `write_tar` for the arguments.
+    '''
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def writer():
+        try:
+            with os.fdopen(write_fd, 'wb') as fd:
+                write_tar(fd, files, data)
+        except Exception as err:
+            errors.append(err)
+
+    thread = threading.Thread(target=writer, name='tar-stream')
+    thread.daemon = True
+    thread.start()
+
+    try:
+        # If the consumer stops early, closing the read end makes the
+        # writer fail with a broken pipe and exit
+        with os.fdopen(read_fd, 'rb') as fd:
+            while True:
+                chunk = fd.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        thread.join()
+
+    if errors:
+        raise errors[0]
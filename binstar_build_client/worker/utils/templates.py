@@ -0,0 +1,112 @@
+"""
+Load, cache and precompile the build script templates
+
+This module only depends on jinja2 so that `setup.py` can precompile the
+templates at install time without importing the rest of the package.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import io
+import logging
+import os
+import threading
+
+import jinja2
+
+log = logging.getLogger('binstar.build')
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+COMPILED_DIR = 'compiled'
+# Compiled templates are only valid for the jinja2 version that compiled them
+VERSION_FILE = 'JINJA2_VERSION'
+
+
+def is_template(name):
+    return name.startswith('build_script.')
+
+
+def precompile_templates(data_dir=DATA_DIR):
+    '''
+    Compile the build script templates into python modules
+
+    Args:
+        data_dir: the directory containing the templates
+
+    Returns:
+        (str) the directory the compiled templates were written to
+    '''
+    target = os.path.join(data_dir, COMPILED_DIR)
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(data_dir))
+    env.compile_templates(target, zip=None, filter_func=is_template)
+
+    with io.open(os.path.join(target, VERSION_FILE), 'wb') as fd:
+        fd.write(jinja2.__version__.encode('utf-8'))
+
+    return target
+
+
+def compiled_templates_dir(data_dir=DATA_DIR):
+    '''
+    The directory of precompiled templates if it is usable, otherwise None
+
+    Precompiled templates are ignored if they were compiled by another jinja2
+    version or are older than any of the template sources.
+    '''
+    target = os.path.join(data_dir, COMPILED_DIR)
+    version_file = os.path.join(target, VERSION_FILE)
+    try:
+        with io.open(version_file) as fd:
+            version = fd.read().strip()
+        compiled_mtime = os.path.getmtime(version_file)
+        source_mtime = max(os.path.getmtime(os.path.join(data_dir, name))
+                           for name in os.listdir(data_dir) if is_template(name))
+    except (IOError, OSError, ValueError):
+        return None
+
+    if version != jinja2.__version__ or compiled_mtime < source_mtime:
+        log.debug('Ignoring stale precompiled templates in %s', target)
+        return None
+
+    return target
+
+
+class TemplateCache(object):
+    '''
+    Build script templates are parsed and compiled once per process,
+    rendering a job is then a dictionary lookup plus the render itself.
+    '''
+    def __init__(self, data_dir=DATA_DIR, globals=None):
+        self.data_dir = data_dir
+        self.globals = globals or {}
+        self.env = None
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def environment(self):
+        if self.env is None:
+            loader = jinja2.FileSystemLoader(self.data_dir)
+            compiled = compiled_templates_dir(self.data_dir)
+            if compiled:
+                log.debug('Using precompiled templates from %s', compiled)
+                loader = jinja2.ChoiceLoader([jinja2.ModuleLoader(compiled), loader])
+
+            env = jinja2.Environment(loader=loader, auto_reload=False)
+            env.globals.update(self.globals)
+            self.env = env
+        return self.env
+
+    def get_template(self, name):
+        try:
+            return self.templates[name]
+        except KeyError:
+            pass
+
+        with self.lock:
+            if name not in self.templates:
+                self.templates[name] = self.environment().get_template(name)
+            return self.templates[name]
+
+    def clear(self):
+        with self.lock:
+            self.env = None
+            self.templates = {}
@@ -0,0 +1,75 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import itertools
+import unittest
+
+from mock import Mock
+
+from binstar_build_client.worker.utils.container_pool import ContainerPool, entrypoint_script
+
+
+class TestContainerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Mock()
+        counter = itertools.count()
+        self.client.create_container.side_effect = lambda *args, **kwargs: {'Id': next(counter)}
+        self.pool = ContainerPool(self.client, 2, 'worker_id')
+        self.addCleanup(self.pool.close)
+
+    def removed(self):
+        return [call[0][0]['Id'] for call in self.client.remove_container.call_args_list]
+
+    def test_entrypoint_script(self):
+        script = entrypoint_script(['bash', '/home/build_script.sh', '--api-token', 'a b'])
+        self.assertEqual(script, "#!/bin/bash\nexec bash /home/build_script.sh --api-token 'a b'\n")
+
+    def test_get(self):
+        container, warm = self.pool.get('image', 'id1', '/home')
+        self.assertEqual(container, {'Id': 0})
+        self.assertFalse(warm)
+
+        self.pool.drain()
+        self.assertEqual(self.client.create_container.call_count, 3)
+        self.client.create_container.assert_called_with(
+            'image', command='bash /home/anaconda-build-entrypoint.sh',
+            labels={'org.anaconda.build.pool': 'worker_id'})
+
+        container, warm = self.pool.get('image', 'id1', '/home')
+        self.assertEqual(container, {'Id': 1})
+        self.assertTrue(warm)
+
+        self.pool.drain()
+        self.assertEqual(self.client.create_container.call_count, 4)
+
+    def test_release(self):
+        container, warm = self.pool.get('image', 'id1', '/home')
+        self.pool.release(container)
+        self.pool.drain()
+        self.assertEqual(self.removed(), [0])
+
+    def test_new_image(self):
+        self.pool.get('image', 'id1', '/home')
+        self.pool.drain()
+
+        container, warm = self.pool.get('image', 'id2', '/home')
+        self.assertFalse(warm)
+        self.pool.drain()
+        self.assertEqual(sorted(self.removed()), [1, 2])
+
+    def test_close(self):
+        self.pool.get('image', 'id1', '/home')
+        self.pool.drain()
+        self.pool.close()
+        self.assertEqual(sorted(self.removed()), [1, 2])
+
+    def test_remove_leftovers(self):
+        self.client.containers.return_value = [{'Id': 'old'}]
+        self.pool.remove_leftovers()
+        self.client.containers.assert_called_once_with(
+            all=True, filters={'label': 'org.anaconda.build.pool=worker_id'})
+        self.assertEqual(self.removed(), ['old'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import Mock, patch
+
+from binstar_build_client.worker.utils.docker_images import (
+    ImageCache, PullError, PullManager, PullProgress, split_image)
+
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Mock()
+        self.client.images.return_value = [
+            {'Id': 'sha256:aaa', 'RepoTags': ['binstar/linux-64:latest', 'binstar/linux-64:v1']},
+            {'Id': 'sha256:bbb', 'RepoTags': ['binstar/linux-64:v2']},
+        ]
+        self.client.inspect_image.side_effect = lambda image_id: {
+            'Config': {'WorkingDir': '/home/' + image_id[-3:]}}
+        self.cache = ImageCache(self.client)
+
+    def test_split_image(self):
+        self.assertEqual(split_image('binstar/linux-64'), ('binstar/linux-64', None))
+        self.assertEqual(split_image('binstar/linux-64:v1'), ('binstar/linux-64', 'v1'))
+        self.assertEqual(split_image('localhost:5000/linux-64'), ('localhost:5000/linux-64', None))
+        self.assertEqual(split_image('localhost:5000/linux-64:v1'), ('localhost:5000/linux-64', 'v1'))
+        self.assertEqual(split_image('linux-64@sha256:abc'), ('linux-64', None))
+
+    def test_resolve(self):
+        self.assertEqual(self.cache.working_dir('binstar/linux-64'), '/home/aaa')
+        self.assertEqual(self.cache.working_dir('binstar/linux-64:v2'), '/home/bbb')
+        self.client.images.assert_called_with('binstar/linux-64')
+
+        with self.assertRaises(KeyError):
+            self.cache.image_id('binstar/linux-64:v3')
+
+    def test_cached(self):
+        for _ in range(3):
+            self.assertEqual(self.cache.working_dir('binstar/linux-64:v1'), '/home/aaa')
+        self.assertEqual(self.client.images.call_count, 1)
+        self.assertEqual(self.client.inspect_image.call_count, 1)
+
+        # Another name for the same image id does not inspect the image again
+        self.cache.working_dir('binstar/linux-64:latest')
+        self.assertEqual(self.client.inspect_image.call_count, 1)
+
+    def test_invalidate(self):
+        self.cache.working_dir('binstar/linux-64:v1')
+        self.client.images.return_value = [
+            {'Id': 'sha256:ccc', 'RepoTags': ['binstar/linux-64:v1']},
+        ]
+
+        self.assertEqual(self.cache.working_dir('binstar/linux-64:v1'), '/home/aaa')
+        self.cache.invalidate('binstar/linux-64:v1')
+        self.assertEqual(self.cache.working_dir('binstar/linux-64:v1'), '/home/ccc')
+
+    @patch('binstar_build_client.worker.utils.docker_images.time')
+    def test_expired(self, clock):
+        clock.time.return_value = 1000
+        self.assertEqual(self.cache.image_id('binstar/linux-64:v1'), 'sha256:aaa')
+
+        # Pulled outside the worker
+        self.client.images.return_value = [
+            {'Id': 'sha256:ccc', 'RepoTags': ['binstar/linux-64:v1']},
+        ]
+        clock.time.return_value = 1000 + self.cache.ttl - 1
+        self.assertEqual(self.cache.image_id('binstar/linux-64:v1'), 'sha256:aaa')
+        clock.time.return_value = 1000 + self.cache.ttl
+        self.assertEqual(self.cache.image_id('binstar/linux-64:v1'), 'sha256:ccc')
+        self.assertEqual(self.cache.working_dir('binstar/linux-64:v1'), '/home/ccc')
+        self.assertEqual(self.client.images.call_count, 2)
+
+
+def pull_messages(image):
+    return [json.dumps(msg) for msg in [
+        {'status': 'Pulling from ' + image, 'id': 'latest'},
+        {'status': 'Pulling fs layer', 'id': 'l1', 'progressDetail': {}},
+        {'status': 'Already exists', 'id': 'l2', 'progressDetail': {}},
+        {'status': 'Downloading', 'id': 'l1', 'progressDetail': {'current': 1024 ** 2, 'total': 2 * 1024 ** 2}},
+        {'status': 'Downloading', 'id': 'l1', 'progressDetail': {'current': 2 * 1024 ** 2, 'total': 2 * 1024 ** 2}},
+        {'status': 'Pull complete', 'id': 'l1', 'progressDetail': {}},
+        {'status': 'Status: Downloaded newer image for ' + image},
+    ]]
+
+
+class TestPullManager(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+
+        self.local = {}
+        self.client = Mock()
+        self.client.images.side_effect = lambda repository: [
+            {'Id': image_id, 'RepoTags': [name]} for name, image_id in self.local.items()
+            if split_image(name)[0] == repository]
+        self.client.inspect_image.return_value = {'VirtualSize': 2 * 1024 ** 3}
+
+        def pull(repository, tag=None, stream=False):
+            name = '{0}:{1}'.format(repository, tag) if tag else repository
+            self.local[name] = 'id-' + name
+            return iter(pull_messages(name))
+        self.client.pull.side_effect = pull
+
+        self.pulls = PullManager(self.client, ImageCache(self.client), self.state_dir,
+                                 budget=5 * 1024 ** 3, ttl=60, protected=['worker/image'])
+        self.output = []
+
+    def test_pull_once(self):
+        self.assertTrue(self.pulls.pull('user/image:1', self.output.append))
+        self.assertFalse(self.pulls.pull('user/image:1', self.output.append))
+        self.assertEqual(self.client.pull.call_count, 1)
+        self.client.pull.assert_called_with('user/image', tag='1', stream=True)
+
+        self.assertEqual(self.output[-3], 'Docker: Pull user/image:1: 2/2 layers, 2.0/2.0 MB\n')
+        self.assertEqual(self.output[-1], 'Docker: Using local image user/image:1\n')
+
+    def test_pull_expired(self):
+        self.pulls.pull('user/image:1', self.output.append)
+        pulled = self.pulls._pulled_file('user/image:1')
+        os.utime(pulled, (time.time() - 120, time.time() - 120))
+
+        self.assertTrue(self.pulls.pull('user/image:1', self.output.append))
+
+    def test_pull_error(self):
+        self.client.pull.side_effect = lambda *args, **kwargs: iter(
+            [json.dumps({'error': 'image not found'})])
+        with self.assertRaises(PullError):
+            self.pulls.pull('user/missing', self.output.append)
+
+    def test_evict(self):
+        self.pulls.pull('user/image:1', self.output.append)
+        self.pulls.pull('user/image:2', self.output.append)
+        self.assertFalse(self.client.remove_image.called)
+
+        # Over the 5 GB budget, the least recently used image is removed
+        self.pulls.pull('user/image:3', self.output.append)
+        self.client.remove_image.assert_called_once_with('user/image:1')
+
+    def test_progress_throttled(self):
+        output = []
+        progress = PullProgress('image', output.append, interval=60)
+        for line in pull_messages('image'):
+            progress.update(json.loads(line))
+        progress.finish()
+
+        self.assertEqual(output, [
+            'Docker: Pull image: 0/0 layers, 0.0/0.0 MB\r',
+            'Docker: Pull image: 2/2 layers, 2.0/2.0 MB\n',
+            'Docker: Status: Downloaded newer image for image\n',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import unittest
+
+from mock import Mock
+
+from binstar_build_client.worker.utils.docker_resources import (
+    ResourceLimits, parse_bytes, parse_tmpfs)
+
+
+class TestResourceLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.limits = ResourceLimits(cpus=4, memory=8 * 1024 ** 3, pids=1024)
+
+    def test_parse(self):
+        self.assertEqual(parse_bytes('512m'), 512 * 1024 ** 2)
+        self.assertEqual(parse_bytes('1.5G'), 3 * 512 * 1024 ** 2)
+        self.assertEqual(parse_bytes('2gb'), 2 * 1024 ** 3)
+        self.assertEqual(parse_bytes(1024), 1024)
+        self.assertIsNone(parse_bytes(None))
+        with self.assertRaises(ValueError):
+            parse_bytes('lots')
+
+        self.assertEqual(parse_tmpfs('/tmp:size=1g'), ('/tmp', 'size=1g'))
+        self.assertEqual(parse_tmpfs('/run'), ('/run', ''))
+        with self.assertRaises(ValueError):
+            parse_tmpfs('tmp')
+
+    def test_from_args(self):
+        args = Mock(cpus=1.5, cpu_shares=None, memory='2g', memory_swap=None,
+                    pids_limit=None, tmpfs=['/tmp:size=1g'])
+        limits = ResourceLimits.from_args(args)
+        self.assertEqual(limits.host_config(), {
+            'cpu_period': 100000,
+            'cpu_quota': 150000,
+            'mem_limit': 2 * 1024 ** 3,
+            'tmpfs': {'/tmp': 'size=1g'},
+        })
+        self.assertEqual(limits.describe(), 'cpus=1.5, memory=2g, tmpfs=/tmp')
+
+    def test_no_override(self):
+        limits, warnings = self.limits.override(None)
+        self.assertEqual(limits, self.limits)
+        self.assertEqual(warnings, [])
+
+    def test_override_lower(self):
+        limits, warnings = self.limits.override({'cpus': 2, 'memory': '2g', 'cpu_shares': 512})
+        self.assertEqual(warnings, [])
+        self.assertEqual(limits.cpus, 2)
+        self.assertEqual(limits.memory, 2 * 1024 ** 3)
+        self.assertEqual(limits.cpu_shares, 512)
+        self.assertEqual(limits.pids, 1024)
+        self.assertNotEqual(limits, self.limits)
+
+    def test_override_capped(self):
+        limits, warnings = self.limits.override({'cpus': 16, 'memory': '64g', 'pids': -1,
+                                                 'privileged': True})
+        self.assertEqual(limits, self.limits)
+        self.assertEqual(len(warnings), 4)
+        self.assertIn("unsupported resource 'privileged'", warnings[0])
+        self.assertIn('using 4', warnings[1])
+        self.assertIn('using 8g', warnings[2])
+
+    def test_override_invalid(self):
+        limits, warnings = self.limits.override({'memory': 'lots'})
+        self.assertEqual(limits, self.limits)
+        self.assertEqual(len(warnings), 1)
+
+        limits, warnings = self.limits.override('4g')
+        self.assertEqual(limits, self.limits)
+        self.assertEqual(len(warnings), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
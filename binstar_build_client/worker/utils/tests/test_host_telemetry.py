@@ -0,0 +1,67 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from binstar_build_client.worker.utils.host_telemetry import (
+    FIELDS, HEADER, RECORD, HostSampler, RingFile)
+
+
+class TestHostTelemetry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.filename = os.path.join(self.tmp, 'telemetry', 'worker.ring')
+
+    def values(self, t):
+        return dict((field, t) for field in FIELDS)
+
+    def test_ring(self):
+        ring = RingFile(self.filename, capacity=3)
+        self.assertEqual(ring.read(), [])
+
+        for t in range(1, 6):
+            ring.append(self.values(t))
+
+        self.assertEqual([sample['time'] for sample in ring.read()], [3, 4, 5])
+        self.assertEqual([sample['time'] for sample in ring.read(last=1)], [5])
+        self.assertEqual(os.path.getsize(self.filename), HEADER.size + 3 * RECORD.size)
+
+        # Reopening the file keeps the samples, unless the capacity changed
+        self.assertEqual(len(RingFile(self.filename, capacity=3).read()), 3)
+        self.assertEqual(RingFile(self.filename, capacity=4).read(), [])
+
+    def test_sample(self):
+        sampler = HostSampler(self.filename, interval=60, path=self.tmp)
+        sampler.sample()
+
+        stats = sampler.stats()
+        samples = stats['host telemetry']['out']
+        self.assertEqual(len(samples), 1)
+        self.assertEqual(sorted(samples[0]), sorted(FIELDS))
+        self.assertGreater(samples[0]['disk_free'], 0)
+
+    def test_thread(self):
+        sampler = HostSampler(self.filename, interval=0.01, path=self.tmp)
+        sampler.start()
+        while not sampler.ring.read():
+            pass
+        sampler.stop()
+        self.assertIsNone(sampler._thread)
+
+    def test_upload(self):
+        uploaded = threading.Event()
+        sampler = HostSampler(self.filename, interval=0.01, path=self.tmp,
+                              upload=uploaded.set, upload_interval=0.05)
+        sampler.start()
+        self.assertTrue(uploaded.wait(10))
+        sampler.stop()
+        self.assertTrue(sampler.ring.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import unittest
+
+import requests
+
+from binstar_build_client.worker.utils import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = metrics.Counter('jobs_total', 'Jobs', labels=['status'], registry=self.registry)
+        counter.inc(status='success')
+        counter.inc(2, status='failure')
+        counter.inc(status='success')
+
+        self.assertEqual(counter.value(status='success'), 2)
+        self.assertEqual(self.registry.render(), (
+            '# HELP jobs_total Jobs\n'
+            '# TYPE jobs_total counter\n'
+            'jobs_total{status="failure"} 2\n'
+            'jobs_total{status="success"} 2\n'
+        ))
+
+        with self.assertRaises(ValueError):
+            counter.inc(section='build')
+
+    def test_gauge(self):
+        gauge = metrics.Gauge('busy', 'Busy slots', registry=self.registry)
+        self.assertEqual(self.registry.render().splitlines()[-1], 'busy 0')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(self.registry.render().splitlines()[-1], 'busy 1')
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('poll_seconds', 'Polls', buckets=(0.1, 1),
+                                      registry=self.registry)
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.value(), 4)
+        self.assertEqual(self.registry.render().splitlines()[2:], [
+            'poll_seconds_bucket{le="0.1"} 1',
+            'poll_seconds_bucket{le="1.0"} 3',
+            'poll_seconds_bucket{le="+Inf"} 4',
+            'poll_seconds_sum 6.05',
+            'poll_seconds_count 4',
+        ])
+
+    def test_serve(self):
+        metrics.JOBS_STARTED.inc()
+        server = metrics.serve(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+
+        res = requests.get(url + '/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('# TYPE anaconda_build_jobs_started_total counter', res.text)
+        self.assertIn('anaconda_build_polls_total', res.text)
+
+        self.assertEqual(requests.get(url + '/other').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from binstar_build_client.worker.utils.pkgs_cache import PackageCache, fcntl
+
+
+class TestPackageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.cache = PackageCache(self.root, max_size=2500)
+
+    def add_package(self, name, size, last_used):
+        path = os.path.join(self.cache.pkgs_dir, name)
+        os.makedirs(path)
+        with open(os.path.join(path, 'data'), 'wb') as fd:
+            fd.write(b'x' * size)
+        os.utime(os.path.join(path, 'data'), (last_used, last_used))
+        os.utime(path, (last_used, last_used))
+        return path
+
+    def test_binds(self):
+        binds = self.cache.binds()
+        self.assertEqual(binds[self.cache.pkgs_dir]['bind'],
+                         self.cache.environment()['CONDA_PKGS_DIRS'])
+        self.assertEqual(binds[self.cache.pip_dir]['bind'],
+                         self.cache.environment()['PIP_CACHE_DIR'])
+
+    def test_trim(self):
+        oldest = self.add_package('a-1.0-0', 1000, 100)
+        self.add_package('b-1.0-0', 1000, 300)
+        self.add_package('c-1.0-0', 1000, 200)
+        with open(os.path.join(self.cache.pkgs_dir, 'urls.txt'), 'w') as fd:
+            fd.write('x' * 1000)
+        lock = os.path.join(self.cache.pkgs_dir, 'b-1.0-0', '.conda_lock-1')
+        open(lock, 'w').close()
+
+        self.assertEqual(self.cache.trim(), 1000)
+        self.assertEqual(sorted(os.listdir(self.cache.pkgs_dir)),
+                         ['b-1.0-0', 'c-1.0-0', 'urls.txt'])
+        self.assertFalse(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(lock))
+
+        self.assertEqual(self.cache.trim(), 0)
+
+    def test_trim_recently_used(self):
+        self.add_package('a-1.0-0', 2000, 100)
+        recent = self.add_package('b-1.0-0', 2000, time.time())
+
+        # A running build may be using the recent entry
+        self.assertEqual(self.cache.trim(), 2000)
+        self.assertEqual(self.cache.trim(), 0)
+        self.assertTrue(os.path.exists(recent))
+
+    @unittest.skipIf(fcntl is None, 'requires fcntl')
+    def test_trim_in_use(self):
+        path = self.add_package('a-1.0-0', 5000, 100)
+        lock = os.path.join(path, '.conda_lock-1')
+        open(lock, 'w').close()
+        for filename in (lock, path):
+            os.utime(filename, (100, 100))
+
+        with self.cache.shared():
+            self.assertEqual(self.cache.trim(), 5000)
+            # A build starts while the cache is trimmed
+            with self.cache.shared():
+                pass
+
+        self.assertEqual(os.listdir(self.cache.pkgs_dir), [])
+
+if __name__ == '__main__':
+    unittest.main()
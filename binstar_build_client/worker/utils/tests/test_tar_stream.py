@@ -0,0 +1,46 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+from io import BytesIO
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from binstar_build_client.worker.utils.tar_stream import tar_stream
+
+
+class TestTarStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, 'source.tar.bz2')
+        with open(self.filename, 'wb') as fd:
+            fd.write(os.urandom(300 * 1024))
+
+    def test_stream(self):
+        chunks = list(tar_stream([(self.filename, 'source.tar.bz2')],
+                                 [('entrypoint.sh', b'#!/bin/bash\n', 0o755)],
+                                 chunk_size=1024))
+
+        self.assertTrue(all(len(chunk) <= 1024 for chunk in chunks))
+        with tarfile.open(fileobj=BytesIO(b''.join(chunks))) as tf:
+            self.assertEqual(tf.getnames(), ['source.tar.bz2', 'entrypoint.sh'])
+            with open(self.filename, 'rb') as fd:
+                self.assertEqual(tf.extractfile('source.tar.bz2').read(), fd.read())
+            self.assertEqual(tf.getmember('entrypoint.sh').mode, 0o755)
+
+    def test_stop_early(self):
+        stream = tar_stream([(self.filename, 'source.tar.bz2')], chunk_size=1024)
+        next(stream)
+        # Does not block on the writer thread
+        stream.close()
+
+    def test_missing_file(self):
+        with self.assertRaises(OSError):
+            list(tar_stream([(os.path.join(self.tmpdir, 'missing'), 'missing')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock, patch
+
+from binstar_client import errors
+from binstar_build_client.worker.utils import uploader
+
+
+def fake_get_attrs(package_type, filename):
+    basename = os.path.basename(filename)
+    return ({'summary': 'summary', 'license': 'BSD'},
+            {'version': '1.0', 'description': ''},
+            {'basename': 'linux-64/' + basename, 'attrs': {'build': '0'}})
+
+
+@patch('binstar_build_client.worker.utils.uploader.get_attrs', fake_get_attrs)
+@patch('binstar_build_client.worker.utils.uploader.detect_package_type', Mock(return_value='conda'))
+@patch('binstar_build_client.worker.utils.uploader.Binstar')
+class TestUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.files = []
+        for i in range(5):
+            filename = os.path.join(self.tmpdir, 'pkg-1.0-{0}.tar.bz2'.format(i))
+            with open(filename, 'wb') as fd:
+                fd.write(b'x' * 1024)
+            self.files.append(filename)
+
+        self.bs = Mock(domain='http://api.example.com')
+
+        patcher = patch.object(uploader.Uploader, 'RETRY_DELAY', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_uploader(self, **kwargs):
+        kwargs.setdefault('jobs', 3)
+        return uploader.Uploader(self.bs, 'token', 'owner', 'pkg', ['dev'], build_id='1.0', **kwargs)
+
+    def test_upload_all(self, Binstar):
+        api = Binstar.return_value
+        results = list(self.make_uploader().upload(self.files))
+
+        self.assertEqual(sorted(r['filename'] for r in results), self.files)
+        self.assertTrue(all(r['error'] is None for r in results))
+        self.assertEqual(api.upload.call_count, 5)
+        # The package and the release are only looked up once
+        self.assertEqual(api.release.call_count, 1)
+        self.assertFalse(api.remove_dist.called)
+
+        args, kwargs = api.upload.call_args
+        self.assertEqual(args[:3], ('owner', 'pkg', '1.0'))
+        self.assertEqual(kwargs['channels'], ['dev'])
+        self.assertEqual(kwargs['attrs']['binstar_build'], '1.0')
+
+        self.assertIn('MB/s', uploader.format_result(results[0]))
+
+    def test_create_release(self, Binstar):
+        api = Binstar.return_value
+        api.package.side_effect = errors.NotFound('no package')
+        api.release.side_effect = errors.NotFound('no release')
+
+        list(self.make_uploader().upload(self.files[:2]))
+
+        self.assertEqual(api.add_package.call_count, 1)
+        api.add_release.assert_called_once_with(
+            'owner', 'pkg', '1.0', [], None, {'version': '1.0', 'description': ''})
+
+    def test_force(self, Binstar):
+        api = Binstar.return_value
+        api.remove_dist.side_effect = [None, errors.NotFound('no dist')]
+
+        results = list(self.make_uploader(force=True).upload(self.files[:2]))
+
+        self.assertEqual(api.remove_dist.call_count, 2)
+        self.assertTrue(all(r['error'] is None for r in results))
+
+    def test_retry(self, Binstar):
+        api = Binstar.return_value
+        api.upload.side_effect = [errors.ServerError('oops'), None]
+
+        result, = self.make_uploader().upload(self.files[:1])
+
+        self.assertIsNone(result['error'])
+        self.assertEqual(result['attempts'], 2)
+        self.assertEqual(api.upload.call_count, 2)
+
+    def test_no_retry_on_conflict(self, Binstar):
+        api = Binstar.return_value
+        api.upload.side_effect = errors.Conflict('exists')
+
+        result, = self.make_uploader().upload(self.files[:1])
+
+        self.assertIn('exists', result['error'])
+        self.assertEqual(result['attempts'], 1)
+        self.assertIn('Failed to upload', uploader.format_result(result))
+
+
+if __name__ == '__main__':
+    unittest.main()
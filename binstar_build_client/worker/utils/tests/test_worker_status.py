@@ -0,0 +1,67 @@
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from binstar_build_client.worker.utils.worker_status import (
+    WorkerStatus, format_summary, read_status, summarize)
+
+
+class TestWorkerStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.workers_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workers_dir)
+        self.filename = os.path.join(self.workers_dir, 'worker1.status.json')
+        self.status = WorkerStatus(self.filename, {'name': 'worker1', 'worker_id': 'id1'})
+
+    def job(self, job_id):
+        return {'job': {'_id': job_id}, 'job_name': 'user/package/{0}'.format(job_id)}
+
+    @patch('binstar_build_client.worker.utils.worker_status.time.time')
+    def test_summary(self, time):
+        time.return_value = 1000
+        self.status = WorkerStatus(self.filename, {'name': 'worker1', 'worker_id': 'id1'})
+        self.status.update(True, 'ok')
+        self.status.start_job(self.job('1'))
+        time.return_value = 1100
+        self.status.finish_job(self.job('1'), 'success')
+        self.status.start_job(self.job('2'))
+
+        status = read_status(self.filename)
+        self.assertEqual(status['name'], 'worker1')
+        self.assertEqual(os.listdir(self.workers_dir), ['worker1.status.json'])
+
+        summary = summarize(status, os.getpid(), now=4630)
+        self.assertEqual(summary['state'], 'building')
+        self.assertEqual(summary['jobs'], [{'name': 'user/package/2', 'seconds': 3530}])
+        self.assertEqual(summary['uptime'], 3630)
+        self.assertEqual(summary['builds'], 1)
+        self.assertEqual(summary['builds_last_hour'], 1)
+        self.assertEqual(summary['mean_build_seconds'], 100)
+        self.assertEqual(format_summary(summary),
+                         'running with pid: {0}, building user/package/2 for 58m, '
+                         'up 1h00m, 1 builds in the last hour'.format(os.getpid()))
+
+    def test_not_running(self):
+        self.status.update(False, 'Server error')
+        status = read_status(self.filename)
+
+        self.assertEqual(summarize(status, os.getpid())['state'], 'error: Server error')
+        self.assertEqual(summarize(status, None), {'running': False, 'pid': None, 'state': 'stopped'})
+
+        # The status of a previous process of the worker
+        summary = summarize(status, os.getpid() + 1)
+        self.assertEqual(summary['state'], 'running')
+        self.assertEqual(format_summary(summary), 'running with pid: {0}'.format(os.getpid() + 1))
+
+    def test_no_status(self):
+        self.assertIsNone(read_status(os.path.join(self.workers_dir, 'missing.status.json')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+"""
+Upload the build targets of a build from the worker process
+
+The build script uploads each build target with its own `anaconda upload`
+process. With `anaconda worker run --upload-jobs N` the worker uploads the
+build targets itself instead, over one authenticated session with up to N
+uploads in flight.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from multiprocessing.pool import ThreadPool
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from binstar_client import Binstar
+from binstar_client import errors
+from binstar_client.utils.detect import detect_package_type, get_attrs
+
+log = logging.getLogger('binstar.build')
+
+MB = 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class Uploader(object):
+    '''
+    Upload files to one package of anaconda.org concurrently
+
+    :param bs: the Binstar object of the worker, used for its domain
+    :param token: the upload token of the build
+    :param owner: the owner of the package
+    :param package: the name of the package
+    :param labels: the list of labels to upload the files to
+    :param build_id: the build number the files are attached to
+    :param force: replace existing files
+    :param jobs: the maximum number of uploads in flight
+    '''
+    RETRIES = 3
+    RETRY_DELAY = 2
+
+    # Errors worth a second attempt, anything else (like a conflict or an
+    # authorization error) fails the upload right away
+    RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, errors.ServerError)
+
+    def __init__(self, bs, token, owner, package, labels, build_id=None,
+                 force=False, jobs=4):
+        self.owner = owner
+        self.package = package
+        self.labels = labels
+        self.build_id = build_id
+        self.force = force
+        self.jobs = max(1, jobs)
+
+        self.api = Binstar(token, domain=bs.domain, verify=bs.session.verify)
+        adapter = HTTPAdapter(pool_connections=self.jobs, pool_maxsize=self.jobs)
+        self.api.session.mount('http://', adapter)
+        self.api.session.mount('https://', adapter)
+
+        self._releases = set()
+        self._release_lock = threading.Lock()
+
+    def inspect(self, filename):
+        '''
+        Read the package metadata of filename
+
+        :return: (package_type, package_attrs, release_attrs, file_attrs)
+        '''
+        package_type = detect_package_type(filename)
+        if not package_type:
+            raise UploadError('Could not detect the package type of {0}'.format(filename))
+
+        try:
+            package_attrs, release_attrs, file_attrs = get_attrs(package_type, filename)
+        except Exception as err:
+            raise UploadError('Could not read the package metadata of {0}: {1}'.format(filename, err))
+
+        return package_type, package_attrs, release_attrs, file_attrs
+
+    def ensure_release(self, package_attrs, release_attrs):
+        '''
+        Create the package and the release of a file, once per version
+        '''
+        version = release_attrs['version']
+        with self._release_lock:
+            if version in self._releases:
+                return
+            try:
+                self.api.package(self.owner, self.package)
+            except errors.NotFound:
+                self.api.add_package(self.owner, self.package,
+                                     summary=package_attrs.get('summary'),
+                                     license=package_attrs.get('license'),
+                                     attrs=package_attrs)
+            try:
+                self.api.release(self.owner, self.package, version)
+            except errors.NotFound:
+                self.api.add_release(self.owner, self.package, version, [], None, release_attrs)
+            self._releases.add(version)
+
+    def upload_once(self, filename):
+        package_type, package_attrs, release_attrs, file_attrs = self.inspect(filename)
+        version = release_attrs['version']
+        basename = file_attrs['basename']
+
+        self.ensure_release(package_attrs, release_attrs)
+
+        if self.force:
+            try:
+                self.api.remove_dist(self.owner, self.package, version, basename)
+            except errors.NotFound:
+                pass
+
+        attrs = dict(file_attrs.get('attrs') or {})
+        if self.build_id:
+            attrs['binstar_build'] = self.build_id
+
+        with open(filename, 'rb') as fd:
+            self.api.upload(self.owner, self.package, version, basename, fd, package_type,
+                            file_attrs.get('description') or '',
+                            dependencies=file_attrs.get('dependencies'),
+                            attrs=attrs, channels=self.labels)
+
+        return basename
+
+    def upload_file(self, filename):
+        '''
+        Upload a single file, retrying transient errors
+
+        :return: dict with the keys `filename`, `basename`, `size`, `seconds`,
+                 `attempts` and `error` (None on success)
+        '''
+        result = {'filename': filename, 'basename': os.path.basename(filename),
+                  'size': os.path.getsize(filename), 'seconds': 0.0,
+                  'attempts': 0, 'error': None}
+
+        start = time.time()
+        for attempt in range(1, self.RETRIES + 1):
+            result['attempts'] = attempt
+            try:
+                result['basename'] = self.upload_once(filename)
+                result['error'] = None
+                break
+            except self.RETRY_ERRORS as err:
+                result['error'] = '{0}: {1}'.format(type(err).__name__, err)
+                log.warn('Upload of %s failed (attempt %s/%s): %s',
+                         filename, attempt, self.RETRIES, result['error'])
+                if attempt < self.RETRIES:
+                    time.sleep(self.RETRY_DELAY * attempt)
+            except (UploadError, errors.BinstarError, IOError, OSError) as err:
+                result['error'] = '{0}: {1}'.format(type(err).__name__, err)
+                break
+
+        result['seconds'] = time.time() - start
+        return result
+
+    def upload(self, filenames):
+        '''
+        Upload all of filenames with at most `jobs` uploads in flight
+
+        Yields the result of each file as its upload completes
+        '''
+        if not filenames:
+            return
+
+        pool = ThreadPool(min(self.jobs, len(filenames)))
+        try:
+            for result in pool.imap_unordered(self.upload_file, filenames):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def format_result(result):
+    '''
+    A line of the build log reporting the upload of one file
+    '''
+    size = result['size'] / MB
+    if result['error']:
+        return 'Failed to upload {0} after {1} attempts: {2}\n'.format(
+            result['basename'], result['attempts'], result['error'])
+
+    rate = size / result['seconds'] if result['seconds'] else 0.0
+    return 'Uploaded {0} ({1:.1f} MB in {2:.1f}s, {3:.1f} MB/s)\n'.format(
+        result['basename'], size, result['seconds'], rate)
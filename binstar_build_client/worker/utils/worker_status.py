@@ -0,0 +1,158 @@
+"""
+The live status of a running worker, for `anaconda worker list`
+
+A running worker rewrites ~/.anaconda-build/status/NAME.status.json when it
+polls the build queue and when it starts or finishes a build, so listing the
+workers of a host reads local files instead of asking the server.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger('binstar.build')
+
+STATUS_SUFFIX = '.status.json'
+
+
+def write_json(filename, data):
+    '''
+    Write `data` to `filename` atomically, readers never see a partial file
+    '''
+    dirname, basename = os.path.split(filename)
+    tmp = os.path.join(dirname, '.{0}.{1}.tmp'.format(basename, os.getpid()))
+    with io.open(tmp, 'wb') as fd:
+        fd.write(json.dumps(data).encode('utf-8'))
+    os.rename(tmp, filename)
+
+
+def read_status(filename):
+    '''
+    The status written by a worker, None if there is none
+    '''
+    try:
+        with io.open(filename, 'r', encoding='utf-8') as fd:
+            return json.load(fd)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class WorkerStatus(object):
+    '''
+    Track the status of a running worker in `filename`
+
+    :param filename: the status file
+    :param info: the worker configuration, as a dict
+    '''
+    # The finished builds kept to compute the recent throughput
+    RECENT = 100
+
+    def __init__(self, filename, info):
+        self.filename = filename
+        self._lock = threading.Lock()
+        now = time.time()
+        self.data = dict(info, pid=os.getpid(), started=now, updated=now, ok=True,
+                         message='Starting', jobs={}, builds=0, finished=[])
+
+    def _write(self):
+        self.data['updated'] = time.time()
+        try:
+            status_dir = os.path.dirname(self.filename)
+            if not os.path.isdir(status_dir):
+                os.makedirs(status_dir)
+            write_json(self.filename, self.data)
+        except (IOError, OSError) as err:
+            log.warn('Could not write the worker status %s: %s', self.filename, err)
+
+    def update(self, ok, msg):
+        'Record the result of polling the build queue'
+        with self._lock:
+            self.data['ok'] = ok
+            self.data['message'] = msg
+            self._write()
+
+    def start_job(self, job_data):
+        with self._lock:
+            self.data['jobs'][job_data['job']['_id']] = {
+                'name': job_data.get('job_name'),
+                'started': time.time(),
+            }
+            self._write()
+
+    def finish_job(self, job_data, status):
+        with self._lock:
+            job = self.data['jobs'].pop(job_data['job']['_id'], None)
+            now = time.time()
+            duration = now - job['started'] if job else None
+            self.data['builds'] += 1
+            self.data['finished'] = (self.data['finished'] + [[now, duration, status]])[-self.RECENT:]
+            self._write()
+
+
+def summarize(status, pid, now=None):
+    '''
+    The state, current jobs, uptime and recent throughput of a worker
+
+    :param status: the content of its status file, or None
+    :param pid: the pid of the running worker, or None if it is not running
+    '''
+    now = now or time.time()
+    summary = {'running': pid is not None, 'pid': pid}
+    if pid is None:
+        summary['state'] = 'stopped'
+    if not status or pid is None or status.get('pid') != pid:
+        # No status, or the status of a previous process
+        summary.setdefault('state', 'running')
+        return summary
+
+    jobs = sorted(status.get('jobs', {}).values(), key=lambda job: job['started'])
+    if jobs:
+        summary['state'] = 'building'
+    elif status.get('ok'):
+        summary['state'] = 'idle'
+    else:
+        summary['state'] = 'error: {0}'.format(status.get('message'))
+
+    summary['jobs'] = [{'name': job['name'], 'seconds': int(now - job['started'])} for job in jobs]
+    summary['uptime'] = int(now - status['started'])
+    summary['last_update'] = int(now - status['updated'])
+    summary['builds'] = status.get('builds', 0)
+
+    last_hour = [item for item in status.get('finished', []) if now - item[0] < 3600]
+    summary['builds_last_hour'] = len(last_hour)
+    durations = [item[1] for item in last_hour if item[1] is not None]
+    summary['mean_build_seconds'] = int(sum(durations) / len(durations)) if durations else None
+    return summary
+
+
+def format_seconds(seconds):
+    if seconds < 60:
+        return '{0}s'.format(seconds)
+    if seconds < 3600:
+        return '{0}m'.format(seconds // 60)
+    return '{0}h{1:02d}m'.format(seconds // 3600, seconds % 3600 // 60)
+
+
+def format_summary(summary):
+    '''
+    A one line description of a worker summary
+    '''
+    if not summary['running']:
+        return 'stopped'
+
+    items = ['running with pid: {0}'.format(summary['pid'])]
+    if 'uptime' not in summary:
+        return ', '.join(items)
+
+    state = summary['state']
+    if summary['jobs']:
+        state = 'building ' + ', '.join('{0} for {1}'.format(job['name'], format_seconds(job['seconds']))
+                                        for job in summary['jobs'])
+    items.append(state)
+    items.append('up {0}'.format(format_seconds(summary['uptime'])))
+    items.append('{0} builds in the last hour'.format(summary['builds_last_hour']))
+    return ', '.join(items)
@@ -11,14 +11,21 @@ import logging
 import os
 import psutil
 import requests
+import threading
 import time
 
 
+from binstar_build_client.utils import worker_stats
 from binstar_build_client.utils.rm import rm_rf
 from binstar_build_client.worker.utils import process_wrappers
 from binstar_build_client.worker.utils import script_generator
+from binstar_build_client.worker.utils.build_cache import BuildCache
 from binstar_build_client.worker.utils.build_log import BuildLog
+from binstar_build_client.worker.utils.host_telemetry import HostSampler
+from binstar_build_client.worker.utils.pkgs_cache import GB
+from binstar_build_client.worker.utils import metrics
 from binstar_build_client.worker.utils.timeout import read_with_timeout
+from binstar_build_client.worker.utils import uploader
 from binstar_client import errors
 
 
@@ -53,10 +60,39 @@ class Worker(object):
     JOURNAL_FILE = 'journal.csv'
     SLEEP_TIME = 10
 
+    # Builds run at once
+    concurrency = 1
+
+    # Where --telemetry-interval keeps the host samples of each worker
+    TELEMETRY_DIR = os.path.join(os.path.expanduser('~'), '.anaconda-build', 'telemetry')
+    # Seconds between the uploads of the host samples with --telemetry-upload
+    TELEMETRY_UPLOAD_INTERVAL = 15 * 60
+
+    # The WorkerStatus of a running worker, for anaconda worker list
+    live_status = None
+
     def __init__(self, bs, worker_config, args):
         self.bs = bs
         self.args = args
         self.config = worker_config
+        self.build_cache = None
+        if args.build_cache:
+            self.build_cache = BuildCache(args.build_cache, int(args.build_cache_size * GB))
+        self.upload_jobs = args.upload_jobs
+        self.log_batch = args.log_batch
+
+        self.metrics_port = args.metrics_port
+
+        self.telemetry = None
+        if args.telemetry_interval:
+            self.telemetry = HostSampler(
+                os.path.join(self.TELEMETRY_DIR, '{0}.ring'.format(worker_config.name)),
+                args.telemetry_interval, args.cwd,
+                upload=self.upload_telemetry if args.telemetry_upload else None,
+                upload_interval=self.TELEMETRY_UPLOAD_INTERVAL)
+        elif args.telemetry_upload:
+            log.warn('--telemetry-upload has no effect without --telemetry-interval, '
+                     'the host is not sampled')
 
     @property
     def worker_id(self):
@@ -66,18 +102,58 @@ class Worker(object):
         if self.args.status_file:
             with open(self.args.status_file, 'w') as fd:
                 fd.write("{0} {1} '{2}'\n".format(int(not ok), int(time.time()), msg))
+        if self.live_status:
+            self.live_status.update(ok, msg)
 
     def write_stats(self):
+        '''
+        Upload the worker stats in the background, the commands collecting
+        them take seconds and the worker polls for jobs meanwhile
+        '''
+        thread = threading.Thread(target=self.upload_stats, name='worker-stats')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def upload_stats(self, cache=None):
+        '''
+        Upload the worker stats if they changed since the last upload of
+        this worker
+        '''
+        cache = cache or worker_stats.StatsCache()
+        fingerprint = worker_stats.stats_fingerprint()
+        if cache.is_uploaded(self.worker_id, fingerprint):
+            log.info('The worker stats did not change since their last upload')
+            return
+        self._upload_stats(cache, fingerprint)
+
+    def upload_telemetry(self, cache=None):
+        '''
+        Upload the worker stats with the recent host samples, on the
+        schedule of the sampler, whether or not the stats changed
+        '''
+        cache = cache or worker_stats.StatsCache()
+        self._upload_stats(cache, worker_stats.stats_fingerprint())
+
+    def _upload_stats(self, cache, fingerprint):
         try:
+            stats = cache.collect(fingerprint)
+            if self.telemetry and self.args.telemetry_upload:
+                stats = dict(stats, **self.telemetry.stats())
             self.bs.upload_worker_stats(self.config.username,
                                         self.config.queue,
-                                        self.worker_id)
+                                        self.worker_id,
+                                        stats=stats)
         except errors.NotFound:
             log.warn('{} does not support upload '
                      'of worker status information like system '
                      'packages and the output of conda list.'
                      '  It may be an out of date '
                      'version of Repository'.format(self.bs.domain))
+        except Exception:
+            log.warn('Could not upload the worker stats', exc_info=True)
+        else:
+            cache.mark_uploaded(self.worker_id, fingerprint)
 
     def job_loop(self):
         """
@@ -90,6 +166,7 @@ class Worker(object):
         bs = self.bs
         worker_idle = False
         while 1:
+            poll_start = time.time()
             try:
                 job_data = bs.pop_build_job(self.config.username,
                                             self.config.queue,
@@ -105,11 +182,12 @@ class Worker(object):
                            "Did someone remove it manually?")
                     raise errors.BinstarError(msg)
 
-            except requests.ConnectionError as err:
+            except (requests.ConnectionError, requests.Timeout) as err:
                 log.error("Trouble connecting to binstar at '{0}' ".format(bs.domain))
                 log.error("Could not retrieve work items")
                 job_data = {}
                 self.write_status(False, "Trouble connecting to binstar")
+                metrics.POLLS.inc(result='error')
 
             except errors.ServerError as err:
                 log.exception(err)
@@ -117,8 +195,12 @@ class Worker(object):
                 log.error("Could not retrieve work items")
                 self.write_status(False, "Server error")
                 job_data = {}
+                metrics.POLLS.inc(result='error')
             else:
                 self.write_status(True)
+                metrics.POLLS.inc(result='empty' if job_data.get('job') is None else 'job')
+            finally:
+                metrics.POLL_DURATION.observe(time.time() - poll_start)
 
             if job_data.get('job') is None:
                 if not worker_idle:
@@ -141,6 +223,11 @@ class Worker(object):
         Handle a single build job
         only catches build script level errors
         """
+        if self.live_status:
+            self.live_status.start_job(job_data)
+        metrics.JOBS_STARTED.inc()
+        metrics.SLOTS_BUSY.inc()
+        start_time = time.time()
 
         try:
             failed, status = self.build(job_data)
@@ -156,29 +243,46 @@ class Worker(object):
             status = 'error'
             self._finish_job(job_data, failed, status)
             raise
+        finally:
+            metrics.SLOTS_BUSY.dec()
+            metrics.JOB_DURATION.observe(time.time() - start_time)
 
         self._finish_job(job_data, failed, status)
 
 
     def _finish_job(self, job_data, failed, status):
         bs = self.bs
+        if self.live_status:
+            self.live_status.finish_job(job_data, status)
+        metrics.JOBS_FINISHED.inc(status=status)
 
-        if self.args.push_back:
-            bs.push_build_job(
-                self.config.username,
-                self.config.queue,
-                self.worker_id,
-                job_data['job']['_id']
-            )
-        else:
-            job_data = bs.finish_build(
-                self.config.username,
-                self.config.queue,
-                self.worker_id,
-                job_data['job']['_id'],
-                failed=failed,
-                status=status
-            )
+        try:
+            if self.args.push_back:
+                bs.push_build_job(
+                    self.config.username,
+                    self.config.queue,
+                    self.worker_id,
+                    job_data['job']['_id']
+                )
+            else:
+                extra = {}
+                if job_data.get('timings'):
+                    extra['timings'] = job_data['timings']
+
+                bs.finish_build(
+                    self.config.username,
+                    self.config.queue,
+                    self.worker_id,
+                    job_data['job']['_id'],
+                    failed=failed,
+                    status=status,
+                    **extra
+                )
+        except (requests.ConnectionError, requests.Timeout, errors.ServerError):
+            # Go on with the next job rather than exit the worker
+            log.error("Could not finish the job {0} on binstar at '{1}'".format(
+                job_data['job']['_id'], bs.domain), exc_info=True)
+            self.write_status(False, "Could not finish the job")
 
     def work_forever(self):
         """
@@ -187,6 +291,23 @@ class Worker(object):
         """
         log.info('Working Forever')
 
+        metrics.SLOTS.set(self.concurrency)
+        metrics_server = metrics.serve(self.metrics_port) if self.metrics_port else None
+        if self.telemetry:
+            self.telemetry.start()
+        try:
+            self.work()
+        finally:
+            if self.telemetry:
+                self.telemetry.stop()
+            if metrics_server:
+                metrics_server.shutdown()
+                metrics_server.server_close()
+
+    def work(self):
+        '''
+        Build the jobs of the build queue one after the other
+        '''
         with open(self.JOURNAL_FILE, 'a') as journal:
             for job_data in self.job_loop():
                 with self.job_context(journal, job_data):
@@ -252,6 +373,7 @@ class Worker(object):
             job_id,
             filename=self.build_logfile(job_data),
             quiet=quiet,
+            batch=self.log_batch,
         )
 
         build_log.update_metadata({'section': 'dequeue_build'})
@@ -266,12 +388,6 @@ class Worker(object):
 
             # build_log.flush()
 
-            script_filename = script_generator.gen_build_script(
-                staging_dir,
-                working_dir,
-                job_data,
-                conda_build_dir=self.args.conda_build_dir)
-
             iotimeout = instructions.get('iotimeout', DEFAULT_IO_TIMEOUT)
             timeout = self.args.timeout
 
@@ -283,15 +399,38 @@ class Worker(object):
             else:
                 build_filename = None
 
+            fingerprint, cached_files = self.build_cache_lookup(job_data, build_filename)
+
+            script_filename = script_generator.gen_build_script(
+                staging_dir,
+                working_dir,
+                job_data,
+                conda_build_dir=self.args.conda_build_dir,
+                cached_files=cached_files,
+                **self.build_script_context())
+
             exit_code = self.run(
                 job_data, script_filename, build_log, timeout, iotimeout, api_token,
                 git_oauth_token, build_filename, instructions=instructions,
                 build_was_stopped_by_user=build_log.terminated)
             log.info("Build script exited with code {0}".format(exit_code))
+
+            test_only = job_data['build_info'].get('test_only', False)
+            if self.upload_jobs and exit_code == script_generator.EXIT_CODE_OK and not test_only:
+                exit_code = self.upload_build_targets(job_data, build_log, api_token, cached_files)
+
+            build_log.write_timing_summary()
+            job_data['timings'] = build_log.timings
+            for step in build_log.timings:
+                if step['command'] is None and step['section']:
+                    metrics.PHASE_DURATION.observe(step['duration'], section=step['section'])
+
             if exit_code == script_generator.EXIT_CODE_OK:
                 failed = False
                 status = 'success'
                 log.info('Build {0} Succeeded'.format(job_data['job_name']))
+                if fingerprint and not cached_files:
+                    self.build_cache_store(job_data, fingerprint)
             elif exit_code == script_generator.EXIT_CODE_ERROR:
                 failed = True
                 status = 'error'
@@ -307,6 +446,117 @@ class Worker(object):
                     exit_code, job_data['job_name']))
             return failed, status
 
+    def build_script_context(self):
+        '''
+        Worker specific variables of the build script template
+        '''
+        return {'native_upload': bool(self.upload_jobs)}
+
+    def build_cache_lookup(self, job_data, build_filename):
+        '''
+        Find the build targets of a previous successful build with
+        the same inputs as this job
+
+        :return: (fingerprint, cached_files) both are None if the build cache
+                 is disabled or the build can not be cached, cached_files is
+                 None on a cache miss
+        '''
+        if not self.build_cache:
+            return None, None
+
+        fingerprint = self.build_cache.fingerprint(job_data, build_filename)
+        if fingerprint is None:
+            log.info('Not using the build cache, the source of the build is unknown')
+            return None, None
+
+        cached_files = self.build_cache.lookup(fingerprint)
+        if cached_files:
+            log.info('Build cache hit {0}: reusing {1} build targets'.format(
+                fingerprint, len(cached_files)))
+            metrics.CACHE_LOOKUPS.inc(cache='build', result='hit')
+        else:
+            log.info('Build cache miss {0}'.format(fingerprint))
+            metrics.CACHE_LOOKUPS.inc(cache='build', result='miss')
+
+        return fingerprint, cached_files
+
+    def build_cache_store(self, job_data, fingerprint):
+        '''
+        Copy the build targets of a successful build into the build cache
+        '''
+        build_targets = self.build_targets(job_data)
+        if not build_targets:
+            return
+
+        try:
+            self.build_cache.store(fingerprint, build_targets)
+        except (IOError, OSError):
+            log.warn('Could not store the build targets in the build cache', exc_info=True)
+
+    def build_targets(self, job_data):
+        '''
+        The files matching the build targets of a finished build
+        '''
+        context = {'conda_build_dir': self.args.conda_build_dir}
+        files = script_generator.get_files(context, job_data)
+        source_dir = script_generator.get_source_dir(self.staging_dir(job_data), job_data)
+        return script_generator.expand_files(files, source_dir)
+
+    def upload_build_targets(self, job_data, build_log, api_token, cached_files=None):
+        '''
+        Upload the build targets of a successful build with up to
+        `args.upload_jobs` uploads in flight
+
+        :return: the exit code of the build after the upload
+        '''
+        build_log.flush()
+        build_log.update_metadata({'section': 'upload_build_targets', 'command': None})
+
+        def write(msg):
+            build_log.writeline(msg.encode('utf-8', 'replace'))
+
+        context = {'conda_build_dir': self.args.conda_build_dir}
+        if not cached_files and not script_generator.get_files(context, job_data):
+            write('No build targets specified\n')
+            return script_generator.EXIT_CODE_OK
+
+        build_targets = cached_files or self.build_targets(job_data)
+        if not build_targets:
+            write('No files match the build targets {0}\n'.format(
+                ' '.join(script_generator.get_files(context, job_data))))
+            return script_generator.EXIT_CODE_ERROR
+
+        job_uploader = uploader.Uploader(
+            self.bs, api_token,
+            owner=job_data['owner']['login'],
+            package=job_data['package']['name'],
+            labels=script_generator.get_label_list(job_data),
+            build_id=job_data['build_item_info']['build_no'],
+            force=bool(script_generator.get_force_upload(job_data)),
+            jobs=self.upload_jobs)
+
+        write('Uploading {0} build targets ({1} at a time)\n'.format(
+            len(build_targets), min(self.upload_jobs, len(build_targets))))
+
+        start = time.time()
+        failed = 0
+        total_size = 0
+        for result in job_uploader.upload(build_targets):
+            write(uploader.format_result(result))
+            if result['error']:
+                failed += 1
+            else:
+                total_size += result['size']
+        build_log.flush()
+
+        duration = time.time() - start
+        write('Uploaded {0} of {1} build targets ({2:.1f} MB) in {3:.1f}s\n'.format(
+            len(build_targets) - failed, len(build_targets), float(total_size) / uploader.MB, duration))
+
+        if failed:
+            return script_generator.EXIT_CODE_ERROR
+        return script_generator.EXIT_CODE_OK
+
     def run(self, build_data, script_filename, build_log, timeout, iotimeout, api_token=None,
             git_oauth_token=None, build_filename=None, instructions=None,
             build_was_stopped_by_user=lambda:None):
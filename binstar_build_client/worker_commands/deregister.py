@@ -24,9 +24,12 @@ def main(args, context="worker"):
 
     bs = get_binstar(args, cls=BinstarBuildAPI)
     if args.all:
-        WorkerConfiguration.deregister_all(bs)
+        WorkerConfiguration.deregister_all(bs, jobs=args.jobs)
+    elif len(args.worker_id) > 1:
+        workers = [WorkerConfiguration.load(worker_id, bs) for worker_id in args.worker_id]
+        WorkerConfiguration.deregister_many(bs, workers, jobs=args.jobs)
     elif args.worker_id:
-        wconfig = WorkerConfiguration.load(args.worker_id, bs)
+        wconfig = WorkerConfiguration.load(args.worker_id[0], bs)
         wconfig.deregister(bs)
     else:
         log.info(context_info)
@@ -40,11 +43,13 @@ def add_parser(subparsers, name='deregister',
                                    help=description, description=description,
                                    epilog=epilog)
     parser.add_argument('worker_id',
-                        help="Worker id to deregister",
-                        nargs="?")
+                        help="Worker ids or names to deregister",
+                        nargs="*")
     parser.add_argument('-a','--all',
                         help="Deregister all workers " +\
                              "registered by this hostname {}.".format(platform.node()),
                         action="store_true")
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=8,
+                        help="Send up to N removals at once (default: %(default)s)")
     parser.set_defaults(main=default_func)
     return parser
@@ -6,16 +6,19 @@ from __future__ import (print_function, unicode_literals, division,
     absolute_import)
 
 import logging
+import os
 
 from binstar_client import errors
 from binstar_client.utils import get_binstar
 from clyent.logs import setup_logging
 
 from binstar_build_client import BinstarBuildAPI
+from binstar_build_client.mixins.transport import DEFAULT_POOL_SIZE
 from binstar_build_client.worker.docker_worker import DockerWorker
 from binstar_build_client.worker_commands.run import add_parser as add_worker_parser
 from binstar_build_client.worker_commands.run import WRONG_HOSTNAME_MSG
 from binstar_build_client.worker.register import WorkerConfiguration
+from binstar_build_client.worker.utils.worker_status import WorkerStatus
 
 try:
     import docker
@@ -31,7 +34,9 @@ def main(args):
                                "Run:\n\tpip install docker-py")
 
     bs = get_binstar(args, cls=BinstarBuildAPI)
-    worker_config = WorkerConfiguration.load(args.worker_id, bs, warn=True)
+    bs.configure_transport(retries=args.http_retries)
+    worker_config = WorkerConfiguration.load(args.worker_id, bs, warn=True,
+                                             ttl=args.registry_ttl)
     WorkerConfiguration.validate_worker_name(bs, args.worker_id)
     if worker_config.hostname != WorkerConfiguration.HOSTNAME:
         log.warn(WRONG_HOSTNAME_MSG.format(worker_config.hostname,
@@ -41,8 +46,13 @@ def main(args):
                   args.color, show_tb=args.show_traceback)
 
     worker = DockerWorker(bs, worker_config, args)
-    worker.write_stats()
-    worker.work_forever()
+    # Each build slot polls, streams its log and fetches its source at once
+    bs.configure_transport(pool_size=args.http_pool_size or
+                           max(DEFAULT_POOL_SIZE, 4 * worker.concurrency))
+    worker.live_status = WorkerStatus(worker_config.status_file, worker_config.to_dict())
+    with worker_config.running():
+        worker.write_stats()
+        worker.work_forever()
 
 def add_parser(subparsers):
     description = 'Run a build worker in a docker container to build jobs off of a binstar build queue'
@@ -56,6 +66,48 @@ def add_parser(subparsers):
                         )
     dgroup.add_argument('--allow-user-images', action='store_true', default=False,
                         help="Allow user defined images")
+    dgroup.add_argument('--user-image-ttl', metavar='SECONDS', type=int, default=600,
+                        help="Do not pull a user defined image again if it was pulled less "
+                             "than SECONDS ago (default: %(default)s)")
+    dgroup.add_argument('--user-image-budget', metavar='GB', type=float, default=20,
+                        help="Remove the least recently used user defined images when they "
+                             "take more than GB gigabytes (default: %(default)s)")
+    dgroup.add_argument('--container-pool', metavar='N', type=int, default=0,
+                        help="Keep N containers of the image created ahead of the next builds, "
+                             "and remove finished containers in the background "
+                             "(default: disabled)")
+    dgroup.add_argument('--bind-staging', action='store_true', default=False,
+                        help="Bind mount the staging directory of a build read-only into its "
+                             "container instead of copying the build script and source into it. "
+                             "The docker daemon must run on this host")
+    dgroup.add_argument('--conda-pkgs-volume', metavar='DIR', type=os.path.abspath,
+                        help="Share a conda package cache and pip cache in DIR between the "
+                             "containers of all builds (default: disabled). "
+                             "The docker daemon must run on this host")
+    dgroup.add_argument('--conda-pkgs-volume-size', metavar='GB', type=float, default=20,
+                        help="Evict the least recently used packages when the package cache "
+                             "grows over GB gigabytes (default: %(default)s)")
+    dgroup.add_argument('--concurrency', metavar='N', type=int, default=1,
+                        help="Run up to N builds at once, each in its own container and "
+                             "staging directory (default: %(default)s)")
+
+    rgroup = parser.add_argument_group(
+        'container resource limits',
+        "The limits of every build container. A build may lower them in the 'resources' "
+        "section of its .binstar.yml, e.g. 'resources: {cpus: 2, memory: 4g}', "
+        "it cannot raise them")
+    rgroup.add_argument('--cpus', metavar='N', type=float,
+                        help="Number of CPUs, e.g. 1.5 (default: no limit)")
+    rgroup.add_argument('--cpu-shares', metavar='N', type=int,
+                        help="Relative CPU weight (default: no limit)")
+    rgroup.add_argument('--memory', metavar='SIZE',
+                        help="Memory limit, e.g. 4g (default: no limit)")
+    rgroup.add_argument('--memory-swap', metavar='SIZE',
+                        help="Memory plus swap limit, e.g. 8g (default: no limit)")
+    rgroup.add_argument('--pids-limit', metavar='N', type=int,
+                        help="Maximum number of processes (default: no limit)")
+    rgroup.add_argument('--tmpfs', metavar='PATH[:OPTIONS]', action='append',
+                        help="Mount a tmpfs at PATH, e.g. /tmp:size=1g, may be repeated")
 
     parser.set_defaults(main=main,
                         platform="linux-64",
@@ -6,37 +6,73 @@ anaconda worker list
 from __future__ import (print_function, unicode_literals, division,
     absolute_import)
 
+from multiprocessing.pool import ThreadPool
+import json
 import logging
 
 from binstar_build_client.worker.register import WorkerConfiguration
 from binstar_client.utils import get_binstar
 from binstar_build_client import BinstarBuildAPI
 from binstar_build_client.worker.register import split_queue_arg
+from binstar_build_client.worker.utils.worker_status import read_status, summarize, format_summary
 
 log = logging.getLogger('binstar.build')
 
-def print_registered_workers(bs, args):
+# Status files read at once
+STATUS_READERS = 16
 
-    has_workers = False
 
-    log.info('Registered workers:')
+def worker_statuses(workers, running):
+    '''
+    The summaries of the live status of `workers`, read concurrently
+
+    :param running: the pids of the running workers by name
+    '''
+    def status(wconfig):
+        pid = running.get(wconfig.name)
+        return summarize(read_status(wconfig.status_file) if pid is not None else None, pid)
+
+    if not workers:
+        return []
+    pool = ThreadPool(min(len(workers), STATUS_READERS))
+    try:
+        return pool.map(status, workers)
+    finally:
+        pool.close()
+
+
+def print_registered_workers(bs, args):
+
     if args.queue:
         user, args.queue = split_queue_arg(args.queue)
+
+    workers = []
     for wconfig in WorkerConfiguration.registered_workers(bs):
-        has_workers = True
         if args.this_host_only and wconfig.hostname != WorkerConfiguration.HOSTNAME:
             continue
         if args.queue and args.queue != wconfig.queue:
             continue
         if args.org and args.org != wconfig.username:
             continue
+        workers.append(wconfig)
+
+    running = WorkerConfiguration.running_workers()
+    statuses = worker_statuses(workers, running)
+
+    if args.json:
+        print(json.dumps([dict(wconfig.to_dict(), status=status)
+                          for wconfig, status in zip(workers, statuses)], indent=2))
+        return
+
+    log.info('Registered workers:')
+    for wconfig, status in zip(workers, statuses):
         msg = '{name}, id:{worker_id}, hostname:{hostname}, queue:{username}/{queue}'.format(**wconfig.to_dict())
-        if wconfig.pid:
-            msg += ' (running with pid: {})'.format(wconfig.pid)
+        if status['running']:
+            msg += ' ({})'.format(format_summary(status))
 
         log.info(msg)
 
-    if not has_workers:
+    if not workers:
         log.info('(No registered workers)')
 
 def main(args):
@@ -61,6 +97,9 @@ def add_parser(subparsers, name='list',
     parser.add_argument('--queue',
                         '-q',
                         help="Print only workers registered to this queue.")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the workers and the live status of the workers "
+                             "running on this host as JSON.")
     parser.set_defaults(main=main)
 
     return parser
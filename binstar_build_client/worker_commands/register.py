@@ -13,6 +13,7 @@ from binstar_client import errors
 from binstar_client.utils import get_binstar
 from binstar_build_client.utils.validate_name import is_valid_name
 from binstar_build_client import BinstarBuildAPI
+from binstar_build_client.worker import bulk
 from binstar_build_client.worker.register import (WorkerConfiguration,
                                                   split_queue_arg)
 
@@ -60,16 +61,42 @@ def main(args):
                                   ' with a letter and contain'
                                   ' only numbers, letters, -, and _'.format(args.name))
 
+    if args.count > 1:
+        return register_many(bs, args)
+
     worker_config = WorkerConfiguration.register(
         bs, args.username, args.queue,
         args.platform, args.hostname, args.dist,
         name=args.name,
     )
 
-    log.info('When running, worker PID files will be at {}.<PID>.'.format(worker_config.filename))
+    log.info('When running, the worker holds a lock on {}.'.format(worker_config.lock_file))
     log.info('Now run:\n\tanaconda worker run {}'.format(worker_config.name))
 
 
+def register_many(bs, args):
+    '''
+    Register --count workers, named NAME-1 to NAME-COUNT with --name
+    '''
+    if args.name:
+        names = ['{}-{}'.format(args.name, i) for i in range(1, args.count + 1)]
+    else:
+        names = [None] * args.count
+
+    results = WorkerConfiguration.register_many(
+        bs, args.username, args.queue,
+        args.platform, args.hostname, args.dist,
+        names, jobs=args.jobs,
+    )
+    for line in bulk.format_results(results, 'registered'):
+        log.info(line)
+
+    failed = [result for result in results if result['error'] is not None]
+    if failed:
+        raise errors.BinstarError('Failed to register {} of {} workers'.format(
+            len(failed), len(results)))
+
+
 def add_parser(subparsers, name='register',
                description='Register a build worker to build jobs off of a binstar build queue',
                epilog=__doc__,
@@ -87,6 +114,13 @@ def add_parser(subparsers, name='register',
     parser.add_argument('-n', '--name', metavar='WORKER_NAME',
                         help='Unique name of the worker')
 
+    parser.add_argument('--count', metavar='N', type=int, default=1,
+                        help='Register N workers, named WORKER_NAME-1 to WORKER_NAME-N '
+                             'with --name (default: %(default)s)')
+
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=8,
+                        help='Send up to N registrations at once with --count (default: %(default)s)')
+
     parser.add_argument('-p', '--platform',
                         default=conda_platform,
                         help='The platform this worker is running on (default: %(default)s)')
@@ -13,9 +13,11 @@ from clyent.logs import setup_logging
 from binstar_client.utils import get_binstar
 
 from binstar_build_client import BinstarBuildAPI
+from binstar_build_client.mixins.transport import DEFAULT_RETRIES
 from binstar_build_client.utils import get_conda_root_prefix
 from binstar_build_client.worker.worker import Worker
 from binstar_build_client.worker.register import WorkerConfiguration
+from binstar_build_client.worker.utils.worker_status import WorkerStatus
 
 log = logging.getLogger('binstar.build')
 
@@ -24,14 +26,28 @@ WRONG_HOSTNAME_MSG = 'Proceeding with worker id registered for ' + \
                      'This host is: {}.'
 
 
+def default_conda_build_dir():
+    '''
+    The conda build directory of the conda installation running this worker
+    '''
+    conda_prefix = get_conda_root_prefix()
+    if conda_prefix:
+        return os.path.join(conda_prefix, 'conda-bld', '{platform}')
+
+
 def main(args):
     bs = get_binstar(args, cls=BinstarBuildAPI)
-    worker_config = WorkerConfiguration.load(args.worker_id, bs, warn=True)
+    bs.configure_transport(pool_size=args.http_pool_size, retries=args.http_retries)
+    worker_config = WorkerConfiguration.load(args.worker_id, bs, warn=True,
+                                             ttl=args.registry_ttl)
     WorkerConfiguration.validate_worker_name(bs, args.worker_id)
     if worker_config.hostname != WorkerConfiguration.HOSTNAME:
         log.warn(WRONG_HOSTNAME_MSG.format(worker_config.hostname,
                                            WorkerConfiguration.HOSTNAME))
-    args.conda_build_dir = args.conda_build_dir.format(platform=worker_config.platform)
+    if args.conda_build_dir is None:
+        args.conda_build_dir = default_conda_build_dir()
+    if args.conda_build_dir:
+        args.conda_build_dir = args.conda_build_dir.format(platform=worker_config.platform)
 
     setup_logging(logging.getLogger('binstar_build_client'), args.log_level,
                   args.color, show_tb=args.show_traceback)
@@ -40,15 +56,17 @@ def main(args):
     log.info(str(worker_config))
 
     worker = Worker(bs, worker_config, args)
-
-    worker.write_status(True, "Starting")
-    worker.write_stats()
-
-    try:
-        with worker_config.running():
+    worker.live_status = WorkerStatus(worker_config.status_file, worker_config.to_dict())
+
+    # Only the worker holding the lock writes the status and the stats, a
+    # second run of a running worker must not overwrite them
+    with worker_config.running():
+        worker.write_status(True, "Starting")
+        worker.write_stats()
+        try:
             worker.work_forever()
-    finally:
-        worker.write_status(False, "Exited")
+        finally:
+            worker.write_status(False, "Exited")
 
 
 def add_parser(subparsers, name='run',
@@ -72,14 +90,10 @@ def add_parser(subparsers, name='run',
 
     dgroup = parser.add_argument_group('development options')
 
-    conda_prefix = get_conda_root_prefix()
-    if conda_prefix:
-        default_build_dir = os.path.join(conda_prefix, 'conda-bld', '{platform}')
-    else:
-        default_build_dir = None
     dgroup.add_argument("--conda-build-dir",
-                        default=default_build_dir,
-                        help="[Advanced] The conda build directory (default: %(default)s)",
+                        default=None,
+                        help="[Advanced] The conda build directory "
+                             "(default: CONDA_ROOT/conda-bld/PLATFORM)",
                         )
 
     dgroup.add_argument('--show-new-procs', action='store_true', dest='show_new_procs',
@@ -90,9 +104,52 @@ def add_parser(subparsers, name='run',
                         help='If given, binstar will update this file with the ' + \
                              'time it last checked the anaconda server for updates')
 
+    parser.add_argument('--registry-ttl', metavar='SECONDS', type=int, default=0,
+                        help='Reuse the list of registered workers fetched by another worker '
+                             'of this host less than SECONDS ago, to start many workers at once '
+                             '(default: disabled)')
+
+    parser.add_argument('--telemetry-interval', metavar='SECONDS', type=float, default=0,
+                        help='Sample the load, CPU, memory and free disk of this host every '
+                             'SECONDS seconds into ~/.anaconda-build/telemetry (default: disabled)')
+
+    parser.add_argument('--telemetry-upload', action='store_true',
+                        help='Upload the recent host samples with the worker stats '
+                             'every 15 minutes, requires --telemetry-interval')
+
+    parser.add_argument('--metrics-port', metavar='PORT', type=int,
+                        help='Serve Prometheus metrics of this worker at '
+                             'http://127.0.0.1:PORT/metrics (default: disabled)')
+
+    parser.add_argument('--http-pool-size', metavar='N', type=int,
+                        help='Keep up to N connections to the server alive '
+                             '(default: 10, or 4 per build slot)')
+
+    parser.add_argument('--http-retries', metavar='N', type=int, default=DEFAULT_RETRIES,
+                        help='Retry the requests that failed to connect, and the idempotent '
+                             'requests that failed, up to N times (default: %(default)s)')
+
     parser.add_argument('--cwd', default=os.path.abspath('.'), type=os.path.abspath,
                         help='The root directory this build should use (default: "%(default)s")')
 
+    parser.add_argument('--build-cache', metavar='DIR', type=os.path.abspath,
+                        help='Reuse the build targets of previous successful builds with '
+                             'the same source, engine, env and instructions. '
+                             'The build targets are cached in DIR (default: disabled)')
+
+    parser.add_argument('--build-cache-size', metavar='GB', type=float, default=20,
+                        help='Evict the least recently used build targets of the build cache '
+                             'when it grows over GB gigabytes (default: %(default)s)')
+
+    parser.add_argument('--upload-jobs', metavar='N', type=int, default=0,
+                        help='Upload the build targets from the worker with up to N uploads '
+                             'in flight, instead of running `anaconda upload` once per file '
+                             'in the build script (default: disabled)')
+
+    parser.add_argument('--log-batch', action='store_true',
+                        help='Send the build log in compressed batches, one request every '
+                             '10 seconds, instead of one request per line of output')
+
     parser.add_argument('-t', '--max-job-duration', type=int, metavar='SECONDS',
                         dest='timeout',
                         help='Force jobs to stop after they exceed duration (default: %(default)s)', default=60 * 60)
@@ -1,12 +1,37 @@
+import os
+import runpy
+
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 import versioneer
 
 
+cmdclass = versioneer.get_cmdclass()
+_build_py = cmdclass.get('build_py', build_py)
+
+
+class build_py_precompile(_build_py):
+    '''Precompile the build script templates if jinja2 is available'''
+
+    def run(self):
+        _build_py.run(self)
+        try:
+            import jinja2
+        except ImportError:
+            return
+
+        templates = runpy.run_path(os.path.join('binstar_build_client', 'worker', 'utils', 'templates.py'))
+        data_dir = os.path.join(self.build_lib, 'binstar_build_client', 'worker', 'utils', 'data')
+        templates['precompile_templates'](data_dir)
+
+
+cmdclass['build_py'] = build_py_precompile
+
 setup(
     name='anaconda-build',
 
     version=versioneer.get_version(),
-    cmdclass=versioneer.get_cmdclass(),
+    cmdclass=cmdclass,
 
     author='Sean Ross-Ross',
     author_email='srossross@gmail.com',
@@ -15,7 +40,8 @@ setup(
     install_requires=['anaconda-client',
                       'jinja2', 'psutil'],
 
-    package_data={'binstar_build_client': ['worker/utils/data/*'], },
+    package_data={'binstar_build_client': ['worker/utils/data/*',
+                                           'worker/utils/data/compiled/*'], },
     include_package_data=True,
     zip_safe=False,
 